@@ -0,0 +1,114 @@
+"""
+Synchronous, batched version of the A3C training loop of train.py (A2C) on AI2ThorEnv.
+Instead of one env and one copy of the model per process, args.num_processes envs are run in their
+own subprocess by a VectorAI2ThorEnv and stepped in lockstep, while a single process runs the
+shared model (including the LSTMCell state of every env) on the [N, C, H, W] batch of observations.
+After args.num_steps steps, advantages are calculated with Generalized Advantage Estimation (GAE)
+over the [num_steps, N] rewards and values (see a3c_losses in train.py), and the shared model is
+optimised once for the whole rollout. Since there is a single learner, the shared model is trained
+directly and never copied.
+
+Episodes are reset automatically by the vector env, so rollouts always have num_steps steps and the
+LSTM states and returns of the envs whose episode finished are masked instead.
+"""
+
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+
+from algorithms.a3c.model import flat_gradients
+from algorithms.a3c.train import a3c_losses
+from gym_ai2thor.envs.vector_env import VectorAI2ThorEnv
+
+
+def train_a2c(args, shared_model, stats, optimizer=None, start_method=None):
+    torch.manual_seed(args.seed)
+
+    args.config_dict = {'max_episode_length': args.max_episode_length}
+    env = VectorAI2ThorEnv(args.num_processes, seed=args.seed, config_file=args.config_file,
+                           config_dict=args.config_dict, start_method=start_method)
+    num_envs = env.num_envs
+
+    if optimizer is None:
+        optimizer = optim.Adam(shared_model.parameters(), lr=args.lr)
+
+    model = shared_model
+    model.train()
+    # Zeroed in place instead of with optimizer.zero_grad, so that the gradients stay views of grad
+    grad = flat_gradients(model)
+
+    state = torch.from_numpy(env.reset())
+    cx = torch.zeros(num_envs, 256)
+    hx = torch.zeros(num_envs, 256)
+
+    # monitoring
+    episode_total_rewards_list = []
+    rewards_in_episode = torch.zeros(num_envs)
+
+    # Rollout buffers filled in place every rollout
+    rewards = torch.zeros(args.num_steps, num_envs)
+    masks = torch.ones(args.num_steps, num_envs)
+
+    try:
+        while True:
+            cx = cx.detach()
+            hx = hx.detach()
+
+            values = []
+            log_probs = []
+            entropies = []
+
+            for step in range(args.num_steps):
+                value, logit, (hx, cx) = model((state, (hx, cx)))
+                prob = F.softmax(logit, dim=-1)
+                log_prob = F.log_softmax(logit, dim=-1)
+                entropy = -(log_prob * prob).sum(1)
+                entropies.append(entropy)
+
+                action = prob.multinomial(num_samples=1).detach()
+                log_prob = log_prob.gather(1, action).squeeze(1)
+
+                state, reward, done, _ = env.step(action.squeeze(1).numpy())
+
+                stats.add(0, env_steps=num_envs)
+
+                state = torch.from_numpy(state)
+                rewards[step] = torch.from_numpy(reward)
+                # 0 for the envs whose episode finished, which are already reset by the vector env
+                # (a separate tensor, since writing into masks would invalidate the one saved for
+                # the backward pass of the masked LSTM state)
+                mask = torch.from_numpy(1. - done.astype('float32'))
+                masks[step] = mask
+                # The LSTM state of the new episodes starts from zeros
+                hx = hx * mask.unsqueeze(1)
+                cx = cx * mask.unsqueeze(1)
+
+                rewards_in_episode += rewards[step]
+                for rank in done.nonzero()[0]:
+                    episode_total_rewards_list.append(rewards_in_episode[rank].item())
+                    print('Episode Over in env {}. Total reward for episode: {}'.format(
+                        rank, rewards_in_episode[rank].item()))
+                rewards_in_episode *= mask
+
+                values.append(value.squeeze(1))
+                log_probs.append(log_prob)
+
+            # No interaction with environment below.
+            # Bootstrap the returns of the unfinished episodes with the predicted value
+            with torch.no_grad():
+                R, _, _ = model((state, (hx, cx)))
+
+            # Backprop and optimisation
+            policy_loss, value_loss = a3c_losses(args, torch.stack(values),
+                                                 torch.stack(log_probs), torch.stack(entropies),
+                                                 rewards, masks, R.squeeze(1))
+
+            grad.zero_()
+
+            (policy_loss + args.value_loss_coef * value_loss).backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
+
+            optimizer.step()
+            stats.add(0, updates=1)
+    finally:
+        env.close()
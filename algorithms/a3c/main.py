@@ -7,6 +7,8 @@ Example of use:
 
 Runs A3C on our AI2ThorEnv wrapper with default params (4 processes). Optionally it can be
 run on any atari environment as well using the --atari and --atari-env-name params.
+With --a2c, the same number of AI2ThorEnv processes are instead stepped in lockstep and trained in
+batches by a single process (synchronous A2C, see a2c.py).
 """
 
 from __future__ import print_function
@@ -20,7 +22,9 @@ import torch.multiprocessing as mp
 from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
 from algorithms.a3c.envs import create_atari_env
 from algorithms.a3c import my_optim
-from algorithms.a3c.model import ActorCritic
+from algorithms.a3c.a2c import train_a2c
+from algorithms.a3c.model import ActorCritic, FlatParameters
+from algorithms.a3c.stats import WorkerStats
 from algorithms.a3c.test import test
 from algorithms.a3c.train import train
 
@@ -52,12 +56,25 @@ parser.add_argument('--max-episode-length', type=int, default=1000,
                     help='maximum length of an episode (default: 1000000)')
 parser.add_argument('--no-shared', default=False,
                     help='use an optimizer without shared momentum.')
+parser.add_argument('--optimizer', type=str, default='adam', choices=['adam', 'rmsprop'],
+                    help='shared optimizer: SharedAdam or the Shared RMSProp of the A3C paper '
+                         '(default: adam)')
 parser.add_argument('-sync', '--synchronous', dest='synchronous', action='store_true',
                     help='Useful for debugging purposes e.g. import pdb; pdb.set_trace(). '
                          'Overwrites args.num_processes as everything is in main thread. '
                          '1 train() function is run and no test()')
 parser.add_argument('-async', '--asynchronous', dest='synchronous', action='store_false')
 parser.set_defaults(synchronous=False)
+parser.add_argument('--a2c', dest='a2c', action='store_true',
+                    help='Synchronous batched A2C: steps --num-processes AI2ThorEnv processes in '
+                         'lockstep and trains the shared model in batches in the main process')
+parser.add_argument('--pipelined-steps', action='store_true',
+                    help='Step the ai2thor env in a background thread while the log prob and '
+                         'entropy of the action are computed (A3C processes only). Off by default '
+                         'since it only pays off when the env steps are slow, e.g. with Unity '
+                         'rendering, and is slower than blocking steps with fast envs')
+parser.add_argument('--config-file', type=str, default='config_files/config_example.json',
+                    help='Config file used for ai2thor environment definition')
 
 # Atari arguments. Good example of keeping code modular and allowing algorithms to run everywhere
 parser.add_argument('--atari', dest='atari', action='store_true',
@@ -83,9 +100,11 @@ if __name__ == '__main__':
         args.frame_dim = 42  # fixed to be 42x42 in envs.py _process_frame42()
     else:
         args.config_dict = {'max_episode_length': args.max_episode_length}
-        env = AI2ThorEnv(config_dict=args.config_dict)
+        env = AI2ThorEnv(config_file=args.config_file, config_dict=args.config_dict)
         args.frame_dim = env.config['resolution'][-1]
     shared_model = ActorCritic(env.observation_space.shape[0], env.action_space.n, args.frame_dim)
+    # The parameters of the shared model are views of a single shared memory tensor
+    shared_parameters = FlatParameters(shared_model, share_memory=True)
     shared_model.share_memory()
 
     env.close()  # above env initialisation was only to find certain params needed
@@ -93,27 +112,39 @@ if __name__ == '__main__':
     if args.no_shared:
         optimizer = None
     else:
-        optimizer = my_optim.SharedAdam(shared_model.parameters(), lr=args.lr)
+        shared_optimizer = my_optim.SharedAdam if args.optimizer == 'adam' else \
+            my_optim.SharedRMSprop
+        optimizer = shared_optimizer(shared_model.parameters(), lr=args.lr)
         optimizer.share_memory()
 
     processes = []
 
-    counter = mp.Value('i', 0)
-    lock = mp.Lock()
+    # Env steps, updates and sync times written by each training process in its own slots
+    stats = WorkerStats(1 if args.a2c or args.synchronous else args.num_processes)
 
-    if not args.synchronous:
+    if args.a2c:
+        if args.atari:
+            raise NotImplementedError('A2C mode is only implemented for AI2ThorEnv')
         # test runs continuously and if episode ends, sleeps for args.test_sleep_time seconds
-        p = mp.Process(target=test, args=(args.num_processes, args, shared_model, counter))
+        p = mp.Process(target=test, args=(args.num_processes, args, shared_model, stats))
+        p.start()
+        processes.append(p)
+        train_a2c(args, shared_model, stats, optimizer)
+    elif not args.synchronous:
+        # test runs continuously and if episode ends, sleeps for args.test_sleep_time seconds
+        p = mp.Process(target=test, args=(args.num_processes, args, shared_model, stats))
         p.start()
         processes.append(p)
 
         for rank in range(0, args.num_processes):
-            p = mp.Process(target=train, args=(rank, args, shared_model, counter, lock, optimizer))
+            p = mp.Process(target=train, args=(rank, args, shared_model, shared_parameters,
+                                               stats, optimizer))
             p.start()
             processes.append(p)
         for p in processes:
             p.join()
     else:
         rank = 0
-        # test(args.num_processes, args, shared_model, counter)  # for checking test functionality
-        train(rank, args, shared_model, counter, lock, optimizer)  # run train on main thread
+        # test(args.num_processes, args, shared_model, stats)  # for checking test functionality
+        # run train on main thread
+        train(rank, args, shared_model, shared_parameters, stats, optimizer)
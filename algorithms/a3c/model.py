@@ -3,11 +3,12 @@ Adapted from: https://github.com/ikostrikov/pytorch-a3c/blob/master/model.py
 
 Main A3C model which outputs predicted value, action logits and hidden state.
 Includes helper functions too for weight initialisation and dynamically computing LSTM/flatten input
-size.
+size, and FlatParameters to sync the local models of the A3C processes with the shared model.
 """
 
 import numpy as np
 import torch
+import torch.multiprocessing as mp
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -101,6 +102,8 @@ class ActorCritic(torch.nn.Module):
         inputs, (hx, cx) = inputs
         if len(inputs.size()) == 3:  # if batch forgotten
             inputs = inputs.unsqueeze(0)
+        if inputs.dtype == torch.uint8:  # uint8 observations are normalised once here
+            inputs = inputs.float().div_(255)
         x = F.elu(self.conv1(inputs))
         x = F.elu(self.conv2(x))
         x = F.elu(self.conv3(x))
@@ -111,3 +114,76 @@ class ActorCritic(torch.nn.Module):
         x = hx
 
         return self.critic_linear(x), self.actor_linear(x), (hx, cx)
+
+
+def flat_gradients(model):
+    """
+    Makes the gradients of the parameters of model views of a single contiguous tensor, which is
+    returned. Backward passes accumulate into these views as long as they are zeroed in place, so
+    that the shared optimizers update all the parameters at once (see flat_view in my_optim.py)
+    """
+    params = list(model.parameters())
+    grad = torch.zeros(sum(param.numel() for param in params))
+    offset = 0
+    for param in params:
+        param.grad = grad[offset:offset + param.numel()].view_as(param)
+        offset += param.numel()
+    return grad
+
+
+class FlatParameters:
+    """
+    Keeps all the parameters of a model as views of a single contiguous tensor (and their gradients
+    as views of another one), so that the local model of each A3C process can be synced with the
+    shared model with a single copy_ instead of load_state_dict, and its gradients handed to the
+    shared model without copying them.
+
+    The FlatParameters of the shared model are created before starting the training processes with
+    share_memory=True. They also hold a version counter in shared memory, increased after every
+    optimiser step, so that the local copies are skipped when the shared parameters did not change.
+    """
+    def __init__(self, model, share_memory=False):
+        params = list(model.parameters())
+        num_params = sum(param.numel() for param in params)
+        self.data = torch.zeros(num_params)
+        # Gradients are never shared between processes, each one writes its own into the shared
+        # model (see push_gradients)
+        if share_memory:
+            self.data.share_memory_()
+            self.version = mp.Value('l', 0)
+        else:
+            self.version = None
+        self.synced_version = -1
+        offset = 0
+        for param in params:
+            size = param.numel()
+            self.data[offset:offset + size].copy_(param.data.view(-1))
+            param.data = self.data[offset:offset + size].view_as(param)
+            offset += size
+        self.grad = None if share_memory else flat_gradients(model)
+        self.grad_views = [] if share_memory else [param.grad for param in params]
+
+    def sync_with(self, shared_parameters):
+        """
+        Copies the shared parameters unless they did not change since the last copy
+        :return: (bool) whether the parameters were copied
+        """
+        version = shared_parameters.version.value
+        if version == self.synced_version:
+            return False
+        # Reading the version first so that updates during the copy are copied on the next sync
+        self.data.copy_(shared_parameters.data)
+        self.synced_version = version
+        return True
+
+    def zero_grad(self):
+        self.grad.zero_()
+
+    def push_gradients(self, shared_model):
+        """ Makes the gradients of the parameters of shared_model (in this process) these ones """
+        for shared_param, grad in zip(shared_model.parameters(), self.grad_views):
+            shared_param.grad = grad
+
+    def increment_version(self):
+        with self.version.get_lock():
+            self.version.value += 1
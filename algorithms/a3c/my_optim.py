@@ -5,7 +5,14 @@ In the original A3C paper (https://arxiv.org/abs/1602.01783), the authors compar
 optimizers i.e. Momentum SGD, RMSProp and Shared RMSProp (check final part of section 4). The
 difference between the 3rd compared to the 2nd is whether to compute shared statistics across all
 threads, which was found to be more robust. It seems the equivalent was implemented for Adam
-below.
+below, and Shared RMSProp is implemented as well.
+
+The statistics of all the parameters are kept in flat buffers (one per statistic) which are moved
+to shared memory with share_memory(). When the parameters and their gradients are themselves views
+of single contiguous tensors (see FlatParameters and flat_gradients in model.py), every statistic
+is updated with one vectorised operation over all the parameters per step. Otherwise the same
+operations are run on the views of the flat buffers of each parameter. As in the original Hogwild
+training, the processes update the shared statistics and parameters in place without locking.
 """
 
 import math
@@ -14,32 +21,72 @@ import torch
 import torch.optim as optim
 
 
-class SharedAdam(optim.Adam):
-    """Implements Adam algorithm with shared states.
+def flat_view(tensors):
+    """
+    1-D view of all the tensors if they are consecutive contiguous views of the same memory, e.g.
+    the parameters and gradients of FlatParameters, or None otherwise
     """
+    first = tensors[0]
+    num_elements = 0
+    for tensor in tensors:
+        if tensor is None or not tensor.is_contiguous() or tensor.dtype != first.dtype or \
+                tensor.data_ptr() != first.data_ptr() + num_elements * first.element_size():
+            return None
+        num_elements += tensor.numel()
+    return first.as_strided((num_elements, ), (1, ))
 
-    def __init__(self,
-                 params,
-                 lr=1e-3,
-                 betas=(0.9, 0.999),
-                 eps=1e-8,
-                 weight_decay=0):
-        super(SharedAdam, self).__init__(params, lr, betas, eps, weight_decay)
 
-        for group in self.param_groups:
-            for p in group['params']:
-                state = self.state[p]
-                state['step'] = torch.zeros(1)
-                state['exp_avg'] = p.data.new().resize_as_(p.data).zero_()
-                state['exp_avg_sq'] = p.data.new().resize_as_(p.data).zero_()
+class SharedOptimizer(optim.Optimizer):
+    """
+    Base class of the shared optimizers. Subclasses define the names of their flat statistics in
+    STATISTICS and the update of the parameters in _update, which is called once with flat tensors
+    of all the parameters if possible, or else once per parameter with its views
+    """
+    STATISTICS = ()
+
+    def __init__(self, params, defaults):
+        super(SharedOptimizer, self).__init__(params, defaults)
+        if len(self.param_groups) != 1:
+            raise ValueError('{} only supports a single group of parameters'.format(
+                type(self).__name__))
+        self.params = self.param_groups[0]['params']
+        self.num_elements = sum(p.numel() for p in self.params)
+        # Number of steps done by all the processes
+        self.step_count = torch.zeros(1)
+        self.statistics = {name: self.params[0].data.new_zeros(self.num_elements)
+                           for name in self.STATISTICS}
+        # Views of the flat buffers of each parameter, also kept in self.state for inspection
+        self.views = {name: [] for name in self.STATISTICS}
+        for p, offset in zip(self.params, self.offsets()):
+            state = self.state[p]
+            state['step'] = self.step_count
+            for name in self.STATISTICS:
+                state[name] = self.statistics[name][offset:offset + p.numel()].view_as(p)
+                self.views[name].append(state[name])
+        # Scratch buffer for intermediate results, e.g. Adam's denominator, and its views. It is
+        # allocated by the first step of each process so that the processes never share it
+        self.buffer, self.buffer_views = None, None
+
+    def offsets(self):
+        """ Offset of each parameter in the flat buffers """
+        offsets, offset = [], 0
+        for p in self.params:
+            offsets.append(offset)
+            offset += p.numel()
+        return offsets
 
     def share_memory(self):
-        for group in self.param_groups:
-            for p in group['params']:
-                state = self.state[p]
-                state['step'].share_memory_()
-                state['exp_avg'].share_memory_()
-                state['exp_avg_sq'].share_memory_()
+        self.step_count.share_memory_()
+        for statistic in self.statistics.values():
+            statistic.share_memory_()
+
+    def __getstate__(self):
+        # optim.Optimizer only pickles its defaults, state and param_groups, which would lose the
+        # flat statistics when the optimizer is passed to spawned processes. The scratch buffer is
+        # left out so that every process allocates its own
+        state = dict(self.__dict__)
+        state['buffer'], state['buffer_views'] = None, None
+        return state
 
     def step(self, closure=None):
         """Performs a single optimization step.
@@ -51,32 +98,89 @@ class SharedAdam(optim.Adam):
         if closure is not None:
             loss = closure()
 
-        for group in self.param_groups:
-            for p in group['params']:
-                if p.grad is None:
-                    continue
-                grad = p.grad.data
-                state = self.state[p]
+        group = self.param_groups[0]
+        if self.buffer is None:
+            self.buffer = self.params[0].data.new_empty(self.num_elements)
+            self.buffer_views = [self.buffer[offset:offset + p.numel()].view_as(p)
+                                 for p, offset in zip(self.params, self.offsets())]
+        self.step_count += 1
+        step = self.step_count.item()
+        with torch.no_grad():
+            grads = [p.grad for p in self.params]
+            flat_params, flat_grads = flat_view(self.params), flat_view(grads)
+            if flat_params is not None and flat_grads is not None:
+                params, grads = [flat_params], [flat_grads]
+                statistics = {name: [self.statistics[name]] for name in self.STATISTICS}
+                buffers = [self.buffer]
+            else:
+                # Parameter by parameter, skipping the ones without gradient
+                used = [i for i, grad in enumerate(grads) if grad is not None]
+                params, grads = [self.params[i] for i in used], [grads[i] for i in used]
+                statistics = {name: [self.views[name][i] for i in used]
+                              for name in self.STATISTICS}
+                buffers = [self.buffer_views[i] for i in used]
+            for i, (param, grad) in enumerate(zip(params, grads)):
+                if group['weight_decay'] != 0:
+                    grad = grad.add(param, alpha=group['weight_decay'])
+                self._update(group, step, param, grad, buffers[i],
+                             *[statistics[name][i] for name in self.STATISTICS])
+        return loss
 
-                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
-                beta1, beta2 = group['betas']
+    def _update(self, group, step, param, grad, buffer, *statistics):
+        raise NotImplementedError
 
-                state['step'] += 1
 
-                if group['weight_decay'] != 0:
-                    grad = grad.add(group['weight_decay'], p.data)
+class SharedAdam(SharedOptimizer):
+    """Implements Adam algorithm with shared states.
+    """
+    STATISTICS = ('exp_avg', 'exp_avg_sq')
+
+    def __init__(self,
+                 params,
+                 lr=1e-3,
+                 betas=(0.9, 0.999),
+                 eps=1e-8,
+                 weight_decay=0):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        super(SharedAdam, self).__init__(params, defaults)
 
-                # Decay the first and second moment running average coefficient
-                exp_avg.mul_(beta1).add_(1 - beta1, grad)
-                exp_avg_sq.mul_(beta2).addcmul_(1 - beta2, grad, grad)
+    def _update(self, group, step, param, grad, denom, exp_avg, exp_avg_sq):
+        beta1, beta2 = group['betas']
 
-                denom = exp_avg_sq.sqrt().add_(group['eps'])
+        # Decay the first and second moment running average coefficient
+        exp_avg.lerp_(grad, 1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
 
-                bias_correction1 = 1 - beta1 ** state['step'].item()
-                bias_correction2 = 1 - beta2 ** state['step'].item()
-                step_size = group['lr'] * math.sqrt(
-                    bias_correction2) / bias_correction1
+        bias_correction1 = 1 - beta1 ** step
+        bias_correction2_sqrt = math.sqrt(1 - beta2 ** step)
+        # Same update as torch.optim.Adam, lr / bias_correction1 * m / (sqrt(v) /
+        # sqrt(bias_correction2) + eps), with sqrt(bias_correction2) moved out of the denominator
+        # to save a pass over all the parameters
+        torch.sqrt(exp_avg_sq, out=denom).add_(group['eps'] * bias_correction2_sqrt)
+        step_size = group['lr'] * bias_correction2_sqrt / bias_correction1
 
-                p.data.addcdiv_(-step_size, exp_avg, denom)
+        param.addcdiv_(exp_avg, denom, value=-step_size)
 
-        return loss
+
+class SharedRMSprop(SharedOptimizer):
+    """Implements RMSprop algorithm with shared statistics (Shared RMSProp of the A3C paper).
+    """
+    STATISTICS = ('square_avg', )
+
+    def __init__(self,
+                 params,
+                 lr=1e-2,
+                 alpha=0.99,
+                 eps=1e-8,
+                 weight_decay=0):
+        defaults = dict(lr=lr, alpha=alpha, eps=eps, weight_decay=weight_decay)
+        super(SharedRMSprop, self).__init__(params, defaults)
+
+    def _update(self, group, step, param, grad, avg, square_avg):
+        alpha = group['alpha']
+
+        square_avg.mul_(alpha).addcmul_(grad, grad, value=1 - alpha)
+
+        torch.sqrt(square_avg, out=avg).add_(group['eps'])
+
+        param.addcdiv_(grad, avg, value=-group['lr'])
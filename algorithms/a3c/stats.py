@@ -0,0 +1,51 @@
+"""
+Training statistics shared by the A3C processes (env steps, optimiser updates and time spent syncing
+with the shared model) without any lock. Every worker owns a row of slots of a shared memory array
+which only it writes, and the readers (e.g. the test process) sum the rows, in the same way as the
+env_steps of the Ape-X actors in algorithms/rainbow/apex.py.
+"""
+import time
+
+import torch.multiprocessing as mp
+
+
+class WorkerStats:
+    FIELDS = ('env_steps', 'updates', 'sync_seconds')
+
+    def __init__(self, num_workers, context=mp):
+        """
+        :param num_workers: (int) Number of rows, one for each process writing statistics
+        :param context:     multiprocessing context used to allocate the shared array
+        """
+        self.num_workers = num_workers
+        # Doubles count exactly up to 2^53 steps and are written atomically by a single worker
+        self.values = context.RawArray('d', num_workers * len(self.FIELDS))
+        self.start_time = time.time()
+
+    def add(self, rank, env_steps=0, updates=0, sync_seconds=0.):
+        """ Only called by the worker rank, which is the only writer of its row """
+        row = rank * len(self.FIELDS)
+        self.values[row] += env_steps
+        self.values[row + 1] += updates
+        self.values[row + 2] += sync_seconds
+
+    def worker(self, rank):
+        row = rank * len(self.FIELDS)
+        return dict(zip(self.FIELDS, self.values[row:row + len(self.FIELDS)]))
+
+    def total(self, field):
+        column = self.FIELDS.index(field)
+        return sum(self.values[column::len(self.FIELDS)])
+
+    def summary(self):
+        """ Env steps/s and updates/s since the start and the average sync time of each worker """
+        elapsed = time.time() - self.start_time
+        env_steps, updates = self.total('env_steps'), self.total('updates')
+        sync_times = []
+        for rank in range(self.num_workers):
+            worker = self.worker(rank)
+            sync_times.append(1e3 * worker['sync_seconds'] / max(worker['updates'], 1))
+        return 'env steps {:.0f} ({:.0f}/s), updates {:.0f} ({:.1f}/s), sync time per ' \
+               'update of each worker (ms) {}'.format(
+                   env_steps, env_steps / elapsed, updates, updates / elapsed,
+                   ' '.join('{:.2f}'.format(sync_time) for sync_time in sync_times))
@@ -17,14 +17,14 @@ from algorithms.a3c.envs import create_atari_env
 from algorithms.a3c.model import ActorCritic
 
 
-def test(rank, args, shared_model, counter):
+def test(rank, args, shared_model, stats):
     torch.manual_seed(args.seed + rank)
 
     if args.atari:
         env = create_atari_env(args.atari_env_name)
     else:
         args.config_dict = {'max_episode_length': args.max_episode_length}
-        env = AI2ThorEnv(config_dict=args.config_dict)
+        env = AI2ThorEnv(config_file=args.config_file, config_dict=args.config_dict)
     env.seed(args.seed + rank)
 
     model = ActorCritic(env.observation_space.shape[0], env.action_space.n, args.frame_dim)
@@ -55,7 +55,7 @@ def test(rank, args, shared_model, counter):
             hx = hx.detach()
 
         with torch.no_grad():
-            value, logit, (hx, cx) = model((state.unsqueeze(0).float(), (hx, cx)))
+            value, logit, (hx, cx) = model((state.unsqueeze(0), (hx, cx)))
         prob = F.softmax(logit, dim=-1)
         action = prob.max(1, keepdim=True)[1].numpy()
 
@@ -72,11 +72,14 @@ def test(rank, args, shared_model, counter):
             done = True
 
         if done:
-            print("Time {}, num steps over all threads {}, FPS {:.0f}, episode reward {}, episode length {}".format(
+            num_steps = stats.total('env_steps')
+            print("Time {}, num steps over all threads {:.0f}, FPS {:.0f}, episode reward {}, "
+                  "episode length {}".format(
                 time.strftime("%Hh %Mm %Ss",
                               time.gmtime(time.time() - start_time)),
-                counter.value, counter.value / (time.time() - start_time),
+                num_steps, num_steps / (time.time() - start_time),
                 reward_sum, episode_length))
+            print('Training stats: ' + stats.summary())
             reward_sum = 0
             episode_length = 0
             actions.clear()
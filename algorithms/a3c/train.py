@@ -4,48 +4,104 @@ Adapted from https://github.com/ikostrikov/pytorch-a3c/blob/master/train.py
 Contains the train code run by each A3C process on either Atari or AI2ThorEnv.
 For initialisation, we set up the environment, seeds, shared model and optimizer.
 In the main training loop, we always ensure the weights of the current model are equal to the
-shared model. Then the algorithm interacts with the environment args.num_steps at a time,
-i.e it sends an action to the env for each state and stores predicted values, rewards, log probs
-and entropies to be used for loss calculation and backpropagation.
+shared model, copying them with a single copy_ of their flattened parameters (see FlatParameters in
+model.py) if they changed since the last rollout. Then the algorithm interacts with the
+environment args.num_steps at a time, i.e it sends an action to the env for each state and stores
+predicted values, rewards, log probs and entropies to be used for loss calculation and
+backpropagation.
 After args.num_steps has passed, we calculate advantages, value losses and policy losses using
 Generalized Advantage Estimation (GAE) with the entropy loss added onto policy loss to encourage
-exploration. Once these losses have been calculated, we add them all together, backprop to find all
+exploration. Returns and advantages of the whole rollout are computed at once with a vectorised
+discounted cumulative sum (see discounted_cumsum) instead of a Python loop over the steps.
+Once these losses have been calculated, we add them all together, backprop to find all
 gradients and then optimise with Adam and we go back to the start of the main training loop.
 """
 
+import time
+
 import torch
 import torch.nn.functional as F
 import torch.optim as optim
 
 from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
 from algorithms.a3c.envs import create_atari_env
-from algorithms.a3c.model import ActorCritic
-
-
-def ensure_shared_grads(model, shared_model):
-    for param, shared_param in zip(model.parameters(),
-                                   shared_model.parameters()):
-        if shared_param.grad is not None:
-            return
-        shared_param._grad = param.grad
-
-
-def train(rank, args, shared_model, counter, lock, optimizer=None):
+from algorithms.a3c.model import ActorCritic, FlatParameters
+
+
+def discounted_cumsum(x, discounts, bootstrap=None):
+    """
+    Vectorised y_t = x_t + discounts_t * y_t+1 over the first (time) dimension of x, with
+    y_T = bootstrap (0 if None). With discounts = gamma * (1 - done), this gives the discounted
+    returns of a rollout, and with gamma * tau * (1 - done) applied to the TD errors, the GAE
+    advantages. Each output is a sum of inputs weighted by products of discounts:
+        y_i = sum_j≥i (discounts_i * ... * discounts_j-1) * x_j
+              + (discounts_i * ... * discounts_T-1) * bootstrap
+    which are computed with a T x T cumulative product, so the cost is a few kernels for the whole
+    rollout instead of a chain of tiny ops per step.
+    :param x:         (torch.Tensor) T or T x N values to accumulate
+    :param discounts: (torch.Tensor) Discount applied after each step, same shape as x
+    :param bootstrap: (torch.Tensor) N values after the last step
+    """
+    num_steps = x.shape[0]
+    # earlier[i, k] is True if k < i
+    earlier = torch.ones(num_steps, num_steps, dtype=torch.bool).tril(-1)
+    # products[i, k] = discounts_i * ... * discounts_k for k >= i (and 1 for k < i)
+    products = discounts.unsqueeze(0).expand((num_steps, ) + discounts.shape).clone()
+    products[earlier] = 1
+    products = products.cumprod(1)
+    # weights[i, j] = discounts_i * ... * discounts_j-1 for j >= i (and 0 for j < i)
+    weights = torch.cat([torch.ones_like(products[:, :1]), products[:, :-1]], 1)
+    weights[earlier] = 0
+    y = (weights * x.unsqueeze(0)).sum(1)
+    if bootstrap is not None:
+        y = y + products[:, -1] * bootstrap
+    return y
+
+
+def a3c_losses(args, values, log_probs, entropies, rewards, masks, next_value):
+    """
+    Policy (with entropy bonus) and value losses of a rollout of T steps of N envs, summed over the
+    steps and averaged over the envs
+    :param values:     (torch.Tensor) T x N predicted values
+    :param log_probs:  (torch.Tensor) T x N log probabilities of the actions taken
+    :param entropies:  (torch.Tensor) T x N policy entropies
+    :param rewards:    (torch.Tensor) T x N rewards
+    :param masks:      (torch.Tensor) T x N, 0 after the last step of an episode and 1 otherwise
+    :param next_value: (torch.Tensor) N values predicted after the last step (ignored if masked)
+    :return: (policy_loss, value_loss)
+    """
+    next_value = next_value.detach()
+    returns = discounted_cumsum(rewards, args.gamma * masks, next_value)
+    value_loss = (0.5 * (returns - values).pow(2)).sum(0).mean()
+
+    # Generalized Advantage Estimation
+    detached_values = values.detach()
+    next_values = torch.cat([detached_values[1:], next_value.unsqueeze(0)]) * masks
+    delta_t = rewards + args.gamma * next_values - detached_values
+    gae = discounted_cumsum(delta_t, args.gamma * args.tau * masks)
+
+    policy_loss = -(log_probs * gae).sum(0).mean() - args.entropy_coef * entropies.sum(0).mean()
+    return policy_loss, value_loss
+
+
+def train(rank, args, shared_model, shared_parameters, stats, optimizer=None):
     torch.manual_seed(args.seed + rank)
 
     if args.atari:
         env = create_atari_env(args.atari_env_name)
     else:
         args.config_dict = {'max_episode_length': args.max_episode_length}
-        env = AI2ThorEnv(config_dict=args.config_dict)
+        env = AI2ThorEnv(config_file=args.config_file, config_dict=args.config_dict)
     env.seed(args.seed + rank)
 
     model = ActorCritic(env.observation_space.shape[0], env.action_space.n, args.frame_dim)
+    parameters = FlatParameters(model)
 
     if optimizer is None:
         optimizer = optim.Adam(shared_model.parameters(), lr=args.lr)
 
     model.train()
+    pipelined_steps = args.pipelined_steps and not args.atari
 
     state = env.reset()
     state = torch.from_numpy(state)
@@ -57,11 +113,18 @@ def train(rank, args, shared_model, counter, lock, optimizer=None):
     all_rewards_in_episode = []
     avg_reward_for_num_steps_list = []
 
+    # Rollout buffers. Rewards and masks are filled in place every rollout, while values, log
+    # probs and entropies are part of the graph of each rollout
+    rewards = torch.zeros(args.num_steps, 1)
+    masks = torch.ones(args.num_steps, 1)
+
     total_length = 0
     episode_length = 0
     while True:
         # Sync with the shared model
-        model.load_state_dict(shared_model.state_dict())
+        sync_start = time.time()
+        parameters.sync_with(shared_parameters)
+        sync_seconds = time.time() - sync_start
         if done:
             cx = torch.zeros(1, 256)
             hx = torch.zeros(1, 256)
@@ -69,30 +132,37 @@ def train(rank, args, shared_model, counter, lock, optimizer=None):
             cx = cx.detach()
             hx = hx.detach()
 
-        values = []
-        log_probs = []
-        rewards = []
-        entropies = []
+        values = torch.zeros(args.num_steps, 1)
+        log_probs = torch.zeros(args.num_steps, 1)
+        entropies = torch.zeros(args.num_steps, 1)
 
         for step in range(args.num_steps):
             episode_length += 1
             total_length += 1
-            value, logit, (hx, cx) = model((state.unsqueeze(0).float(), (hx, cx)))
+            value, logit, (hx, cx) = model((state.unsqueeze(0), (hx, cx)))
             prob = F.softmax(logit, dim=-1)
+            action = prob.multinomial(num_samples=1).detach()
+            action_int = action.numpy()[0][0].item()
+            if pipelined_steps:
+                # The env steps in a background thread while the log prob and entropy of the
+                # action are computed and stored
+                env.step_async(action_int)
+
             log_prob = F.log_softmax(logit, dim=-1)
             entropy = -(log_prob * prob).sum(1, keepdim=True)
-            entropies.append(entropy)
-
-            action = prob.multinomial(num_samples=1).detach()
+            entropies[step] = entropy[0]
             log_prob = log_prob.gather(1, action)
+            values[step] = value[0]
+            log_probs[step] = log_prob[0]
 
-            action_int = action.numpy()[0][0].item()
-            state, reward, done, _ = env.step(action_int)
+            if pipelined_steps:
+                state, reward, done, _ = env.step_wait()
+            else:
+                state, reward, done, _ = env.step(action_int)
 
             done = done or episode_length >= args.max_episode_length
 
-            with lock:
-                counter.value += 1
+            stats.add(rank, env_steps=1)  # only this process writes its slots, no lock needed
 
             if done:
                 episode_length = 0
@@ -106,48 +176,39 @@ def train(rank, args, shared_model, counter, lock, optimizer=None):
                 print('Step no: {}. total length: {}'.format(episode_length, total_length))
 
             state = torch.from_numpy(state)
-            values.append(value)
-            log_probs.append(log_prob)
-            rewards.append(reward)
+            rewards[step] = reward
             all_rewards_in_episode.append(reward)
 
             if done:
                 break
+        rollout_length = step + 1
 
         # No interaction with environment below.
         # Monitoring
-        total_reward_for_num_steps = sum(rewards)
+        total_reward_for_num_steps = rewards[:rollout_length].sum().item()
         total_reward_for_num_steps_list.append(total_reward_for_num_steps)
-        avg_reward_for_num_steps = total_reward_for_num_steps / len(rewards)
+        avg_reward_for_num_steps = total_reward_for_num_steps / rollout_length
         avg_reward_for_num_steps_list.append(avg_reward_for_num_steps)
 
         # Backprop and optimisation
-        R = torch.zeros(1, 1)
+        R = torch.zeros(1)
         if not done:  # to change last reward to predicted value to ....
-            value, _, _ = model((state.unsqueeze(0).float(), (hx, cx)))
-            R = value.detach()
+            value, _, _ = model((state.unsqueeze(0), (hx, cx)))
+            R = value.detach()[0]
 
-        values.append(R)
-        policy_loss = 0
-        value_loss = 0
         # import pdb;pdb.set_trace() # good place to breakpoint to see training cycle
-        gae = torch.zeros(1, 1)
-        for i in reversed(range(len(rewards))):
-            R = args.gamma * R + rewards[i]
-            advantage = R - values[i]
-            value_loss = value_loss + 0.5 * advantage.pow(2)
-
-            # Generalized Advantage Estimation
-            delta_t = rewards[i] + args.gamma * values[i + 1] - values[i]
-            gae = gae * args.gamma * args.tau + delta_t
-
-            policy_loss = policy_loss - log_probs[i] * gae.detach() - \
-                          args.entropy_coef * entropies[i]
+        # Episodes only finish at the end of a rollout, where the bootstrap value R is 0
+        policy_loss, value_loss = a3c_losses(args, values[:rollout_length],
+                                             log_probs[:rollout_length],
+                                             entropies[:rollout_length],
+                                             rewards[:rollout_length], masks[:rollout_length], R)
 
-        optimizer.zero_grad()
+        parameters.zero_grad()
 
         (policy_loss + args.value_loss_coef * value_loss).backward()
         torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
 
-        ensure_shared_grads(model, shared_model)
+        parameters.push_gradients(shared_model)
         optimizer.step()
+        shared_parameters.increment_version()
+        stats.add(rank, updates=1, sync_seconds=sync_seconds)
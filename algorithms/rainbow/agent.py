@@ -9,7 +9,7 @@ import numpy as np
 import torch
 from torch import optim
 
-from algorithms.rainbow.model import RainbowDQN
+from algorithms.rainbow.model import RainbowDQN, compile_q_value_net
 
 
 class Agent:
@@ -41,6 +41,9 @@ class Agent:
         self.batch_size = args.batch_size
         self.multi_step = args.multi_step
         self.discount = args.discount
+        # Optional compiled network used for acting and evaluating while in evaluation mode
+        self.inference_mode = args.inference_mode
+        self.q_value_net = None
 
         self.online_net = RainbowDQN(args, self.action_space).to(device=args.device)
         if args.model_path and os.path.isfile(args.model_path):
@@ -65,10 +68,27 @@ class Agent:
         """Resets noisy weights in all linear layers (of online net only) """
         self.online_net.reset_noise()
 
+    def q_values(self, states):
+        """
+        Expected Q-values (batch_size x num_actions) of a batch of states. In evaluation mode they
+        are computed with the QValueNet compiled on the first call after eval() if an inference
+        mode is set, otherwise with the online network (noisy weights included in training mode)
+        """
+        with torch.no_grad():
+            if not self.online_net.training and self.inference_mode != 'none':
+                if self.q_value_net is None:
+                    self.q_value_net = compile_q_value_net(self.online_net, self.support,
+                                                           self.inference_mode, states)
+                return self.q_value_net(states)
+            return (self.online_net(states) * self.support).sum(2)
+
     def act(self, state):
         """Acts based on single state (no batch) """
-        with torch.no_grad():
-            return (self.online_net(state.unsqueeze(0)) * self.support).sum(2).argmax(1).item()
+        return self.act_batch(state.unsqueeze(0))[0].item()
+
+    def act_batch(self, states):
+        """Acts greedily on a batch of states, e.g. one per environment (tensor of actions) """
+        return self.q_values(states).argmax(1)
 
     def act_e_greedy(self, state, epsilon=0.001):
         """
@@ -86,6 +106,18 @@ class Agent:
         idxs, states, actions, returns, next_states, nonterminals, weights = \
           mem.sample(self.batch_size)
 
+        loss = self.compute_loss(states, actions, returns, next_states, nonterminals)
+        self.online_net.zero_grad()
+        # Backpropagate importance-weighted (Prioritized Experience Replay) minibatch loss
+        (weights * loss).mean().backward()
+        self.optimiser.step()
+        # Update priorities of sampled transitions
+        mem.update_priorities(idxs, loss.detach().cpu().numpy())
+
+    def compute_loss(self, states, actions, returns, next_states, nonterminals):
+        """
+        Returns the cross-entropy loss of each transition, which is also used as its priority
+        """
         """Calculate current state probabilities (online network noise already sampled)
         The log is used to calculate the losses. It also provides more stability for the gradients 
         propagation during training and it is not needed for evaluation 
@@ -93,7 +125,7 @@ class Agent:
         # Log probabilities log p(s_t, ·; θonline) for the visited states in the sampled transitions
         online_log_probs = self.online_net(states, log=True)
         # log p(s_t, a_t; θonline) of the actions selected on the visited states (online network)
-        online_log_probs = online_log_probs[range(self.batch_size), actions]
+        online_log_probs = online_log_probs[range(len(actions)), actions]
 
         target_probs = self.compute_target_probs(states, actions, returns, next_states,
                                                  nonterminals)
@@ -102,13 +134,16 @@ class Agent:
         online_log_probs: policy distribution for online network
         target_probs: aligned target policy distribution
         """
-        loss = -torch.sum(target_probs * online_log_probs, 1)
-        self.online_net.zero_grad()
-        # Backpropagate importance-weighted (Prioritized Experience Replay) minibatch loss
-        (weights * loss).mean().backward()
-        self.optimiser.step()
-        # Update priorities of sampled transitions
-        mem.update_priorities(idxs, loss.detach().cpu().numpy())
+        return -torch.sum(target_probs * online_log_probs, 1)
+
+    def compute_priorities(self, states, actions, returns, next_states, nonterminals):
+        """
+        Initial priorities of new transitions computed by the Ape-X actors with their copy of the
+        networks (see apex.py)
+        """
+        with torch.no_grad():
+            return self.compute_loss(states, actions, returns, next_states,
+                                     nonterminals).cpu().numpy()
 
     def compute_target_probs(self, states, actions, returns, next_states, nonterminals):
         """
@@ -122,6 +157,7 @@ class Agent:
         For a detailed explanation of the math behind this process we recommend you to read this
         blog: https://mtomassoli.github.io/2017/12/08/distributional_rl/
         """
+        batch_size = len(states)
         with torch.no_grad():
             # Calculate self.multi_step-th next state Q distribution (Z) for Double Q-Learning
             online_z = self.online_net(next_states)
@@ -139,7 +175,7 @@ class Agent:
             network. The expected online_q will be optimized towards these values similarly as to 
             how it is done in Double DQN.
             """
-            target_probs = target_z[range(self.batch_size), online_greedy_action_indices]
+            target_probs = target_z[range(batch_size), online_greedy_action_indices]
             """Apply distributional N-step Bellman operator Tz (Bellman operator T applied to z), 
             also Bellman equation for distributional Q.
             Tz = returns_t + γ * z_t+1 
@@ -196,11 +232,11 @@ class Agent:
             l[(u > 0) * (l == u)] -= 1  # Handles the case of u = b = l != 0
             u[(l < (self.num_atoms - 1)) * (l == u)] += 1  # Handles the case of u = b = l = 0
 
-            # We use new_zeros instead of zeros to auto assign device and dtype of states tensor
-            projected_target_probs = states.new_zeros(self.batch_size, self.num_atoms)
-            offset = torch.linspace(0, ((self.batch_size - 1) * self.num_atoms),
-                                    self.batch_size).unsqueeze(1).expand(self.batch_size,
-                                                                         self.num_atoms).to(actions)
+            # We use new_zeros instead of zeros to auto assign device and dtype of target_probs
+            projected_target_probs = target_probs.new_zeros(batch_size, self.num_atoms)
+            offset = torch.linspace(0, ((batch_size - 1) * self.num_atoms),
+                                    batch_size).unsqueeze(1).expand(batch_size,
+                                                                    self.num_atoms).to(actions)
             """Distribute probabilities to the closest lower atom in inverse proportion to the
             distance to the atom. For efficiency, we are adding the values to the flattened view of 
             the array not flattening the array itself.
@@ -222,13 +258,30 @@ class Agent:
         """Save model parameters on current device """
         torch.save(self.online_net.state_dict(), os.path.join(path, filename))
 
+    def state_dict(self):
+        """Online and target networks and optimiser state, e.g. to resume training """
+        return {'online_net': self.online_net.state_dict(),
+                'target_net': self.target_net.state_dict(),
+                'optimiser': self.optimiser.state_dict()}
+
+    def load_state_dict(self, state_dict):
+        self.online_net.load_state_dict(state_dict['online_net'])
+        self.target_net.load_state_dict(state_dict['target_net'])
+        self.optimiser.load_state_dict(state_dict['optimiser'])
+        self.q_value_net = None
+
     def evaluate_q(self, state):
         """Evaluates Q-value based on single state (no batch) """
-        with torch.no_grad():
-            return (self.online_net(state.unsqueeze(0)) * self.support).sum(2).max(1)[0].item()
+        return self.evaluate_q_batch(state.unsqueeze(0))[0].item()
+
+    def evaluate_q_batch(self, states):
+        """Evaluates the Q-value of the greedy action for a batch of states """
+        return self.q_values(states).max(1)[0]
 
     def train(self):
         self.online_net.train()
+        self.q_value_net = None  # the weights will change, compile again on the next eval()
 
     def eval(self):
         self.online_net.eval()
+        self.q_value_net = None
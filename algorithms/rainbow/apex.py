@@ -0,0 +1,302 @@
+"""
+Ape-X style distributed training of Rainbow (Horgan et al. 2018, Distributed Prioritized Experience
+Replay) on a single machine. Acting, storing and learning are decoupled into processes:
+
+- num_actors actor processes, each with its own AI2ThorEnv and a copy of the online network synced
+  periodically from a shared-memory network. They keep their recent transitions in a small local
+  ReplayMemory, compute the initial priority of every n-step transition with their copy of the
+  networks and send them in chunks to the replay process.
+- The replay process owns the central prioritised ReplayMemory. It stores the chunks, samples
+  batches ahead of the learner and applies the priority updates sent back by it.
+- The learner process trains continuously on the sampled batches and publishes its online network
+  weights to the actors every learner_sync_interval updates.
+
+Every actor chunk is sent with the history_length - 1 transitions before it and the multi_step
+transitions after it with priority 0, so that consecutive transitions of different actors can be
+interleaved in the central memory: the context transitions are only used to rebuild the stacked
+states and the n-step returns of their neighbours and are never sampled.
+Evaluation (test.py) is not run in this mode. Note that --target-update counts learner updates here.
+
+Example of use:
+`python algorithms/rainbow/apex.py --num-actors 4 --learn-start 5000`
+"""
+
+from collections import deque
+from copy import copy
+from datetime import datetime
+import queue
+import time
+import types
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from algorithms.rainbow.agent import Agent
+from algorithms.rainbow.env import FrameStackEnv
+from algorithms.rainbow.main import parser
+from algorithms.rainbow.memory import ReplayMemory
+from algorithms.rainbow.model import RainbowDQN
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+
+parser.add_argument('--num-actors', type=int, default=4, metavar='N',
+                    help='Number of actor processes')
+parser.add_argument('--actor-send-interval', type=int, default=50, metavar='STEPS',
+                    help='Number of transitions sent by each actor in every chunk')
+parser.add_argument('--actor-sync-interval', type=int, default=400, metavar='STEPS',
+                    help='Number of actor steps between copies of the shared network weights')
+parser.add_argument('--learner-sync-interval', type=int, default=100, metavar='UPDATES',
+                    help='Number of learner updates between publishing the network weights')
+parser.add_argument('--replay-queue-depth', type=int, default=4, metavar='K',
+                    help='Number of batches sampled by the replay process ahead of the learner')
+parser.add_argument('--report-interval', type=float, default=10, metavar='SECONDS',
+                    help='Seconds between reports of env steps/s and learner updates/s')
+
+
+def make_chunk(dqn, local_mem, num_sent, done):
+    """
+    Prepares the transitions of local_mem appended since the last chunk for the replay process.
+    The last multi_step transitions are kept for the next chunk unless the episode finished, since
+    their n-step returns are not complete yet.
+    :param dqn:       (Agent)        Actor agent used to compute the initial priorities
+    :param local_mem: (ReplayMemory) Local memory of the actor with its recent transitions
+    :param num_sent:  (int)          Number of transitions of local_mem already sent
+    :param done:      (bool)         Whether the last appended transition is terminal
+    :return: (chunk, num_sent) where chunk holds the arguments of ReplayMemory.append_batch
+    """
+    end = local_mem.num_appends if done else local_mem.num_appends - local_mem.multi_step
+    positions = np.arange(max(num_sent - local_mem.history + 1, 0), local_mem.num_appends)
+    idxs = positions % local_mem.capacity
+    ready = (positions >= num_sent) & (positions < end)
+    priorities = np.zeros(len(idxs), dtype=np.float32)
+    if ready.any():
+        priorities[ready] = dqn.compute_priorities(*local_mem._get_batch(idxs[ready]))
+    chunk = dict(timesteps=local_mem.timesteps[idxs], states=local_mem.states[idxs],
+                 actions=local_mem.actions[idxs], rewards=local_mem.rewards[idxs],
+                 nonterminals=local_mem.nonterminals[idxs], priorities=priorities)
+    return chunk, max(end, num_sent)
+
+
+def actor(rank, args, shared_net, chunks, env_steps, stop_event):
+    """
+    Acts with noisy networks on its own env and sends chunks of transitions with their initial
+    priorities to the replay process. env_steps[rank] is only written by this actor
+    """
+    torch.set_num_threads(1)
+    np.random.seed(args.seed + rank)
+    torch.manual_seed(args.seed + rank)
+    env = FrameStackEnv(AI2ThorEnv(seed=args.seed + rank, config_file=args.config_file),
+                        args.history_length, args.device)
+    dqn = Agent(args, env)
+    dqn.train()
+    # Enough room for a chunk and the history and multi-step context around it
+    local_mem = ReplayMemory(args, 2 * (args.actor_send_interval + args.history_length +
+                                        args.multi_step))
+    num_sent, done = 0, True
+    while not stop_event.is_set():
+        if local_mem.num_appends % args.actor_sync_interval == 0:
+            dqn.online_net.load_state_dict(shared_net.state_dict())
+            dqn.update_target_net()
+        if done:
+            state, done = env.reset(), False
+        if local_mem.num_appends % args.replay_frequency == 0:
+            dqn.reset_noise()  # Draw a new set of noisy epsilons
+        action = dqn.act(state)
+        next_state, reward, done, _ = env.step(action)
+        if args.reward_clip > 0:
+            reward = max(min(reward, args.reward_clip), -args.reward_clip)  # Clip rewards
+        local_mem.append(state, action, reward, done)
+        env_steps[rank] += 1
+        state = next_state
+        if done or local_mem.num_appends - num_sent >= args.actor_send_interval + args.multi_step:
+            chunk, num_sent = make_chunk(dqn, local_mem, num_sent, done)
+            while not stop_event.is_set():
+                try:
+                    chunks.put(chunk, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+    # Do not wait for the queued chunks to be consumed when exiting
+    chunks.cancel_join_thread()
+    env.close()
+
+
+def replay(args, chunks, batches, priority_updates, stop_event):
+    """
+    Stores the chunks of all actors in the central memory, keeps the batches queue filled with
+    sampled batches and applies the priority updates of the learner in the order the batches were
+    sampled
+    """
+    torch.set_num_threads(1)
+    np.random.seed(args.seed)
+    mem = ReplayMemory(args, args.memory_capacity, frames_file=args.memory_file,
+                       frame_compression=None if args.frame_compression == 'none'
+                       else args.frame_compression, keyframe_interval=args.keyframe_interval)
+    priority_weight_increase = (1 - args.priority_weight) / (args.max_num_steps - args.learn_start)
+    # sampleable transitions stored, i.e. without context (some already if the memory was reopened)
+    num_transitions = np.count_nonzero(mem.transitions.sum_tree[-mem.capacity:])
+    sampled_at = deque()  # num_appends when each batch in the queue was sampled
+    while not stop_event.is_set():
+        idle = True
+        try:
+            while True:
+                chunk = chunks.get_nowait()
+                mem.append_batch(**chunk)
+                num_transitions += np.count_nonzero(chunk['priorities'])
+                idle = False
+        except queue.Empty:
+            pass
+        try:
+            while True:
+                idxs, priorities = priority_updates.get_nowait()
+                mem.update_priorities(idxs, priorities, sampled_at=sampled_at.popleft())
+                idle = False
+        except queue.Empty:
+            pass
+        if num_transitions >= max(args.learn_start, 1) and not batches.full():
+            # Anneal importance sampling weight β to 1 with the number of stored transitions
+            mem.priority_weight = min(args.priority_weight + priority_weight_increase *
+                                      (num_transitions - args.learn_start), 1)
+            batches.put(mem.sample(args.batch_size))
+            sampled_at.append(mem.num_appends)
+            idle = False
+        if idle:
+            time.sleep(0.001)
+    if args.memory_file is not None:
+        mem.flush()
+    batches.cancel_join_thread()
+
+
+class RemoteReplay:
+    """
+    Replay memory interface of the learner (see Agent.learn). Batches are received from the replay
+    process and the new priorities are sent back to it
+    """
+    def __init__(self, batches, priority_updates, device):
+        self.batches = batches
+        self.priority_updates = priority_updates
+        self.device = device
+
+    def sample(self, batch_size):
+        """ Raises queue.Empty if no batch is received within 0.1 seconds """
+        tree_idxs, *batch = self.batches.get(timeout=0.1)
+        return (tree_idxs, ) + tuple(tensor.to(device=self.device) for tensor in batch)
+
+    def update_priorities(self, idxs, priorities):
+        self.priority_updates.put((idxs, priorities))
+
+
+def learner(args, action_space, shared_net, batches, priority_updates, learner_steps,
+            stop_event):
+    """
+    Trains continuously on the batches of the replay process and publishes the online network
+    weights in shared_net for the actors
+    """
+    # Agent only needs the action space of the env
+    dqn = Agent(args, types.SimpleNamespace(action_space=action_space))
+    dqn.online_net.load_state_dict(shared_net.state_dict())
+    dqn.update_target_net()
+    dqn.train()
+    remote_replay = RemoteReplay(batches, priority_updates, args.device)
+    while not stop_event.is_set():
+        dqn.reset_noise()  # Draw a new set of noisy epsilons
+        try:
+            dqn.learn(remote_replay)  # Train with n-step distributional double-Q learning
+        except queue.Empty:
+            continue
+        learner_steps.value += 1
+        if learner_steps.value % args.learner_sync_interval == 0:
+            shared_net.load_state_dict(dqn.online_net.state_dict())
+        if learner_steps.value % args.target_update == 0:
+            dqn.update_target_net()
+    priority_updates.cancel_join_thread()
+
+
+def run(args, duration=None, start_method=None):
+    """
+    Runs the actors, replay and learner processes until the actors take args.max_num_steps env
+    steps in total or duration seconds pass.
+    :param start_method: (str) multiprocessing start method ('fork', 'spawn', etc.). Default of
+                               the platform is used if None
+    :return: (dict) env steps/s of all actors and learner updates/s since the first update
+    """
+    def log(s):
+        print('[' + str(datetime.now().strftime('%Y-%m-%dT%H:%M:%S')) + '] ' + s)
+
+    env = AI2ThorEnv(config_file=args.config_file)
+    args.resolution = env.config['resolution']
+    args.img_channels = env.observation_space.shape[0]
+    action_space = env.action_space
+    env.close()  # above env initialisation was only to find certain params needed
+    # Actors and replay run on the CPU. Only the learner uses args.device
+    cpu_args = copy(args)
+    cpu_args.device = torch.device('cpu')
+    shared_net = RainbowDQN(cpu_args, action_space)
+    if args.model_path:
+        shared_net.load_state_dict(torch.load(args.model_path, map_location='cpu'))
+    shared_net.share_memory()
+
+    context = mp.get_context(start_method)
+    chunks = context.Queue(maxsize=4 * args.num_actors)
+    batches = context.Queue(maxsize=args.replay_queue_depth)
+    priority_updates = context.Queue()
+    stop_event = context.Event()
+    # One counter per process, each written by its process only, so no lock is needed
+    env_steps = context.RawArray('q', args.num_actors)
+    learner_steps = context.RawValue('q', 0)
+    processes = [context.Process(target=replay,
+                                 args=(cpu_args, chunks, batches, priority_updates, stop_event)),
+                 context.Process(target=learner,
+                                 args=(args, action_space, shared_net, batches, priority_updates,
+                                       learner_steps, stop_event))]
+    processes += [context.Process(target=actor,
+                                  args=(rank, cpu_args, shared_net, chunks, env_steps, stop_event))
+                  for rank in range(args.num_actors)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    start = last_report = time.time()
+    first_update, last_env_steps, last_learner_steps = None, 0, 0
+    try:
+        while sum(env_steps) < args.max_num_steps and \
+                (duration is None or time.time() - start < duration):
+            time.sleep(min(0.1, args.report_interval))
+            if first_update is None and learner_steps.value > 0:
+                first_update, first_learner_steps = time.time(), learner_steps.value
+            if time.time() - last_report >= args.report_interval:
+                num_env_steps, num_learner_steps = sum(env_steps), learner_steps.value
+                log('env steps = {} ({:.1f}/s) | learner updates = {} ({:.1f}/s)'.format(
+                    num_env_steps, (num_env_steps - last_env_steps) / (time.time() - last_report),
+                    num_learner_steps,
+                    (num_learner_steps - last_learner_steps) / (time.time() - last_report)))
+                last_report, last_env_steps, last_learner_steps = \
+                    time.time(), num_env_steps, num_learner_steps
+    finally:
+        end = time.time()
+        num_env_steps, num_learner_steps = sum(env_steps), learner_steps.value
+        stop_event.set()
+        for process in processes:
+            process.join()
+    updates_per_sec = (num_learner_steps - first_learner_steps) / (end - first_update) \
+        if first_update is not None and end > first_update else 0.
+    return {'env_steps': num_env_steps, 'env_steps_per_sec': num_env_steps / (end - start),
+            'learner_updates': num_learner_steps, 'learner_updates_per_sec': updates_per_sec}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    print('-' * 10 + '\n' + 'Options' + '\n' + '-' * 10)
+    for k, v in vars(args).items():
+        print(' ' * 4 + k + ': ' + str(v))
+    np.random.seed(args.seed)
+    torch.manual_seed(np.random.randint(1, 10000))
+    if torch.cuda.is_available() and not args.disable_cuda:
+        args.device = torch.device('cuda')
+        torch.cuda.manual_seed(np.random.randint(1, 10000))
+    else:
+        args.device = torch.device('cpu')
+    # CUDA cannot be used in forked subprocesses
+    stats = run(args, start_method='spawn' if args.device.type == 'cuda' else None)
+    print('Env steps: {env_steps} ({env_steps_per_sec:.1f}/s) | Learner updates: '
+          '{learner_updates} ({learner_updates_per_sec:.1f}/s)'.format(**stats))
@@ -0,0 +1,67 @@
+"""
+Checkpoints to resume the training of Rainbow where it stopped, instead of refilling the replay
+memory from the simulator and starting the networks, optimiser and β annealing from scratch.
+
+A checkpoint directory contains:
+- validation/: the validation memory, which is never written again once saved.
+- a/ and b/: two slots, each with memory/, the replay memory (see ReplayMemory.save_checkpoint),
+  and training.pt, the online and target networks, the optimiser and the number of training steps.
+- latest: the name of the slot of the last complete checkpoint, replaced atomically once the slot
+  is written, so that its presence marks a complete checkpoint.
+
+Checkpoints alternate between the slots, so a checkpoint interrupted halfway, e.g. while its
+frames are written in place, only leaves a partially written slot that latest does not point to.
+The frames files of the slots are updated incrementally, i.e. only the frames appended since the
+previous checkpoint into the same slot are written (every frame on the first checkpoint into each
+slot, including the first one after resuming).
+"""
+import os
+
+import torch
+
+SLOTS = ('a', 'b')
+
+
+def _latest_file(directory):
+    return os.path.join(directory, 'latest')
+
+
+def _latest_slot(directory):
+    with open(_latest_file(directory)) as f:
+        return f.read().strip()
+
+
+def checkpoint_exists(directory):
+    return directory is not None and os.path.exists(_latest_file(directory))
+
+
+def save_checkpoint(directory, num_steps, dqn, mem, val_mem):
+    validation_directory = os.path.join(directory, 'validation')
+    if validation_directory not in val_mem.checkpoints:  # it does not change during training
+        os.makedirs(validation_directory, exist_ok=True)
+        val_mem.save_checkpoint(validation_directory)
+    slot = SLOTS[0]
+    if checkpoint_exists(directory) and _latest_slot(directory) == SLOTS[0]:
+        slot = SLOTS[1]
+    memory_directory = os.path.join(directory, slot, 'memory')
+    os.makedirs(memory_directory, exist_ok=True)
+    mem.save_checkpoint(memory_directory)
+    torch.save({'num_steps': num_steps, 'agent': dqn.state_dict()},
+               os.path.join(directory, slot, 'training.pt'))
+    temporary_file = _latest_file(directory) + '.tmp'
+    with open(temporary_file, 'w') as f:
+        f.write(slot)
+    os.replace(temporary_file, _latest_file(directory))
+
+
+def load_checkpoint(directory, dqn, mem, val_mem):
+    """
+    Restores the last complete checkpoint saved with save_checkpoint into the agent and memories
+    :return: (int) number of training steps done when the checkpoint was saved
+    """
+    slot_directory = os.path.join(directory, _latest_slot(directory))
+    training = torch.load(os.path.join(slot_directory, 'training.pt'), map_location='cpu')
+    dqn.load_state_dict(training['agent'])
+    mem.load_checkpoint(os.path.join(slot_directory, 'memory'))
+    val_mem.load_checkpoint(os.path.join(directory, 'validation'))
+    return training['num_steps']
@@ -9,6 +9,7 @@ import atari_py
 import torch
 import cv2  # Note that importing cv2 before torch may cause segfaults?
 import gym
+import numpy as np
 from gym import spaces
 
 
@@ -114,6 +115,96 @@ class Env:
         cv2.destroyAllWindows()
 
 
+class FrameRingBuffer:
+    """
+    Preallocated buffer with the last num_frames frames of one env (or of num_envs envs in lockstep)
+    from which the stacked states are returned as views, so that stepping does not allocate.
+
+    The frames are stored in a linear buffer longer than num_frames where the newest frame is
+    written after the previous one and the state is the view of the last num_frames frames. When
+    the end of the buffer is reached the last num_frames - 1 frames are copied to its beginning,
+    i.e. only once every length - num_frames + 1 steps. Since the buffer is at least twice as long
+    as the stack, the state returned by one step is not overwritten by the next one (so it can still
+    be appended to a replay memory after stepping) but it is by later steps, unless copy_states.
+    """
+    def __init__(self, num_frames, frame_shape, dtype, device, num_envs=None, copy_states=False):
+        """
+        :param num_frames:  (int)         Number of stacked frames
+        :param frame_shape: (tuple)       C x H x W shape of every frame
+        :param dtype:       (torch.dtype) torch.uint8 for [0, 255] or torch.float32 for [0, 1]
+        :param num_envs:    (int)         Number of envs stacked in lockstep, or None for one env
+                                          without batch dimension
+        :param copy_states: (bool)        Return a copy of the stacked frames instead of a view
+        """
+        self.num_frames = num_frames
+        self.length = max(2 * num_frames, num_frames + 16)
+        self.batched = num_envs is not None
+        self.frames = torch.zeros(((num_envs, ) if self.batched else ()) + (self.length, ) +
+                                  tuple(frame_shape), dtype=dtype, device=device)
+        self.copy_states = copy_states
+        self.index = num_frames - 1  # position of the newest frame
+        # Views of every frame and of every stacked state, created once to save the slicing cost
+        frames = self.frames.transpose(0, 1) if self.batched else self.frames
+        self.frame_views = list(frames.unbind(0))
+        self.state_views = [None] * self.length
+        for end in range(num_frames, self.length + 1):
+            if self.batched:
+                stack = self.frames[:, end - num_frames:end]
+                self.state_views[end - 1] = stack.view((stack.size(0), -1) + stack.shape[3:])
+            else:
+                stack = self.frames[end - num_frames:end]
+                self.state_views[end - 1] = stack.view((-1, ) + stack.shape[2:])
+
+    @staticmethod
+    def _copy_frames(destination, frames):
+        """ Copies numpy frames into the buffer converting between [0, 255] uint8 and [0, 1] """
+        frames = torch.from_numpy(frames)
+        if destination.dtype == frames.dtype:
+            destination.copy_(frames)
+            return
+        if destination.dtype == torch.uint8:
+            frames = frames.mul(255).round_()
+        destination.copy_(frames)
+        if frames.dtype == torch.uint8:
+            destination.div_(255)
+
+    def state(self):
+        """
+        Returns the num_frames * C x H x W stacked frames (N x num_frames * C x H x W batched)
+        """
+        state = self.state_views[self.index]
+        return state.clone() if self.copy_states else state
+
+    def reset(self, frames, env_indices=None):
+        """
+        Fills the stack with the first frame of an episode (of the envs in env_indices if batched,
+        with frames[i] the frame of env_indices[i], or of all the envs if None)
+        """
+        start, end = self.index - self.num_frames + 1, self.index + 1
+        if not self.batched:
+            self._copy_frames(self.frames[start:end], frames)
+        elif env_indices is None:
+            self._copy_frames(self.frames[:, start:end], frames[:, None])
+        else:
+            for env_index, frame in zip(env_indices, frames):
+                self._copy_frames(self.frames[env_index, start:end], frame)
+        return self.state()
+
+    def append(self, frames):
+        """ Writes the newest frame (N x C x H x W frames if batched) and returns the state """
+        if self.index + 1 == self.length:
+            # Move the frames still stacked to the beginning of the buffer
+            kept = self.num_frames - 1
+            if self.batched:
+                self.frames[:, :kept] = self.frames[:, self.length - kept:]
+            else:
+                self.frames[:kept] = self.frames[self.length - kept:]
+            self.index = kept - 1
+        self.index += 1
+        self._copy_frames(self.frame_views[self.index], frames)
+        return self.state()
+
+
 class FrameStackEnv(gym.Wrapper):
     """
     Wraps our ai2thor gym environment to execute history_length steps every time its step function
@@ -121,34 +212,96 @@ class FrameStackEnv(gym.Wrapper):
     this script to load the atari wrapped environments from the original repository.
     """
 
-    def __init__(self, env, num_frame_stack, device):
+    def __init__(self, env, num_frame_stack, device, observation_dtype=None, copy_states=False):
+        """
+        :param observation_dtype: (str)  'uint8' to keep the stacked frames in [0, 255] until they
+                                         are normalised by the model or 'float32' for [0, 1]. Uses
+                                         the dtype of the wrapped env if None
+        :param copy_states:       (bool) Return states that are not overwritten by later steps
+                                         instead of views of the frame buffer (see FrameRingBuffer)
+        """
         gym.Wrapper.__init__(self, env)
         self.config = env.config
         self.num_frame_stack = num_frame_stack
         self.device = device
-        self.state_buffer = deque([], maxlen=self.num_frame_stack)
+        observation_dtype = np.dtype(observation_dtype or env.observation_dtype)
+        self.observation_dtype = torch.uint8 if observation_dtype == np.uint8 else torch.float32
+        self.frame_buffer = FrameRingBuffer(num_frame_stack, env.observation_space.shape,
+                                            self.observation_dtype, device,
+                                            copy_states=copy_states)
 
     def step(self, action):
         """
         We stack num_frame_stack frames together so that the CNN can capture the consistency of
         movements as it is done in DQN nature paper for atari environments.
-        The frames are stacked one by one using a deque, which means that every step we move only
-        the oldest frame is removed and the newest is appended.
+        The newest frame is written in place in a preallocated ring buffer of frames and the
+        state is a view of the last num_frame_stack frames of it (see FrameRingBuffer).
         If num_frame_stack == 1, we are simply using one frame as the input to our CNN.
         The done and info belong to the last step only.
         """
         state, reward, done, info = self.env.step(action)
-        observation = torch.from_numpy(state).float().to(self.device)
-        self.state_buffer.append(observation)
         # num stacked frames x H x W
-        state = torch.cat(list(self.state_buffer), 0)
+        state = self.frame_buffer.append(state)
         # Return state, reward, done, info
         return state, reward, done, info
 
+    def step_async(self, action):
+        """ Starts the step of the wrapped env in the background (see AI2ThorEnv.step_async) """
+        self.env.step_async(action)
+
+    def step_wait(self):
+        """ Stacks the frame of the step started with step_async as in step """
+        state, reward, done, info = self.env.step_wait()
+        return self.frame_buffer.append(state), reward, done, info
+
     def reset(self):
-        state = self.env.reset()
-        observation = torch.from_numpy(state).float().to(self.device)
-        self.state_buffer = deque([observation for _ in range(self.num_frame_stack)],
-                                  maxlen=self.num_frame_stack)
-        state = torch.cat(list(self.state_buffer), 0)
-        return state
+        return self.frame_buffer.reset(self.env.reset())
+
+
+class VectorFrameStackEnv:
+    """
+    Batched version of FrameStackEnv for a VectorAI2ThorEnv: the frames of all the envs are stacked
+    in lockstep in a single preallocated FrameRingBuffer and the N x (num_frame_stack * C) x H x W
+    states are returned as views of it. The stack of the envs reset automatically by the vector env
+    is filled with their first frame.
+    """
+    def __init__(self, env, num_frame_stack, device, observation_dtype=None, copy_states=False):
+        """
+        :param env: (VectorAI2ThorEnv) Vectorized env to wrap
+        Other params as in FrameStackEnv
+        """
+        self.env = env
+        self.config = env.config
+        self.num_envs = env.num_envs
+        self.num_frame_stack = num_frame_stack
+        self.device = device
+        self.observation_space, self.action_space = env.observation_space, env.action_space
+        observation_dtype = np.dtype(observation_dtype or env.observations_dtype)
+        self.observation_dtype = torch.uint8 if observation_dtype == np.uint8 else torch.float32
+        self.frame_buffer = FrameRingBuffer(num_frame_stack, env.observation_space.shape,
+                                            self.observation_dtype, device, num_envs=env.num_envs,
+                                            copy_states=copy_states)
+
+    def step_async(self, actions):
+        self.env.step_async(actions)
+
+    def step_wait(self):
+        observations, rewards, dones, infos = self.env.step_wait()
+        self.frame_buffer.append(observations)
+        if dones.any():
+            done_indices = np.flatnonzero(dones)
+            self.frame_buffer.reset(observations[done_indices], done_indices)
+        return self.frame_buffer.state(), rewards, dones, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def reset(self):
+        return self.frame_buffer.reset(self.env.reset())
+
+    def close(self):
+        self.env.close()
+
+    def __len__(self):
+        return self.num_envs
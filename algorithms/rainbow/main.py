@@ -19,9 +19,10 @@ import numpy as np
 import torch
 
 from algorithms.rainbow.agent import Agent
+from algorithms.rainbow.checkpoint import checkpoint_exists, load_checkpoint, save_checkpoint
 from algorithms.rainbow.env import Env, FrameStackEnv
-from algorithms.rainbow.memory import ReplayMemory
-from algorithms.rainbow.test import test
+from algorithms.rainbow.memory import ReplayMemory, PrefetchSampler
+from algorithms.rainbow.test import ParallelEvaluator, record_results, test
 from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
 
 
@@ -48,10 +49,27 @@ parser.add_argument('--V-min', type=float, default=-10, metavar='V',
 parser.add_argument('--V-max', type=float, default=10, metavar='V',
                     help='Maximum of value distribution support')
 parser.add_argument('--model-path', type=str, metavar='PARAMS', help='Pretrained model (state dict)')
+parser.add_argument('--inference-mode', type=str, default='none',
+                    choices=['none', 'eager', 'script', 'trace'],
+                    help='Network used to act and evaluate Q in evaluation mode: the online '
+                         'network (none) or a copy with folded noisy layers run as it is (eager) '
+                         'or compiled with TorchScript (script or trace)')
 parser.add_argument('--memory-capacity', type=int, default=int(1e6), metavar='CAPACITY',
                     help='Experience replay memory capacity')
+parser.add_argument('--memory-file', type=str, default=None, metavar='PATH',
+                    help='Keep the frames of the replay memory in this memory-mapped file instead '
+                         'of RAM. An existing file (and its metadata) is reopened to resume')
+parser.add_argument('--frame-compression', type=str, default='none',
+                    choices=['none', 'zlib', 'lz4'],
+                    help='Codec compressing every frame of the replay memory in RAM (lz4 requires '
+                         'the lz4 package)')
+parser.add_argument('--keyframe-interval', type=int, default=1, metavar='N',
+                    help='With --frame-compression, store up to N - 1 frames in a row as deltas '
+                         'of the previous frame of their episode (1 to disable)')
 parser.add_argument('--replay-frequency', type=int, default=1, metavar='k',
                     help='Frequency of sampling from memory')
+parser.add_argument('--prefetch-batches', type=int, default=0, metavar='K',
+                    help='Number of batches sampled ahead in a background thread (0 to disable)')
 parser.add_argument('--priority-exponent', type=float, default=0.1, metavar='ω',
                     help='Prioritised experience replay exponent (originally denoted α)')
 parser.add_argument('--priority-weight', type=float, default=0.4, metavar='β',
@@ -79,8 +97,27 @@ parser.add_argument('--evaluation-episodes', type=int, default=10, metavar='N',
                     help='Number of evaluation episodes to average over')
 parser.add_argument('--evaluation-size', type=int, default=500, metavar='N',
                     help='Number of transitions to use for validating Q')
+parser.add_argument('--evaluation-batch-size', type=int, default=500, metavar='SIZE',
+                    help='Number of validation states evaluated in each forward pass')
+parser.add_argument('--evaluation-envs', type=int, default=0, metavar='N',
+                    help='Number of env processes running the evaluation episodes concurrently '
+                         '(ai2thor only, 0 to run them sequentially on the training env)')
+parser.add_argument('--async-evaluation', action='store_true',
+                    help='Keep training while the evaluation envs run (requires --evaluation-envs)')
+parser.add_argument('--pipelined-steps', action='store_true',
+                    help='Train on the stored transitions while the env steps in a background '
+                         'thread instead of after the step (ai2thor only). Off by default since '
+                         'it only pays off when the env steps are slow, e.g. with Unity '
+                         'rendering: with fast envs the step thread contends for the GIL with '
+                         'training and is slower than blocking steps (see '
+                         'benchmarks/async_step.py)')
 parser.add_argument('--log-interval', type=int, default=200, metavar='STEPS',
                     help='Number of training steps between logging status')
+parser.add_argument('--checkpoint-dir', type=str, default=None, metavar='PATH',
+                    help='Directory where the replay memories, networks, optimiser and number of '
+                         'steps are checkpointed. Training resumes from it if it has a checkpoint')
+parser.add_argument('--checkpoint-interval', type=int, default=int(1e5), metavar='STEPS',
+                    help='Number of training steps between checkpoints')
 parser.add_argument('--render', action='store_true', default=False,
                     help='Display screen (testing only)')
 parser.add_argument('--config-file', type=str, default='config_files/rainbow_example.json',
@@ -121,7 +158,12 @@ if __name__ == '__main__':
 
     # Agent
     dqn = Agent(args, env)
-    mem = ReplayMemory(args, args.memory_capacity)
+    mem = ReplayMemory(args, args.memory_capacity, frames_file=args.memory_file,
+                       frame_compression=None if args.frame_compression == 'none'
+                       else args.frame_compression, keyframe_interval=args.keyframe_interval)
+    # Optionally prepare the next batches in a background thread while the current one is trained
+    replay = PrefetchSampler(mem, args.batch_size, args.prefetch_batches) \
+        if args.prefetch_batches > 0 else mem
     """ Priority weights are linearly annealed and increase every step by priority_weight_increase from 
     args.priority_weight to 1. 
     Typically, the unbiased nature of the updates is most important near convergence at the end of 
@@ -136,22 +178,53 @@ if __name__ == '__main__':
     """
     val_mem = ReplayMemory(args, args.evaluation_size)
     mem_steps, done = 0, True
-    for mem_steps in range(args.evaluation_size):
-        if done:
-            state, done = env.reset(), False
-        next_state, _, done, _ = env.step(env.action_space.sample())
-        # No need to store actions or rewards because we only use the state to evaluate Q
-        val_mem.append(state, None, None, done)
-        state = next_state
+    start_steps = 0
+    if checkpoint_exists(args.checkpoint_dir):
+        start_steps = load_checkpoint(args.checkpoint_dir, dqn, mem, val_mem)
+        if mem.num_appends > 0:
+            # The interrupted episode ends at the last stored transition, the next ones are new
+            mem.nonterminals[(mem.transitions.index - 1) % mem.capacity] = False
+            mem.t = 0
+        log('Resumed from checkpoint ' + args.checkpoint_dir + ' at num_steps = ' +
+            str(start_steps))
+    else:
+        for mem_steps in range(args.evaluation_size):
+            if done:
+                state, done = env.reset(), False
+            next_state, _, done, _ = env.step(env.action_space.sample())
+            # No need to store actions or rewards because we only use the state to evaluate Q
+            val_mem.append(state, None, None, done)
+            state = next_state
+
+    def checkpoint(num_steps):
+        if args.prefetch_batches > 0:
+            with replay.lock:  # the memory is sampled in the background
+                save_checkpoint(args.checkpoint_dir, num_steps, dqn, mem, val_mem)
+        else:
+            save_checkpoint(args.checkpoint_dir, num_steps, dqn, mem, val_mem)
+
+    # Optionally run the evaluation episodes on their own pool of envs, in the background or not
+    evaluator = ParallelEvaluator(args, args.evaluation_envs, args.async_evaluation) \
+        if args.game == 'ai2thor' and args.evaluation_envs > 0 else None
+
+    def log_evaluation(results):
+        eval_num_steps, step_rewards, step_Qs, state_dict = results
+        avg_reward, avg_Q = record_results(eval_num_steps, step_rewards, step_Qs, state_dict)
+        log('num_steps = ' + str(eval_num_steps) + ' / ' + str(args.max_num_steps) +
+            ' | Avg. reward: ' + str(avg_reward) + ' | Avg. Q: ' + str(avg_Q))
 
     if args.evaluate_only:
         dqn.eval()  # Set DQN (online network) to evaluation mode
-        avg_reward, avg_Q = test(env, mem_steps, args, dqn, val_mem, evaluate_only=True)
+        if evaluator is not None:
+            avg_reward, avg_Q = evaluator.evaluate(mem_steps, dqn, val_mem, evaluate_only=True)
+        else:
+            avg_reward, avg_Q = test(env, mem_steps, args, dqn, val_mem, evaluate_only=True)
         print('Avg. reward: ' + str(avg_reward) + ' | Avg. Q: ' + str(avg_Q))
     else:
         # Training loop
         dqn.train()
-        num_steps, done = 0, True
+        num_steps, done = start_steps, True
+        pipelined_steps = args.pipelined_steps and args.game == 'ai2thor'
         while num_steps < args.max_num_steps:
             if done:
                 state, done = env.reset(), False
@@ -159,10 +232,19 @@ if __name__ == '__main__':
                 dqn.reset_noise()  # Draw a new set of noisy epsilons
 
             action = dqn.act(state)  # Choose an action greedily (with noisy weights)
-            next_state, reward, done, _ = env.step(action)  # Step
+            if pipelined_steps:
+                # The env renders, preprocesses and rewards the next frame in a background thread
+                # while the agent learns from the transitions stored before this step
+                env.step_async(action)
+                if num_steps + 1 >= args.learn_start and \
+                        (num_steps + 1) % args.replay_frequency == 0:
+                    dqn.learn(replay)
+                next_state, reward, done, _ = env.step_wait()
+            else:
+                next_state, reward, done, _ = env.step(action)  # Step
             if args.reward_clip > 0:
                 reward = max(min(reward, args.reward_clip), -args.reward_clip)  # Clip rewards
-            mem.append(state, action, reward, done)  # Append transition to memory
+            replay.append(state, action, reward, done)  # Append transition to memory
             num_steps += 1
 
             if num_steps % args.log_interval == 0:
@@ -173,10 +255,17 @@ if __name__ == '__main__':
                 # Anneal importance sampling weight β to 1
                 mem.priority_weight = min(mem.priority_weight + priority_weight_increase, 1)
 
-                if num_steps % args.replay_frequency == 0:
-                    dqn.learn(mem)  # Train with n-step distributional double-Q learning
+                if num_steps % args.replay_frequency == 0 and not pipelined_steps:
+                    dqn.learn(replay)  # Train with n-step distributional double-Q learning
 
-                if num_steps % args.evaluation_interval == 0:
+                if evaluator is not None:
+                    if num_steps % args.evaluation_interval == 0:
+                        # Evaluate a snapshot of the online network (noisy layers fixed)
+                        evaluator.start(num_steps, dqn, val_mem)
+                    results = evaluator.poll()
+                    if results is not None:
+                        log_evaluation(results)
+                elif num_steps % args.evaluation_interval == 0:
                     dqn.eval()  # Set DQN (online network) to evaluation mode. Fixed linear layers
                     # Test and save best model
                     avg_reward, avg_Q = test(env, num_steps, args, dqn, val_mem)
@@ -187,5 +276,19 @@ if __name__ == '__main__':
                 # Update target network
                 if num_steps % args.target_update == 0:
                     dqn.update_target_net()
+            if args.checkpoint_dir is not None and num_steps % args.checkpoint_interval == 0:
+                checkpoint(num_steps)
             state = next_state
+        if args.checkpoint_dir is not None and num_steps % args.checkpoint_interval != 0:
+            checkpoint(num_steps)
+    if evaluator is not None:
+        results = evaluator.wait()
+        while results is not None:
+            log_evaluation(results)
+            results = evaluator.poll()
+        evaluator.close()
+    if args.prefetch_batches > 0:
+        replay.close()
+    if args.memory_file is not None:
+        mem.flush()
     env.close()
@@ -1,8 +1,17 @@
 """
 Adapted from https://github.com/Kaixhin/Rainbow
 """
-import random
-from collections import namedtuple
+from collections import deque
+import os
+import queue
+import threading
+import zlib
+try:
+    import lz4.frame
+    lz4_installed = True
+except ImportError:
+    lz4_installed = False
+
 import torch
 import numpy as np
 
@@ -25,7 +34,13 @@ class SegmentTree:
     Cumulative sum:   [0-3)  [3-13) [13-25) [25-29)[29-30)  [30-32)[32-40) [40-42)
 
     This structure allows us to efficiently store millions of transitions and sample from them
-    quickly.
+    quickly. Only the priorities are stored here, the transitions themselves are kept by the
+    ReplayMemory in preallocated arrays indexed by the same data index.
+
+    A min-tree with the same layout (parent nodes are the minimum of their children) is kept
+    alongside the sum-tree so that the minimum priority, i.e. the maximum importance-sampling
+    weight, of the whole memory is available in O(1). Empty leaves and 0 priorities (which are
+    never sampled) are +inf in the min-tree.
     """
     def __init__(self, size):
         self.index = 0
@@ -33,25 +48,51 @@ class SegmentTree:
         self.full = False  # Used to track actual capacity
         # Initialise fixed size tree with all (priority) zeros
         self.sum_tree = np.zeros((2 * size - 1, ), dtype=np.float32)
-        self.data = np.array([None] * size)  # Wrap-around cyclic buffer
+        self.min_tree = np.full((2 * size - 1, ), np.inf, dtype=np.float32)
         self.max = 1  # Initial max value to return (1 = 1^ω)
 
     # Propagates value up tree given a tree index
-    def _propagate(self, index, value):
-        parent = (index - 1) // 2
-        left, right = 2 * parent + 1, 2 * parent + 2
-        self.sum_tree[parent] = self.sum_tree[left] + self.sum_tree[right]
-        if parent != 0:
-            self._propagate(parent, value)
+    def _propagate(self, index):
+        while index != 0:
+            parent = (index - 1) // 2
+            left, right = 2 * parent + 1, 2 * parent + 2
+            self.sum_tree[parent] = self.sum_tree[left] + self.sum_tree[right]
+            self.min_tree[parent] = min(self.min_tree[left], self.min_tree[right])
+            index = parent
+
+    def _propagate_batch(self, indices):
+        """
+        Recomputes all the parents of the tree indices one level at a time with array operations.
+        Each node is recomputed one iteration after its updated children, so even with leaves at
+        different depths every node is last recomputed after all of its children.
+        """
+        parents = np.unique((indices - 1) // 2)
+        parents = parents[parents >= 0]
+        while len(parents):
+            left = 2 * parents + 1
+            self.sum_tree[parents] = self.sum_tree[left] + self.sum_tree[left + 1]
+            self.min_tree[parents] = np.minimum(self.min_tree[left], self.min_tree[left + 1])
+            parents = np.unique((parents - 1) // 2)
+            parents = parents[parents >= 0]
 
     # Updates value given a tree index
     def update(self, index, value):
         self.sum_tree[index] = value  # Set new value
-        self._propagate(index, value)  # Propagate value
+        self.min_tree[index] = value if value > 0 else np.inf
+        self._propagate(index)  # Propagate value
         self.max = max(value, self.max)
 
-    def append(self, data, value):
-        self.data[self.index] = data  # Store data in underlying data structure
+    # Updates values given an array of tree indices
+    def update_batch(self, indices, values):
+        indices, values = np.asarray(indices), np.asarray(values)
+        if not len(indices):
+            return
+        self.sum_tree[indices] = values  # Set new values
+        self.min_tree[indices] = np.where(values > 0, values, np.inf)
+        self._propagate_batch(indices)  # Propagate values
+        self.max = max(values.max(), self.max)
+
+    def append(self, value):
         self.update(self.index + self.size - 1, value)  # Update tree
         self.index = (self.index + 1) % self.size  # Update index
         self.full = self.full or self.index == 0  # Save when capacity reached
@@ -63,13 +104,14 @@ class SegmentTree:
         Binary search tree which returns index of the closest cumulative priority sum transition.
         Searches for the leaf with the closest value greater or equal than the input value.
         """
-        left, right = 2 * index + 1, 2 * index + 2
-        if left >= len(self.sum_tree):
-            return index
-        elif value <= self.sum_tree[left]:
-            return self._retrieve(left, value)
-        else:
-            return self._retrieve(right, value - self.sum_tree[left])
+        while True:
+            left, right = 2 * index + 1, 2 * index + 2
+            if left >= len(self.sum_tree):
+                return index
+            elif value <= self.sum_tree[left]:
+                index = left
+            else:
+                index, value = right, value - self.sum_tree[left]
 
     # Searches for a value in sum tree and returns value, data index and tree index
     def find(self, value):
@@ -77,13 +119,157 @@ class SegmentTree:
         data_index = index - self.size + 1
         return self.sum_tree[index], data_index, index  # Return value, data index, tree index
 
-    # Returns data given a data index
-    def get(self, data_index):
-        return self.data[data_index % self.size]
+    def _retrieve_batch(self, values):
+        """
+        Same search as _retrieve but for an array of values at once. All values descend the tree
+        together one level per iteration and stop once they reach a leaf (leaves can be at
+        different depths when size is not a power of 2).
+        """
+        indices = np.zeros(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        while True:
+            left = 2 * indices + 1
+            internal = left < len(self.sum_tree)
+            if internal.all():
+                left_values = self.sum_tree[left]
+                go_right = values > left_values
+                values -= left_values * go_right
+                indices = left + go_right
+            elif internal.any():
+                # Only the values which have not reached a leaf yet keep descending
+                left = left[internal]
+                left_values = self.sum_tree[left]
+                go_right = values[internal] > left_values
+                values[internal] -= left_values * go_right
+                indices[internal] = left + go_right
+            else:
+                return indices
+
+    # Searches for an array of values in sum tree and returns values, data indices and tree indices
+    def find_batch(self, values):
+        indices = self._retrieve_batch(values)
+        data_indices = indices - self.size + 1
+        return self.sum_tree[indices], data_indices, indices
 
     def total(self):
         return self.sum_tree[0]
 
+    def min(self):
+        return self.min_tree[0]
+
+
+class CompressedFrames:
+    """
+    Store of uint8 frames indexed like a (capacity, C, H, W) array, i.e. with integers, slices or
+    arrays of data indices, in which every frame is compressed separately with a fast codec (zlib at
+    its fastest level, or lz4 if installed). Consecutive ai2thor frames are very similar, so with
+    keyframe_interval > 1 a frame which is not the first of its episode is stored as its difference
+    (modulo 256) with the frame in the previous slot, which is mostly zeros and compresses much
+    better. At most keyframe_interval - 1 of these deltas are chained before a full frame (a
+    keyframe).
+
+    Reading a frame decodes the keyframe and deltas before it, once per read for all the frames
+    read together (e.g. the history and multi-step frames of a sampled batch). Before a slot is
+    overwritten, the frame after it is stored again as a keyframe if it was a delta of it, so that
+    every stored frame can always be decoded.
+    """
+    CODECS = ('zlib', 'lz4')
+
+    def __init__(self, capacity, frame_shape, timesteps, codec='zlib', keyframe_interval=1):
+        """
+        :param timesteps:         (np.ndarray) Episode timestep of the transition in every slot, as
+                                               kept by the ReplayMemory, which writes them before
+                                               the frames
+        :param codec:             (str)        'zlib' or 'lz4'
+        :param keyframe_interval: (int)        Maximum number of frames decoded to read a frame (1
+                                               to store every frame as a keyframe)
+        """
+        if codec not in self.CODECS:
+            raise ValueError('Unknown frame codec {}, choose one of {}'.format(codec, self.CODECS))
+        if codec == 'lz4' and not lz4_installed:
+            raise ImportError('The lz4 frame codec requires the lz4 package')
+        self.codec = codec
+        self.capacity = capacity
+        self.frame_shape = tuple(frame_shape)
+        self.shape = (capacity, ) + self.frame_shape
+        self.timesteps = timesteps
+        self.keyframe_interval = keyframe_interval
+        # Compressed bytes of every slot (None if it was never written)
+        self.frames = np.full(capacity, None, dtype=object)
+        # Number of deltas of every slot after its keyframe (0 for keyframes)
+        self.chain_lengths = np.zeros(capacity, dtype=np.int32)
+
+    def _compress(self, frame):
+        data = np.ascontiguousarray(frame).tobytes()
+        return zlib.compress(data, 1) if self.codec == 'zlib' else lz4.frame.compress(data)
+
+    def _decompress(self, data):
+        data = zlib.decompress(data) if self.codec == 'zlib' else lz4.frame.decompress(data)
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.frame_shape)
+
+    def _decode(self, index, cache):
+        """ Frame at the data index. Frames decoded on the way are stored in and read from cache """
+        chain = []
+        while index not in cache and self.chain_lengths[index] > 0:
+            chain.append(index)
+            index = (index - 1) % self.capacity
+        if index not in cache:
+            cache[index] = np.zeros(self.frame_shape, dtype=np.uint8) \
+                if self.frames[index] is None else self._decompress(self.frames[index])
+        frame = cache[index]
+        for index in reversed(chain):
+            frame = frame + self._decompress(self.frames[index])  # uint8 arithmetic wraps around
+            cache[index] = frame
+        return frame
+
+    def _store(self, index, frame, previous_frame=None):
+        if previous_frame is None:
+            self.frames[index] = self._compress(frame)
+            self.chain_lengths[index] = 0
+        else:
+            self.frames[index] = self._compress(frame - previous_frame)
+            self.chain_lengths[index] = self.chain_lengths[(index - 1) % self.capacity] + 1
+
+    def _indices(self, key):
+        """ Data indices of an int, slice or array key, without indexing an arange of capacity """
+        if isinstance(key, slice):
+            return np.arange(*key.indices(self.capacity))
+        return np.asarray(key) % self.capacity
+
+    def __getitem__(self, key):
+        indices = self._indices(key)
+        cache = {}
+        frames = np.empty((np.size(indices), ) + self.frame_shape, dtype=np.uint8)
+        for i, index in enumerate(np.ravel(indices)):
+            frames[i] = self._decode(index, cache)
+        return frames.reshape(np.shape(indices) + self.frame_shape)
+
+    def __setitem__(self, key, frames):
+        indices = np.ravel(self._indices(key))
+        frames = np.broadcast_to(np.asarray(frames, dtype=np.uint8),
+                                 (len(indices), ) + self.frame_shape)
+        cache = {}
+        pending = set(indices.tolist())
+        # The deltas of the overwritten frames become keyframes, decoded before any overwrite
+        for index in indices:
+            next_index = (index + 1) % self.capacity
+            if next_index not in pending and self.chain_lengths[next_index] > 0:
+                self._store(next_index, self._decode(next_index, cache))
+        for index, frame in zip(indices, frames):
+            previous = (index - 1) % self.capacity
+            if self.keyframe_interval > 1 and self.timesteps[index] > 0 and \
+                    previous not in pending and self.frames[previous] is not None and \
+                    self.chain_lengths[previous] + 1 < self.keyframe_interval:
+                self._store(index, frame, self._decode(previous, cache))
+            else:
+                self._store(index, frame)
+            cache[index] = frame
+            pending.discard(index)
+
+    def nbytes(self):
+        """ Compressed size of all the stored frames """
+        return sum(len(data) for data in self.frames if data is not None)
+
 
 class ReplayMemory:
     """ This class includes prioritized experience replay (PER) and the calculations of cumulative
@@ -117,166 +303,398 @@ class ReplayMemory:
     the total priority value.
 
     For details on how the sum-tree is used check the SegmentTree class in this script.
+
+    If frames_file is given, the frames are kept in that file through a np.memmap instead of in RAM
+    (the rest of the transitions and the priority trees are still in RAM), so that the capacity can
+    be larger than the RAM and only the pages of the sampled frames are read. flush() writes the
+    frames and saves the rest of the memory to frames_file + '.npz', and a memory created with the
+    same frames_file, e.g. when training is restarted, reopens both files as of the last flush()
+    (frames appended after it may have reached the file already, but they are overwritten again).
+
+    Otherwise, with frame_compression ('zlib' or 'lz4') the frames are kept compressed in RAM by a
+    CompressedFrames store, so that the same RAM holds several times more transitions at the cost
+    of decoding the frames of every sampled batch. See CompressedFrames for keyframe_interval.
     """
-    def __init__(self, args, capacity):
-        self.Transition = namedtuple('Transition',
-                                ('timestep', 'state', 'action', 'reward', 'nonterminal'))
-        # Blank transitions are used to fill frames missing from history or multi-step Q-learning
-        self.blank_trans = self.Transition(0, torch.zeros(args.img_channels, args.resolution[0],
-                                                          args.resolution[1], dtype=torch.uint8),
-                                           None, 0, False)
+    CHECKPOINT_CHUNK = 10000  # number of frames copied at once to and from checkpoints
+    MAX_RESAMPLES = 1000  # rounds of resampling before giving up on segments without valid samples
+
+    def __init__(self, args, capacity, frames_file=None, frame_compression=None,
+                 keyframe_interval=1):
         self.device = args.device
         self.capacity = capacity
         self.history = args.history_length
         self.discount = args.discount
         self.multi_step = args.multi_step
+        # Discount factors γ^k of the truncated n-step return, k = 0, ..., n - 1
+        self.n_step_scaling = np.array([self.discount ** k for k in range(self.multi_step)],
+                                       dtype=np.float32)
         # Initial importance sampling weight β, annealed to 1 over course of training
         self.priority_weight = args.priority_weight
         # Priority exponent α
         self.priority_exponent = args.priority_exponent
         self.t = 0  # Internal episode timestep counter
-        # Store transitions in a wrap-around cyclic buffer within a sum tree for querying priorities
+        self.num_appends = 0  # Total number of transitions ever appended
+        # Priorities of the transitions are kept within a sum tree with the same cyclic index
         self.transitions = SegmentTree(capacity)
         self.channels = args.img_channels
+        self.frame_shape = (args.img_channels, args.resolution[0], args.resolution[1])
+        """Transitions are stored in a wrap-around cyclic buffer made of preallocated contiguous
+        arrays, one per field, all indexed by the data index of the sum tree. Only the last frame of
+        each state is stored (discretised to uint8) and the history is rebuilt when sampling.
+        np.zeros does not touch the memory until it is written, so the resident memory grows with
+        the number of stored transitions rather than with the capacity.
+        """
+        self.timesteps = np.zeros(capacity, dtype=np.int32)
+        self.frames_file = frames_file
+        if frames_file is not None and frame_compression is not None:
+            raise ValueError('Frames kept in a frames_file cannot be compressed')
+        if frame_compression is not None:
+            self.states = CompressedFrames(capacity, self.frame_shape, self.timesteps,
+                                           frame_compression, keyframe_interval)
+        elif frames_file is not None:
+            self.states = self._open_frames_file(frames_file)
+        else:
+            self.states = np.zeros((capacity, ) + self.frame_shape, dtype=np.uint8)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.nonterminals = np.zeros(capacity, dtype=np.bool_)
+        # Stacked states of the whole memory built by state_batches(), e.g. for the validation
+        # memory
+        self.stacked_states = None
+        # num_appends when each checkpoint directory was last saved, to only write the new frames
+        self.checkpoints = {}
+        if frames_file is not None and os.path.exists(self.metadata_file):
+            with np.load(self.metadata_file) as metadata:
+                self.load_metadata(metadata)
+
+    @property
+    def metadata_file(self):
+        return self.frames_file + '.npz'
+
+    @staticmethod
+    def _checkpoint_frames_file(directory):
+        return os.path.join(directory, 'frames.uint8')
+
+    def _uses_frames_file(self, frames_file):
+        return self.frames_file is not None and os.path.exists(frames_file) and \
+            os.path.samefile(self.frames_file, frames_file)
+
+    def _open_frames_file(self, frames_file):
+        """
+        Memory maps the frames file, which is created (sparse, so it takes no disk space until
+        written) if it does not exist yet. An existing file must have the size of this memory
+        """
+        shape = (self.capacity, ) + self.frame_shape
+        if not os.path.exists(frames_file):
+            return np.memmap(frames_file, dtype=np.uint8, mode='w+', shape=shape)
+        if os.path.getsize(frames_file) != np.prod(shape):
+            raise ValueError('Frames file {} of {} bytes does not match a memory of shape '
+                             '{}'.format(frames_file, os.path.getsize(frames_file), shape))
+        return np.memmap(frames_file, dtype=np.uint8, mode='r+', shape=shape)
+
+    def metadata(self):
+        """ Everything stored in the memory apart from the frames, as a dict of numpy arrays """
+        return dict(timesteps=self.timesteps, actions=self.actions, rewards=self.rewards,
+                    nonterminals=self.nonterminals, sum_tree=self.transitions.sum_tree,
+                    min_tree=self.transitions.min_tree, index=self.transitions.index,
+                    full=self.transitions.full, max=self.transitions.max, t=self.t,
+                    num_appends=self.num_appends, priority_weight=self.priority_weight)
+
+    def load_metadata(self, metadata):
+        if len(metadata['timesteps']) != self.capacity:
+            raise ValueError('Metadata of a memory of capacity {} cannot be loaded into a '
+                             'memory of capacity {}'.format(len(metadata['timesteps']),
+                                                            self.capacity))
+        for name in ('timesteps', 'actions', 'rewards', 'nonterminals'):
+            getattr(self, name)[:] = metadata[name]
+        self.transitions.sum_tree[:] = metadata['sum_tree']
+        self.transitions.min_tree[:] = metadata['min_tree']
+        self.transitions.index = int(metadata['index'])
+        self.transitions.full = bool(metadata['full'])
+        self.transitions.max = float(metadata['max'])
+        self.t = int(metadata['t'])
+        self.num_appends = int(metadata['num_appends'])
+        self.priority_weight = float(metadata['priority_weight'])
+        self.stacked_states = None
+
+    def flush(self):
+        """
+        Writes the frames to frames_file and the rest of the memory to frames_file + '.npz', written
+        to a temporary file first so that a crash never leaves a partially written metadata file
+        """
+        if self.frames_file is None:
+            raise ValueError('Only memories with a frames_file can be flushed')
+        self.states.flush()
+        self._save_metadata(self.metadata_file)
+
+    def _save_metadata(self, metadata_file):
+        temporary_file = metadata_file + '.tmp'
+        with open(temporary_file, 'wb') as f:
+            np.savez(f, **self.metadata())
+        os.replace(temporary_file, metadata_file)
+
+    def save_checkpoint(self, directory):
+        """
+        Saves the whole memory into directory, as a frames file and its metadata in the same format
+        as a memory with frames_file, so that training can be resumed with load_checkpoint. Only the
+        frames appended since the last checkpoint into the same directory are written, and a memory
+        whose frames_file is the one of the checkpoint is just flushed. The frames are written in
+        place before the metadata, so a checkpoint interrupted while writing them is not consistent
+        and must not be loaded: algorithms/rainbow/checkpoint.py alternates between two directories
+        and only points to one once it is complete.
+        """
+        frames_file = self._checkpoint_frames_file(directory)
+        if self._uses_frames_file(frames_file):
+            self.flush()
+        else:
+            if directory in self.checkpoints and os.path.exists(frames_file):
+                num_new = min(self.num_appends - self.checkpoints[directory], self.capacity)
+            else:
+                num_new = self.capacity if self.transitions.full else self.transitions.index
+            # The new frames are the num_new slots before the index of the cyclic buffer
+            indices = (self.transitions.index - num_new + np.arange(num_new)) % self.capacity
+            frames = self._open_frames_file(frames_file)
+            # In chunks, since reading compressed frames decodes them into a new array
+            for start in range(0, num_new, self.CHECKPOINT_CHUNK):
+                chunk = indices[start:start + self.CHECKPOINT_CHUNK]
+                frames[chunk] = self.states[chunk]
+            frames.flush()
+            del frames
+            self._save_metadata(frames_file + '.npz')
+        self.checkpoints[directory] = self.num_appends
+
+    def load_checkpoint(self, directory):
+        """ Restores a memory saved with save_checkpoint into this memory of the same capacity """
+        frames_file = self._checkpoint_frames_file(directory)
+        with np.load(frames_file + '.npz') as metadata:
+            self.load_metadata(metadata)
+        if not self._uses_frames_file(frames_file):
+            frames = np.memmap(frames_file, dtype=np.uint8, mode='r',
+                               shape=(self.capacity, ) + self.frame_shape)
+            # Only the stored slots are read, the rest of the frames file was never written
+            num_stored = self.capacity if self.transitions.full else self.transitions.index
+            for start in range(0, num_stored, self.CHECKPOINT_CHUNK):
+                end = min(start + self.CHECKPOINT_CHUNK, num_stored)
+                self.states[start:end] = frames[start:end]
+            del frames
+        # Other checkpoint directories may hold the frames of another run, they are written again
+        self.checkpoints = {directory: self.num_appends}
 
     # Adds state and action at time t, reward and terminal at time t + 1
     def append(self, state, action, reward, terminal):
-        state = state[-self.channels:, ...].mul(255).to(dtype=torch.uint8,
-                                                        device=torch.device('cpu'))
-        state = state if len(state.shape) == 3 else state.unsqueeze(0)
+        state = state[-self.channels:, ...]
+        if state.dtype != torch.uint8:
+            state = state.mul(255)
         # Only store last frame and discretise to save memory
-        self.transitions.append(self.Transition(self.t, state, action, reward, not terminal),
-                                self.transitions.max)  # Store new transition with maximum priority
+        state = state.to(dtype=torch.uint8, device=torch.device('cpu'))
+        index = self.transitions.index
+        self.timesteps[index] = self.t
+        self.states[index] = state.numpy()
+        # actions and rewards are not needed (None) for validation memories
+        self.actions[index] = 0 if action is None else action
+        self.rewards[index] = 0 if reward is None else reward
+        self.nonterminals[index] = not terminal
+        self.transitions.append(self.transitions.max)  # Store new transition with maximum priority
         self.t = 0 if terminal else self.t + 1  # Start new episodes with t = 0
+        self.num_appends += 1
+        self.stacked_states = None
 
-    def _get_transition(self, idx):
+    def append_batch(self, timesteps, states, actions, rewards, nonterminals, priorities):
         """
-        Return the idx-th transition in the SegmentTree memory information for multi-step DQN. This
-        includes the transitions from t - self.history  to t + self.multi_step (multi-steps). If a
-        terminal state is reached on the process or there are no previous states to time t, the
-        missing transitions will be filled with blank transitions as defined in self.blank_trans
+        Appends consecutive transitions already discretised and with their own episode timesteps
+        and initial priorities, e.g. the chunks sent by the Ape-X actors in apex.py. Transitions
+        with priority 0 are stored only as history or multi-step context of their neighbours and are
+        never sampled.
         """
-        transition = np.array([None] * (self.history + self.multi_step))
+        indices = (self.transitions.index + np.arange(len(timesteps))) % self.capacity
+        self.timesteps[indices] = timesteps
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.nonterminals[indices] = nonterminals
+        self.transitions.update_batch(indices + self.capacity - 1,
+                                      np.power(priorities, self.priority_exponent))
+        self.transitions.index = (self.transitions.index + len(timesteps)) % self.capacity
+        self.transitions.full = self.transitions.full or \
+            self.num_appends + len(timesteps) >= self.capacity
+        self.num_appends += len(timesteps)
+        self.stacked_states = None
+
+    def _get_transitions(self, idxs):
+        """
+        Return the data indices of the idxs transitions in the SegmentTree memory information for
+        multi-step DQN. This includes the transitions from t - self.history  to t + self.multi_step
+        (multi-steps) of each idx. If a terminal state is reached on the process or there are no
+        previous states to time t, the missing transitions are marked as blank, i.e. zero frames,
+        rewards and timesteps and terminal.
+        :return: (indices, blank) arrays of shape batch_size x (self.history + self.multi_step)
+        """
+        indices = (idxs[:, np.newaxis] +
+                   np.arange(-self.history + 1, self.multi_step + 1)) % self.capacity
+        blank = np.zeros(indices.shape, dtype=np.bool_)
         # idx is the last transition in history
-        transition[self.history - 1] = self.transitions.get(idx)
-        # fill in previous transitions of history
-        for t in range(self.history - 2, -1, -1):  # e.g. 2 1 0
-            # check if next transition is terminal/first step
-            if transition[t + 1].timestep == 0:
-                transition[t] = self.blank_trans  # If future frame has timestep 0
-            else:
-                transition[t] = self.transitions.get(idx - self.history + 1 + t)
+        """Previous transitions of history are blank if any of the transitions after them (up to
+        idx) is the first step of an episode (timestep 0), e.g. for history 4:
+        timesteps [3, 0, 1, 2] -> blank [True, False, False, False]
+        """
+        first_steps = self.timesteps[indices[:, 1:self.history]] == 0
+        blank[:, :self.history - 1] = np.flip(np.cumsum(np.flip(first_steps, 1), 1), 1) > 0
         """Fill in the history of the future for multi-step transitions. As a reminder, from the
         present frame we move self.multi_step extra transitions and the last one is considered to be
-        the state index, because it is the one we want to estimate Q from.
+        the state index, because it is the one we want to estimate Q from. Future transitions are
+        blank if any of the transitions before them (from idx) is terminal.
         """
-        for t in range(self.history, self.history + self.multi_step):  # e.g. 4 5 6
-            if transition[t - 1].nonterminal:
-                transition[t] = self.transitions.get(idx - self.history + 1 + t)
-            else:
-                transition[t] = self.blank_trans  # If prev/next frame is terminal
-        return transition
+        terminals = ~self.nonterminals[indices[:, self.history - 1:-1]]
+        blank[:, self.history:] = np.cumsum(terminals, 1) > 0
+        return indices, blank
 
-    def _get_sample_from_segment(self, segment_prob, i):
+    def _get_samples_from_segments(self, batch_size, p_total):
         """
-        Returns a valid sample from a segment.
+        Returns a valid sample from each of the batch_size segments.
         Splitting the memory in segments of segment_size, we sample uniformly from the ith segment
         and return the following information:
 
-        prob: Transition priority (unnormalized probability)
-        idx: Index of the transition sorted by time-step
-        tree_idx: Index of the transition sorted by priority (index within the SegmentTree)
-        (state, action, R, next_state): Transition information
-        nonterminal: 1 if the episode doesn't end after or during the n-multi-steps
+        probs: Transition priorities (unnormalized probabilities)
+        idxs: Indices of the transitions sorted by time-step
+        tree_idxs: Indices of the transitions sorted by priority (indices within the SegmentTree)
 
         priority
         ^
         |  <---33---><-----33-----><-----33---->   Every segment sums up to the same total priority
         |         |                      |         defined by segment_prob input
-        |         |        |             |         This function samples uniformly from the ith
-        |    |   ||  |     |             |         segment.
+        |         |        |             |         This function samples uniformly from each
+        |    |   ||  |     |             |         segment at once.
         |    |   ||  |     |  |      ||  |
         |  | |  ||||||     | ||   |  ||| |   | |
         |  |||||||||||||   ||||  ||||||| | | | |
         |  |||||||||||||||||||||||||||||||||||||
         |-----------------------------------------> sample index
         """
-        valid = False
-        while not valid:
-            # Uniformly sample an element from within a segment
-            sample = np.random.uniform(i * segment_prob, (i + 1) * segment_prob)
-            # Retrieve sample transition by the cumulative sum of priorities value from the tree
+        segment_prob = p_total / batch_size
+        segment_starts = np.arange(batch_size) * segment_prob
+        probs = np.zeros(batch_size, dtype=np.float32)
+        idxs, tree_idxs = np.zeros(batch_size, dtype=np.int64), np.zeros(batch_size, dtype=np.int64)
+        invalid = np.ones(batch_size, dtype=np.bool_)
+        for _ in range(self.MAX_RESAMPLES):
+            if not invalid.any():
+                break
+            # Uniformly sample an element from within each segment still without a valid sample
+            samples = np.random.uniform(0, segment_prob, invalid.sum()) + segment_starts[invalid]
+            # Retrieve sample transitions by the cumulative sum of priorities value from the tree
             # with un-normalised probability
-            prob, idx, tree_idx = self.transitions.find(sample)
+            probs[invalid], idxs[invalid], tree_idxs[invalid] = self.transitions.find_batch(samples)
             """Resample if transition hasn't got at least self.history valid transitions before or
             self.multi_step transitions after it. Also checks that the priority of the sampled 
             transition is not 0, which would mean that we should ignore it entirely.
+            Note that conditions are valid but extra conservative around buffer index 0
             """
-            if (self.transitions.index - idx) % self.capacity > self.multi_step and \
-                    (idx - self.transitions.index) % self.capacity >= self.history and prob != 0:
-                # Note that conditions are valid but extra conservative around buffer index 0
-                valid = True
+            invalid = ((self.transitions.index - idxs) % self.capacity <= self.multi_step) | \
+                      ((idxs - self.transitions.index) % self.capacity < self.history) | \
+                      (probs == 0)
+        if invalid.any():
+            raise ValueError('No valid transition found in {} of the {} segments after {} samples, '
+                             'e.g. when a segment only covers the transitions around the index of '
+                             'the memory. Use a smaller batch size or sample once more transitions '
+                             'are stored'.format(invalid.sum(), batch_size, self.MAX_RESAMPLES))
+        return probs, idxs, tree_idxs
+
+    def _to_device(self, array, pin_memory=False):
+        """ Copies a numpy array to the device, through page-locked memory if pin_memory """
+        tensor = torch.from_numpy(array)
+        if pin_memory and self.device.type == 'cuda':
+            return tensor.pin_memory().to(device=self.device, non_blocking=True)
+        return tensor.to(device=self.device)
 
+    def _get_batch(self, idxs, pin_memory=False):
+        """
+        Builds the (states, actions, returns, next_states, nonterminals) of the transitions stored
+        at the data indices idxs
+        """
         # Retrieve all required transition data (from t - history_length to t + multi_step)
-        transition = self._get_transition(idx)
-        # Create un-discretised (float) state and nth next state
-        state = torch.cat([trans.state for trans in transition[:self.history]], 0).to(
-            dtype=torch.float32, device=self.device).div_(255)
-        next_state = torch.cat(
-            [trans.state
-             for trans in transition[self.multi_step: (self.multi_step + self.history)]], 0).to(
-            dtype=torch.float32, device=self.device).div_(255)
-        # Discrete action to be used as index
-        action = torch.tensor([transition[self.history - 1].action], dtype=torch.int64,
-                              device=self.device)
-        # Calculate truncated n-step discounted return R^n = Σ_k=0->n-1 (γ^k)R_t+k+1
+        indices, blank = self._get_transitions(idxs)
+        frames = self.states[indices]  # len(idxs) x (history + multi_step) x C x H x W
+        frames[blank] = 0
+        frames = self._to_device(frames, pin_memory)
+        # Create discretised (uint8) states and nth next states. They are normalised by the model
+        states = frames[:, :self.history].reshape((len(idxs), -1) + self.frame_shape[1:])
+        next_states = frames[:, self.multi_step:(self.multi_step + self.history)].reshape(
+            (len(idxs), -1) + self.frame_shape[1:])
+        # Discrete actions to be used as index
+        actions = self._to_device(self.actions[idxs], pin_memory)
+        # Calculate truncated n-step discounted returns R^n = Σ_k=0->n-1 (γ^k)R_t+k+1
         # (note that invalid nth next states have reward 0)
-        R = torch.tensor([sum(self.discount ** n * transition[self.history + n - 1].reward
-                              for n in range(self.multi_step))],
-                         dtype=torch.float32, device=self.device)
+        rewards = np.where(blank, 0, self.rewards[indices])[:, self.history - 1:-1]
+        returns = self._to_device(rewards @ self.n_step_scaling, pin_memory)
         # Mask for non-terminal nth next states (final state)
-        nonterminal = torch.tensor([transition[self.history + self.multi_step - 1].nonterminal],
-                                   dtype=torch.float32, device=self.device)
-
-        return prob, idx, tree_idx, state, action, R, next_state, nonterminal
+        nonterminals = ~blank[:, -1:] & self.nonterminals[indices[:, -1:]]
+        nonterminals = self._to_device(nonterminals.astype(np.float32), pin_memory)
+        return states, actions, returns, next_states, nonterminals
 
-    def sample(self, batch_size):
+    def sample(self, batch_size, pin_memory=False):
         """
         To sample batch_size transitions, the range [0, p_total] is divided equally into batch_size
         ranges. Next, a value is uniformly sampled from each range. Finally the transitions that
         correspond to each of these sampled values are retrieved from the sum-tree.
         Note that for efficiency reasons sampling is not done according to the priorities, i.e.
         prioritizing transitions with a higher prediction error which we can learn more from.
+
+        The whole batch is built with array operations: the frames of all the transitions
+        (from t - history_length to t + multi_step) are gathered at once from the frames array and
+        copied once to the device, where states and next states are views of them.
+        If pin_memory, the batch is copied asynchronously from page-locked memory (CUDA only).
         """
         # Retrieve sum of all priorities (used to create a normalised probability distribution)
         p_total = self.transitions.total()
-        # Batch size number of segments, based on sum over all probabilities
-        segment_prob = p_total / batch_size
         # Get batch of valid consecutive samples.
-        batch = [self._get_sample_from_segment(segment_prob, i) for i in range(batch_size)]
-        probs, idxs, tree_idxs, states, actions, returns, next_states, nonterminals = zip(*batch)
-        states, next_states, = torch.stack(states), torch.stack(next_states)
-        actions, returns, nonterminals = torch.cat(actions), torch.cat(returns), \
-                                         torch.stack(nonterminals)
+        probs, idxs, tree_idxs = self._get_samples_from_segments(batch_size, p_total)
+        states, actions, returns, next_states, nonterminals = self._get_batch(idxs, pin_memory)
         # Calculate normalised probabilities
-        probs = np.array(probs, dtype=np.float32) / p_total
+        probs = probs / p_total
         capacity = self.capacity if self.transitions.full else self.transitions.index
         # Compute importance-sampling normalized weights w_j = w_i / max(w_i)
         # where w_i = (N * P(j))^−β)
         weights = (capacity * probs) ** -self.priority_weight
-        # Normalise by max importance-sampling weight from batch
-        # w_j = w_i / max(w_i)
-        weights = torch.tensor(weights / weights.max(), dtype=torch.float32, device=self.device)
+        # Normalise by max importance-sampling weight of the whole memory, which is the weight of
+        # the minimum priority: w_j = w_i / max(w_i)
+        max_weight = (capacity * self.transitions.min() / p_total) ** -self.priority_weight
+        weights = self._to_device((weights / max_weight).astype(np.float32), pin_memory)
         return tree_idxs, states, actions, returns, next_states, nonterminals, weights
 
-    def update_priorities(self, idxs, priorities):
+    def update_priorities(self, idxs, priorities, sampled_at=None):
         """
         Original formula for priorities P(i) = p_i ** α / sum_k(p_k ** α).
         We can ignore the constant sum of all elements since we are interested in retrieving the
         highest/lowest values
+        :param sampled_at: (int) num_appends when the batch of idxs was sampled. If given, the
+                                 priorities of the transitions overwritten since then are skipped,
+                                 since they belong to a different transition now
         """
+        if sampled_at is not None:
+            # data indices written since the batch was sampled (tree idx = data idx + capacity - 1)
+            idxs, priorities = np.asarray(idxs), np.asarray(priorities)
+            age = (self.transitions.index - 1 - (idxs - self.capacity + 1)) % self.capacity
+            keep = age >= self.num_appends - sampled_at
+            idxs, priorities = idxs[keep], priorities[keep]
         priorities = np.power(priorities, self.priority_exponent)
-        [self.transitions.update(idx, priority) for idx, priority in zip(idxs, priorities)]
+        self.transitions.update_batch(idxs, priorities)
+
+    def state_batches(self, batch_size):
+        """
+        Yields the stacked (uint8) states of every slot of the memory in batches of batch_size, in
+        the same order as iterating over the memory. The states are built once with array
+        operations and kept on the device until a new transition is appended, so evaluating a
+        validation memory, which never changes during training, is only a few forward passes.
+        """
+        if self.stacked_states is None:
+            # As in __next__, the frame k steps before each state is blank if its timestep is < k
+            steps_back = np.arange(self.history - 1, -1, -1)
+            indices = (np.arange(self.capacity)[:, np.newaxis] - steps_back) % self.capacity
+            frames = self.states[indices]  # capacity x history x C x H x W
+            frames[self.timesteps[:, np.newaxis] < steps_back] = 0
+            self.stacked_states = self._to_device(frames).reshape(
+                (self.capacity, -1) + self.frame_shape[1:])
+        for start in range(0, self.capacity, batch_size):
+            yield self.stacked_states[start:start + batch_size]
 
     # Set up internal state for iterator
     def __iter__(self):
@@ -289,8 +707,8 @@ class ReplayMemory:
             raise StopIteration
         # Create stack of states
         state_stack = [None] * self.history
-        state_stack[-1] = self.transitions.data[self.current_idx].state
-        prev_timestep = self.transitions.data[self.current_idx].timestep
+        state_stack[-1] = self.states[self.current_idx]
+        prev_timestep = self.timesteps[self.current_idx]
         # check in the whole history
         for t in reversed(range(self.history - 1)):  # e.g. 2 1 0
             """Terminal states are indicated by having timestep 0. Since we always sample             
@@ -299,12 +717,93 @@ class ReplayMemory:
             stack enough frames
             """
             if prev_timestep == 0:
-                state_stack[t] = self.blank_trans.state  # If future frame has timestep 0
+                # If future frame has timestep 0
+                state_stack[t] = np.zeros(self.frame_shape, dtype=np.uint8)
             else:
-                state_stack[t] = \
-                  self.transitions.data[self.current_idx + t - self.history + 1].state
+                state_stack[t] = self.states[self.current_idx + t - self.history + 1]
                 prev_timestep -= 1
-        # Concatenate images to return a single state
-        state = torch.cat(state_stack, 0).to(dtype=torch.float32, device=self.device).div_(255)
+        # Concatenate images to return a single (uint8) state
+        state = torch.from_numpy(np.concatenate(state_stack, 0)).to(device=self.device)
         self.current_idx += 1
         return state
+
+
+class PrefetchSampler:
+    """
+    Prepares the next batches of a ReplayMemory in a background thread while the current batch is
+    used for training, so that the learner does not wait for mem.sample before every gradient step.
+    It exposes the same append, sample and update_priorities methods as the ReplayMemory, so it can
+    be passed directly to Agent.learn.
+
+    Batches are prefetched up to queue_depth steps ahead and therefore are sampled with priorities
+    up to queue_depth learn steps old. The memory is only accessed while holding a lock, and the
+    priority updates of each batch are applied in the order the batches were returned. The
+    priorities of transitions overwritten by newer appends since their batch was sampled are
+    skipped, since they belong to a different transition now. An exception raised while sampling
+    stops the thread and is raised again by the next call to sample.
+    """
+    def __init__(self, memory, batch_size, queue_depth=2):
+        """
+        :param memory:      (ReplayMemory) Memory to sample from
+        :param batch_size:  (int)          Size of every prefetched batch
+        :param queue_depth: (int)          Number of batches prepared ahead of the learner
+        """
+        self.memory = memory
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.batches = queue.Queue(maxsize=queue_depth)
+        # number of appends when each returned batch was sampled, to find overwritten transitions
+        self.sampled_at = deque()
+        self.stop_event = threading.Event()
+        self.thread, self.error = None, None
+
+    def _prefetch(self):
+        """ Background thread target. Errors are raised in the main thread by sample """
+        try:
+            while not self.stop_event.is_set():
+                with self.lock:
+                    # pinned memory lets the host to device copy run asynchronously on CUDA
+                    batch = self.memory.sample(self.batch_size, pin_memory=True)
+                    num_appends = self.memory.num_appends
+                while not self.stop_event.is_set():
+                    try:
+                        self.batches.put((num_appends, batch), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        except BaseException as error:
+            self.error = error
+
+    def append(self, state, action, reward, terminal):
+        with self.lock:
+            self.memory.append(state, action, reward, terminal)
+
+    def sample(self, batch_size):
+        """ Returns the next prefetched batch. The thread is started on the first call """
+        if batch_size != self.batch_size:
+            raise ValueError('PrefetchSampler prepares batches of size {} but {} was '
+                             'requested'.format(self.batch_size, batch_size))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._prefetch, daemon=True)
+            self.thread.start()
+        while True:
+            try:
+                num_appends, batch = self.batches.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.error is not None:
+                    raise self.error
+                if not self.thread.is_alive():
+                    raise RuntimeError('PrefetchSampler thread stopped')
+        self.sampled_at.append(num_appends)
+        return batch
+
+    def update_priorities(self, idxs, priorities):
+        """ Updates the priorities of the oldest returned batch without updated priorities """
+        with self.lock:
+            self.memory.update_priorities(idxs, priorities, sampled_at=self.sampled_at.popleft())
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -3,6 +3,7 @@ Adapted from https://github.com/Kaixhin/Rainbow
 
 Model definition definition for DQN and Noisy layers
 """
+import copy
 import math
 import torch
 from torch import nn
@@ -32,7 +33,10 @@ class RainbowDQN(nn.Module):
         self.fc_z_a = NoisyLinear(args.hidden_size, self.action_space * self.num_atoms,
                                   std_init=args.noisy_std)
 
-    def forward(self, x, log=False):
+    def forward(self, x: torch.Tensor, log: bool = False):
+        if x.dtype == torch.uint8:
+            # States are kept as uint8 from the env to the replay memory and only normalised here
+            x = x.float().div_(255)
         x = F.relu(self.conv1(x))
         x = F.relu(self.conv2(x))
         x = F.relu(self.conv3(x))
@@ -77,6 +81,46 @@ class RainbowDQN(nn.Module):
         return linear_size
 
 
+class QValueNet(nn.Module):
+    """
+    Inference-only network returning the expected Q-values (batch_size x num_actions) of a
+    RainbowDQN, i.e. the mean of each action distribution Z over the support. The noisy layers are
+    folded into plain linear layers with their mean weights (weight_mu, bias_mu), which is what
+    they compute in evaluation mode, so the module can be compiled with TorchScript.
+    """
+    def __init__(self, dqn, support):
+        super().__init__()
+        self.dqn = copy.deepcopy(dqn).eval()
+        for name, module in self.dqn.named_children():
+            if isinstance(module, NoisyLinear):
+                setattr(self.dqn, name, module.fold())
+        self.register_buffer('support', support.clone())
+        for param in self.parameters():
+            param.requires_grad = False
+
+    def forward(self, x):
+        return (self.dqn(x) * self.support).sum(2)
+
+
+def compile_q_value_net(dqn, support, mode='script', example_input=None):
+    """
+    Builds a QValueNet from the current weights of dqn
+    :param mode:          (str) 'eager' to run it as it is, 'script' to compile it with
+                          torch.jit.script or 'trace' to compile it with torch.jit.trace
+    :param example_input: (torch.Tensor) batch of states used for tracing. The dtype of the states
+                          (uint8 or float32) is fixed in the traced graph
+    """
+    q_net = QValueNet(dqn, support)
+    if mode == 'script':
+        return torch.jit.script(q_net)
+    elif mode == 'trace':
+        with torch.no_grad():
+            return torch.jit.trace(q_net, example_input)
+    elif mode == 'eager':
+        return q_net
+    raise ValueError('Unknown inference mode: {}'.format(mode))
+
+
 class NoisyLinear(nn.Module):
     """
     From the paper "Noisy Networks for exploration"
@@ -147,6 +191,14 @@ class NoisyLinear(nn.Module):
         self.weight_epsilon.copy_(epsilon_out.ger(epsilon_in))  # outer product e_j x e_i
         self.bias_epsilon.copy_(epsilon_out)
 
+    def fold(self):
+        """ Plain linear layer with the mean weights, as this layer computes in evaluation mode """
+        linear = nn.Linear(self.in_features, self.out_features).to(self.weight_mu.device)
+        with torch.no_grad():
+            linear.weight.copy_(self.weight_mu)
+            linear.bias.copy_(self.bias_mu)
+        return linear
+
     def forward(self, layer_input):
         # PyTorch nn.Module have an attribute self.training to indicate training or evaluation mode
         # You can switch between training and evaluation with dqn.train() or dqn.eval()
@@ -4,7 +4,9 @@ Adapted from https://github.com/Kaixhin/Rainbow
 Functions for testing Rainbow and saving graphics of statistics for rewards and Q during the
 evaluation period
 """
+import copy
 import os
+import threading
 import warnings
 try:
     import plotly
@@ -14,9 +16,12 @@ try:
 except ImportError:
     warnings.warn("Error importing plotly. No plots will be saved on evaluation")
     plotly_installed = False
+import numpy as np
 import torch
 
-from algorithms.rainbow.env import Env
+from algorithms.rainbow.env import Env, VectorFrameStackEnv
+from algorithms.rainbow.model import compile_q_value_net
+from gym_ai2thor.envs.vector_env import VectorAI2ThorEnv
 
 """ Global variables used to track the evaluation results
 eval_steps       - list of evaluation steps at each evaluation period
@@ -35,9 +40,7 @@ def test(env, num_steps, args, dqn, val_mem, evaluate_only=False):
     multiple rendering options, e.g. having the option of training without rendering for efficiency
     reasons and testing with rendering.
     """
-    global eval_steps, rewards, Qs, best_avg_reward
-    eval_steps.append(num_steps)
-    step_rewards, step_Qs = [], []
+    step_rewards = []
     if args.game != 'ai2thor':
         env = Env(args)
     # Test performance over several episodes
@@ -62,9 +65,22 @@ def test(env, num_steps, args, dqn, val_mem, evaluate_only=False):
     if args.game != 'ai2thor':
         env.close()
     # Test Q-values over validation memory completely independently of evaluation episodes
-    for state in val_mem:  # Iterate over valid states
-        step_Qs.append(dqn.evaluate_q(state))
+    step_Qs = []
+    for states in val_mem.state_batches(args.evaluation_batch_size):  # Batches of valid states
+        step_Qs.extend(dqn.evaluate_q_batch(states).tolist())
+
+    return record_results(num_steps, step_rewards, step_Qs, dqn.online_net.state_dict(),
+                          evaluate_only)
 
+
+def record_results(num_steps, step_rewards, step_Qs, state_dict, evaluate_only=False):
+    """
+    Appends the rewards and Qs of an evaluation period to the global results, plots them and saves
+    the network parameters state_dict if the average reward improved
+    :return: (avg_reward, avg_Q)
+    """
+    global eval_steps, rewards, Qs, best_avg_reward
+    eval_steps.append(num_steps)
     avg_reward, avg_Q = sum(step_rewards) / len(step_rewards), sum(step_Qs) / len(step_Qs)
     if not evaluate_only:
         # Append to results
@@ -79,12 +95,138 @@ def test(env, num_steps, args, dqn, val_mem, evaluate_only=False):
         # Save model parameters if improved
         if avg_reward > best_avg_reward:
             best_avg_reward = avg_reward
-            dqn.save(path='weights', filename='rainbow_{}.pt'.format(num_steps))
+            torch.save(state_dict, os.path.join('weights', 'rainbow_{}.pt'.format(num_steps)))
 
     # Return average reward and Q-value
     return avg_reward, avg_Q
 
 
+class ParallelEvaluator:
+    """
+    Runs the evaluation episodes of test() concurrently on a VectorAI2ThorEnv, i.e. on num_envs
+    worker processes with their own controller, instead of sequentially on the training env.
+    Actions are chosen ε-greedily for all the envs at once with a single forward pass of a snapshot
+    of the online network taken when the evaluation starts (noisy layers folded as in evaluation
+    mode), so with asynchronous=True the evaluation runs in a background thread while training
+    continues.
+
+    The episodes are split evenly between the envs. As in test(), episodes which do not finish
+    within max_episode_length steps are not counted. The envs that already ran their share of
+    episodes keep stepping in lockstep with the rest but their results are ignored.
+    """
+    def __init__(self, args, num_envs, asynchronous=False, config_dict=None, start_method=None):
+        """
+        :param args:         (argparse.Namespace) Rainbow arguments of main.py
+        :param num_envs:     (int)  Number of evaluation envs (one subprocess each)
+        :param asynchronous: (bool) Run the evaluations in a background thread
+        :param config_dict:  (dict) Overrides fields of args.config_file for the evaluation envs
+        :param start_method: (str)  multiprocessing start method of the VectorAI2ThorEnv
+        """
+        self.args = args
+        self.asynchronous = asynchronous
+        self.env = VectorFrameStackEnv(
+            VectorAI2ThorEnv(num_envs, seed=args.seed + 1, config_file=args.config_file,
+                             config_dict=config_dict, start_method=start_method),
+            args.history_length, args.device)
+        self.random_state = np.random.RandomState(args.seed)
+        self.thread, self.error = None, None
+        # (num_steps, step_rewards, step_Qs, state_dict) of the evaluations not collected yet
+        self.results = []
+        # (reward, length) of every finished episode of the last evaluation
+        self.episode_stats = []
+
+    def start(self, num_steps, dqn, val_mem):
+        """
+        Starts evaluating a snapshot of the current online network of dqn, after waiting for the
+        previous evaluation if it is still running. Synchronous evaluators return when finished
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        snapshot = copy.deepcopy(dqn.online_net).eval()
+        for param in snapshot.parameters():
+            param.requires_grad = False
+        if self.asynchronous:
+            self.thread = threading.Thread(target=self._run,
+                                           args=(num_steps, snapshot, dqn.support, val_mem))
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self._evaluate(num_steps, snapshot, dqn.support, val_mem)
+
+    def poll(self):
+        """
+        :return: (num_steps, step_rewards, step_Qs, state_dict) of the oldest finished evaluation
+                 not collected yet or None
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return self.results.pop(0) if self.results else None
+
+    def wait(self):
+        """ Waits for the running evaluation, if any, and returns the same as poll """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return self.poll()
+
+    def evaluate(self, num_steps, dqn, val_mem, evaluate_only=False):
+        """ Evaluates until finished and records the results as test(). Returns the same as test """
+        self.start(num_steps, dqn, val_mem)
+        num_steps, step_rewards, step_Qs, state_dict = self.wait()
+        return record_results(num_steps, step_rewards, step_Qs, state_dict, evaluate_only)
+
+    def _run(self, *args):
+        """ Background thread target. Errors are raised in the main thread by poll """
+        try:
+            self._evaluate(*args)
+        except Exception as error:
+            self.error = error
+
+    def _evaluate(self, num_steps, snapshot, support, val_mem, epsilon=0.001):
+        args, num_envs = self.args, self.env.num_envs
+        episodes_per_env = np.array([args.evaluation_episodes // num_envs +
+                                     (rank < args.evaluation_episodes % num_envs)
+                                     for rank in range(num_envs)])
+        finished_episodes = np.zeros(num_envs, dtype=np.int64)
+        reward_sums = np.zeros(num_envs, dtype=np.float64)
+        episode_lengths = np.zeros(num_envs, dtype=np.int64)
+        step_rewards, episode_stats = [], []
+        states = self.env.reset()
+        inference_mode = 'eager' if args.inference_mode == 'none' else args.inference_mode
+        q_value_net = compile_q_value_net(snapshot, support, inference_mode, states)
+        with torch.no_grad():
+            while (finished_episodes < episodes_per_env).any():
+                actions = q_value_net(states).argmax(1).cpu().numpy()
+                # In evaluation we choose actions ε-greedily while fixing the noisy layers
+                random_actions = self.random_state.random_sample(num_envs) < epsilon
+                actions[random_actions] = self.random_state.randint(
+                    0, self.env.action_space.n, random_actions.sum())
+                states, step_reward, dones, _ = self.env.step(actions)
+                reward_sums += step_reward
+                episode_lengths += 1
+                ended = dones | (episode_lengths >= args.max_episode_length)
+                for rank in np.flatnonzero(ended & (finished_episodes < episodes_per_env)):
+                    if dones[rank]:
+                        step_rewards.append(float(reward_sums[rank]))
+                        episode_stats.append((float(reward_sums[rank]),
+                                              int(episode_lengths[rank])))
+                    finished_episodes[rank] += 1
+                reward_sums[ended], episode_lengths[ended] = 0, 0
+            # Test Q-values over validation memory completely independently of evaluation episodes
+            step_Qs = []
+            for val_states in val_mem.state_batches(args.evaluation_batch_size):
+                step_Qs.extend(q_value_net(val_states).max(1)[0].tolist())
+        self.episode_stats = episode_stats
+        self.results.append((num_steps, step_rewards, step_Qs, snapshot.state_dict()))
+
+    def close(self):
+        if self.thread is not None:
+            self.thread.join()
+        self.env.close()
+
+
 def _plot_line(xs, ys_population, title, path=''):
     """ Plots min, max and mean + standard deviation bars of a population over time """
     max_colour, mean_colour, std_colour, transparent = 'rgb(0, 132, 180)', 'rgb(0, 172, 237)', \
@@ -0,0 +1,91 @@
+"""
+Env steps/s and updates/s of the asynchronous A3C training (algorithms/a3c/train.py, one env and
+one model per process) against the synchronous batched A2C mode (algorithms/a3c/a2c.py, one
+process stepping the same number of env processes in lockstep) at equal numbers of processes.
+The SyntheticController of config_files/rainbow_synthetic.json replaces the Unity process,
+simulating the simulator cost by sleeping.
+
+Example of use:
+`python benchmarks/a2c.py --num-processes 1 2 4 8 --step-latency 0.01 --duration 30`
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import torch.multiprocessing as mp
+
+from algorithms.a3c import my_optim
+from algorithms.a3c.a2c import train_a2c
+from algorithms.a3c.main import parser as a3c_parser
+from algorithms.a3c.model import ActorCritic, FlatParameters
+from algorithms.a3c.stats import WorkerStats
+from algorithms.a3c.train import train
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+from gym_ai2thor.utils import read_config
+
+parser = argparse.ArgumentParser(description='A3C against A2C benchmark')
+parser.add_argument('--num-processes', type=int, nargs='+', default=[1, 2, 4, 8],
+                    help='Numbers of env processes to benchmark')
+parser.add_argument('--step-latency', type=float, default=0.01,
+                    help='Seconds slept by the synthetic controller on every step')
+parser.add_argument('--duration', type=float, default=30,
+                    help='Seconds measured for every mode and number of processes')
+
+
+def measure(target, process_args, stats, duration):
+    """ Runs the training processes for duration seconds, after the first update """
+    processes = [mp.Process(target=target, args=args) for args in process_args]
+    for process in processes:
+        process.start()
+    while stats.total('updates') == 0:
+        time.sleep(0.1)
+    start_steps, start_updates = stats.total('env_steps'), stats.total('updates')
+    start = time.time()
+    time.sleep(duration)
+    env_steps = stats.total('env_steps') - start_steps
+    updates = stats.total('updates') - start_updates
+    elapsed = time.time() - start
+    for process in processes:
+        process.terminate()
+        process.join()
+    return env_steps / elapsed, updates / elapsed
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    os.environ['OMP_NUM_THREADS'] = '1'
+    # The training processes read the env config from a file, so the latency is written into a copy
+    config = read_config('config_files/rainbow_synthetic.json')
+    config['controller']['step_latency'] = args.step_latency
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(config, f)
+        a3c = a3c_parser.parse_args(['--config-file', config_file])
+        a3c.frame_dim = config['resolution'][-1]
+        env = AI2ThorEnv(config_file=config_file)
+        num_channels, num_actions = env.observation_space.shape[0], env.action_space.n
+        env.close()
+        for num_processes in args.num_processes:
+            a3c.num_processes = num_processes
+            results = []
+            for mode in ['a3c', 'a2c']:
+                shared_model = ActorCritic(num_channels, num_actions, a3c.frame_dim)
+                shared_parameters = FlatParameters(shared_model, share_memory=True)
+                optimizer = my_optim.SharedAdam(shared_model.parameters(), lr=a3c.lr)
+                optimizer.share_memory()
+                if mode == 'a3c':
+                    stats = WorkerStats(num_processes)
+                    process_args = [(rank, a3c, shared_model, shared_parameters, stats,
+                                     optimizer) for rank in range(num_processes)]
+                    results.append(measure(train, process_args, stats, args.duration))
+                else:
+                    stats = WorkerStats(1)
+                    process_args = [(a3c, shared_model, stats, optimizer)]
+                    results.append(measure(train_a2c, process_args, stats, args.duration))
+            (a3c_steps, a3c_updates), (a2c_steps, a2c_updates) = results
+            print('{} processes: A3C {:.1f} env steps/s, {:.1f} updates/s | A2C {:.1f} env '
+                  'steps/s, {:.1f} updates/s'.format(num_processes, a3c_steps, a3c_updates,
+                                                     a2c_steps, a2c_updates))
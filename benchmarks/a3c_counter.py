@@ -0,0 +1,65 @@
+"""
+Overhead of counting the env steps of the A3C processes: a single mp.Value incremented under a lock
+on every step (as previously in algorithms/a3c/train.py) against the lock-free per-worker slots of
+WorkerStats, with increasing numbers of workers doing nothing else than counting and a small
+amount of work per step.
+
+Example of use:
+`python benchmarks/a3c_counter.py --num-workers 1 4 16 32 --num-steps 100000`
+"""
+import argparse
+import time
+
+import torch.multiprocessing as mp
+
+from algorithms.a3c.stats import WorkerStats
+
+parser = argparse.ArgumentParser(description='A3C step counter benchmark')
+parser.add_argument('--num-workers', type=int, nargs='+', default=[1, 4, 16, 32],
+                    help='Numbers of worker processes to benchmark')
+parser.add_argument('--num-steps', type=int, default=100000, help='Steps counted by each worker')
+parser.add_argument('--work-per-step', type=int, default=100,
+                    help='Iterations of a dummy loop run on every step between the increments')
+
+
+def locked_worker(rank, counter, lock, num_steps, work_per_step):
+    for _ in range(num_steps):
+        for _ in range(work_per_step):
+            pass
+        with lock:
+            counter.value += 1
+
+
+def slots_worker(rank, stats, num_steps, work_per_step):
+    for _ in range(num_steps):
+        for _ in range(work_per_step):
+            pass
+        stats.add(rank, env_steps=1)
+
+
+def run_workers(target, process_args):
+    """ Seconds until all the workers finished """
+    processes = [mp.Process(target=target, args=args) for args in process_args]
+    start = time.time()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    for num_workers in args.num_workers:
+        counter, lock = mp.Value('i', 0), mp.Lock()
+        locked_time = run_workers(locked_worker, [
+            (rank, counter, lock, args.num_steps, args.work_per_step)
+            for rank in range(num_workers)])
+        stats = WorkerStats(num_workers)
+        slots_time = run_workers(slots_worker, [
+            (rank, stats, args.num_steps, args.work_per_step) for rank in range(num_workers)])
+        assert counter.value == stats.total('env_steps') == num_workers * args.num_steps
+        total_steps = num_workers * args.num_steps
+        print('{} workers: locked mp.Value {:.0f} steps/s | per-worker slots {:.0f} steps/s | '
+              '{:.1f}x faster'.format(num_workers, total_steps / locked_time,
+                                      total_steps / slots_time, locked_time / slots_time))
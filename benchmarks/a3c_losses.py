@@ -0,0 +1,69 @@
+"""
+Time to compute the A3C losses of a rollout and backpropagate them: the previous step by step loop
+of train.py, which chains tiny ops on [1, 1] tensors, against the vectorised a3c_losses (discounted
+cumulative sums over the whole rollout). The predicted values, log probs and entropies are outputs
+of a small linear layer so that the backward pass also reaches parameters.
+
+Example of use:
+`python benchmarks/a3c_losses.py --num-steps 20 100 500 --repeats 50`
+"""
+import argparse
+import time
+import types
+
+import torch
+
+from algorithms.a3c.train import a3c_losses
+
+parser = argparse.ArgumentParser(description='A3C losses benchmark')
+parser.add_argument('--num-steps', type=int, nargs='+', default=[20, 100, 500],
+                    help='Rollout lengths to benchmark')
+parser.add_argument('--repeats', type=int, default=50, help='Number of measured updates')
+
+
+def loop_losses(args, values, log_probs, entropies, rewards, R):
+    """ Losses as computed step by step in train.py before a3c_losses """
+    values = [value.view(1, 1) for value in values] + [R.view(1, 1)]
+    R = R.view(1, 1)
+    policy_loss, value_loss = 0, 0
+    gae = torch.zeros(1, 1)
+    for i in reversed(range(len(rewards))):
+        R = args.gamma * R + rewards[i]
+        advantage = R - values[i]
+        value_loss = value_loss + 0.5 * advantage.pow(2)
+        delta_t = rewards[i] + args.gamma * values[i + 1] - values[i]
+        gae = gae * args.gamma * args.tau + delta_t
+        policy_loss = policy_loss - log_probs[i] * gae.detach() - \
+            args.entropy_coef * entropies[i]
+    return policy_loss, value_loss
+
+
+def seconds_per_update(compute_losses, head, features, rewards, R, repeats):
+    for repeat in range(repeats + 1):
+        if repeat == 1:  # the first update is a warm up
+            start = time.time()
+        outputs = head(features)
+        policy_loss, value_loss = compute_losses(outputs[:, :1], outputs[:, 1:2],
+                                                 outputs[:, 2:].exp(), rewards, R)
+        head.zero_grad()
+        (policy_loss + 0.5 * value_loss).sum().backward()
+    return (time.time() - start) / repeats
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    a3c = types.SimpleNamespace(gamma=0.99, tau=1.00, entropy_coef=0.01)
+    head = torch.nn.Linear(256, 3)
+    for num_steps in args.num_steps:
+        features, rewards = torch.randn(num_steps, 256), torch.randn(num_steps, 1)
+        R = torch.randn(1)
+        masks = torch.ones(num_steps, 1)
+        loop = seconds_per_update(
+            lambda *rollout: loop_losses(a3c, *rollout), head, features, rewards, R,
+            args.repeats)
+        vectorised = seconds_per_update(
+            lambda values, log_probs, entropies, rewards, R: a3c_losses(
+                a3c, values, log_probs, entropies, rewards, masks, R),
+            head, features, rewards, R, args.repeats)
+        print('{} steps: loop {:.2f}ms | vectorised {:.2f}ms | {:.1f}x faster'.format(
+            num_steps, loop * 1e3, vectorised * 1e3, loop / vectorised))
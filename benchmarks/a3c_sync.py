@@ -0,0 +1,89 @@
+"""
+Cost of syncing the local ActorCritic of an A3C process with the shared model at the start of every
+rollout: load_state_dict(shared_model.state_dict()) against a single copy_ of the FlatParameters,
+and total env steps/s and updates/s of the A3C training with several numbers of processes. The
+SyntheticController of config_files/rainbow_synthetic.json replaces the Unity process, simulating
+the simulator cost by sleeping.
+
+Example of use:
+`python benchmarks/a3c_sync.py --num-processes 4 8 16 --step-latency 0.01 --duration 30`
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import torch
+
+from algorithms.a3c import my_optim
+from algorithms.a3c.main import parser as a3c_parser
+from algorithms.a3c.model import ActorCritic, FlatParameters
+from algorithms.a3c.stats import WorkerStats
+from algorithms.a3c.train import train
+from benchmarks.a2c import measure
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+from gym_ai2thor.utils import read_config
+
+parser = argparse.ArgumentParser(description='A3C parameter sync benchmark')
+parser.add_argument('--num-processes', type=int, nargs='+', default=[4, 8, 16],
+                    help='Numbers of training processes to benchmark')
+parser.add_argument('--step-latency', type=float, default=0.01,
+                    help='Seconds slept by the synthetic controller on every step')
+parser.add_argument('--duration', type=float, default=30,
+                    help='Seconds measured for every number of processes')
+parser.add_argument('--num-syncs', type=int, default=1000, help='Number of syncs measured')
+
+
+def seconds_per_sync(sync, num_syncs):
+    sync()
+    start = time.time()
+    for _ in range(num_syncs):
+        sync()
+    return (time.time() - start) / num_syncs
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    os.environ['OMP_NUM_THREADS'] = '1'
+    torch.set_num_threads(1)
+    # The training processes read the env config from a file, so the latency is written into a copy
+    config = read_config('config_files/rainbow_synthetic.json')
+    config['controller']['step_latency'] = args.step_latency
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(config, f)
+        a3c = a3c_parser.parse_args(['--config-file', config_file])
+        a3c.frame_dim = config['resolution'][-1]
+        env = AI2ThorEnv(config_file=config_file)
+        num_channels, num_actions = env.observation_space.shape[0], env.action_space.n
+        env.close()
+
+        shared_model = ActorCritic(num_channels, num_actions, a3c.frame_dim)
+        shared_parameters = FlatParameters(shared_model, share_memory=True)
+        model = ActorCritic(num_channels, num_actions, a3c.frame_dim)
+        state_dict_sync = seconds_per_sync(
+            lambda: model.load_state_dict(shared_model.state_dict()), args.num_syncs)
+        parameters = FlatParameters(model)
+
+        def flat_sync():
+            parameters.synced_version = -1  # always copy, as when other processes updated
+            parameters.sync_with(shared_parameters)
+        flat_copy_sync = seconds_per_sync(flat_sync, args.num_syncs)
+        print('Sync per rollout: load_state_dict {:.1f}us | flat copy_ {:.1f}us | {:.1f}x '
+              'faster'.format(state_dict_sync * 1e6, flat_copy_sync * 1e6,
+                              state_dict_sync / flat_copy_sync))
+
+        for num_processes in args.num_processes:
+            shared_model = ActorCritic(num_channels, num_actions, a3c.frame_dim)
+            shared_parameters = FlatParameters(shared_model, share_memory=True)
+            optimizer = my_optim.SharedAdam(shared_model.parameters(), lr=a3c.lr)
+            optimizer.share_memory()
+            stats = WorkerStats(num_processes)
+            process_args = [(rank, a3c, shared_model, shared_parameters, stats, optimizer)
+                            for rank in range(num_processes)]
+            env_steps, updates = measure(train, process_args, stats, args.duration)
+            sync_ms = 1e3 * stats.total('sync_seconds') / stats.total('updates')
+            print('{} processes: {:.1f} env steps/s | {:.1f} updates/s | {:.3f}ms sync per '
+                  'update'.format(num_processes, env_steps, updates, sync_ms))
@@ -0,0 +1,50 @@
+"""
+Scaling of the Ape-X style Rainbow training (algorithms/rainbow/apex.py) with the number of actors
+on one CPU-only machine: env steps/s of all actors and learner updates/s. The SyntheticController
+of config_files/rainbow_synthetic.json replaces the Unity process, simulating the simulator cost by
+sleeping.
+
+Example of use:
+`python benchmarks/apex.py --num-actors 1 2 4 8 --step-latency 0.01 --duration 30`
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import torch
+
+from algorithms.rainbow import apex
+from gym_ai2thor.utils import read_config
+
+parser = argparse.ArgumentParser(description='Ape-X Rainbow benchmark')
+parser.add_argument('--num-actors', type=int, nargs='+', default=[1, 2, 4, 8],
+                    help='Numbers of actors to benchmark')
+parser.add_argument('--step-latency', type=float, default=0.01,
+                    help='Seconds slept by the synthetic controller on every step')
+parser.add_argument('--duration', type=float, default=30,
+                    help='Seconds measured for every number of actors')
+parser.add_argument('--learn-start', type=int, default=500,
+                    help='Number of transitions stored before the learner starts')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # The actors read the env config from a file, so the latency is written into a copy of it
+    config = read_config('config_files/rainbow_synthetic.json')
+    config['controller']['step_latency'] = args.step_latency
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(config, f)
+        rainbow = apex.parser.parse_args(['--learn-start', str(args.learn_start),
+                                          '--memory-capacity', str(int(1e5)),
+                                          '--history-length', '4',
+                                          '--report-interval', str(args.duration),
+                                          '--config-file', config_file])
+        rainbow.device = torch.device('cpu')
+        for num_actors in args.num_actors:
+            rainbow.num_actors = num_actors
+            stats = apex.run(rainbow, duration=args.duration)
+            print('{} actors: {:.1f} env steps/s | {:.1f} learner updates/s'.format(
+                num_actors, stats['env_steps_per_sec'], stats['learner_updates_per_sec']))
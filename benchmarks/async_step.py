@@ -0,0 +1,76 @@
+"""
+End-to-end steps/s of the Rainbow training loop on AI2ThorEnv with blocking steps against
+pipelined steps (AI2ThorEnv.step_async/step_wait, --pipelined-steps of algorithms/rainbow/main.py),
+where the agent learns from a batch while the env steps in a background thread. Each step acts with
+the online network, steps the env and learns every --replay-frequency steps. The SyntheticController
+of config_files/rainbow_synthetic.json replaces the Unity process, simulating the rendering cost by
+sleeping --step-latencies seconds every step.
+
+Example of use:
+`python benchmarks/async_step.py --step-latencies 0 0.005 0.02 --num-steps 500`
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from algorithms.rainbow.agent import Agent
+from algorithms.rainbow.env import FrameStackEnv
+from algorithms.rainbow.memory import ReplayMemory
+from benchmarks.utils import rainbow_args
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+
+parser = argparse.ArgumentParser(description='Pipelined env steps benchmark')
+parser.add_argument('--step-latencies', type=float, nargs='+', default=[0, 0.005, 0.02],
+                    help='Seconds slept by the synthetic controller on every step')
+parser.add_argument('--num-steps', type=int, default=500, help='Number of steps measured')
+parser.add_argument('--replay-frequency', type=int, default=1,
+                    help='Number of steps between learning updates')
+parser.add_argument('--batch-size', type=int, default=32, help='Batch size of the updates')
+
+
+def run(env, dqn, mem, args, pipelined):
+    state, done = env.reset(), False
+    start = time.time()
+    for step in range(args.num_steps):
+        if done:
+            state, done = env.reset(), False
+        action = dqn.act(state)
+        learn = (step + 1) % args.replay_frequency == 0
+        if pipelined:
+            env.step_async(action)
+            if learn:
+                dqn.learn(mem)
+            state, reward, done, _ = env.step_wait()
+        else:
+            state, reward, done, _ = env.step(action)
+            if learn:
+                dqn.learn(mem)
+    return args.num_steps / (time.time() - start)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    for step_latency in args.step_latencies:
+        env = FrameStackEnv(AI2ThorEnv(config_file='config_files/rainbow_synthetic.json',
+                                       config_dict={'controller': {
+                                           'type': 'synthetic', 'step_latency': step_latency}}),
+                            4, torch.device('cpu'))
+        rainbow = rainbow_args(resolution=tuple(env.config['resolution']),
+                               img_channels=env.observation_space.shape[0],
+                               batch_size=args.batch_size)
+        dqn = Agent(rainbow, env)
+        # The agent learns from random transitions, only the time of the updates matters
+        mem = ReplayMemory(rainbow, 10000)
+        frames = torch.randint(0, 256, (100, rainbow.img_channels) + rainbow.resolution,
+                               dtype=torch.uint8)
+        for step in range(10000):
+            mem.append(frames[step % len(frames)], np.random.randint(env.action_space.n),
+                       np.random.randn(), (step + 1) % 100 == 0)
+        blocking = run(env, dqn, mem, args, pipelined=False)
+        pipelined = run(env, dqn, mem, args, pipelined=True)
+        print('Step latency {}s: blocking {:.1f} steps/s | pipelined {:.1f} steps/s | {:.2f}x '
+              'faster'.format(step_latency, blocking, pipelined, pipelined / blocking))
+        env.close()
@@ -0,0 +1,64 @@
+"""
+Time to evaluate Q over the validation memory of algorithms/rainbow/main.py: one forward pass per
+state with Agent.evaluate_q (as test() iterating over val_mem) against a single batched forward
+pass with Agent.evaluate_q_batch, with the online network and with the QValueNet of each
+inference mode (noisy layers folded, optionally compiled with TorchScript).
+
+Example of use:
+`python benchmarks/batched_inference.py --evaluation-size 500 --repeats 5`
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+import torch
+
+from algorithms.rainbow.agent import Agent
+from algorithms.rainbow.memory import ReplayMemory
+from benchmarks.utils import rainbow_args
+
+parser = argparse.ArgumentParser(description='Batched inference benchmark')
+parser.add_argument('--evaluation-size', type=int, default=500,
+                    help='Number of validation states')
+parser.add_argument('--inference-modes', type=str, nargs='+',
+                    default=['none', 'eager', 'script', 'trace'],
+                    help='Inference modes to benchmark')
+parser.add_argument('--repeats', type=int, default=5, help='Number of measured validations')
+parser.add_argument('--disable-cuda', action='store_true', help='Disable CUDA')
+
+
+def seconds_per_validation(validate, repeats):
+    validate()  # warm up (and compile the inference network)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeats):
+        validate()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - start) / repeats
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.disable_cuda
+                          else 'cpu')
+    val_mem = ReplayMemory(rainbow_args(device=device), args.evaluation_size)
+    for step in range(args.evaluation_size):
+        frame = torch.from_numpy(np.random.randint(0, 256, (1, 64, 64), dtype=np.uint8))
+        val_mem.append(frame, None, None, (step + 1) % 100 == 0)
+    val_states = list(val_mem)
+    val_batch = torch.stack(val_states)
+
+    print('Device {}. {} validation states'.format(device, args.evaluation_size))
+    for inference_mode in args.inference_modes:
+        dqn = Agent(rainbow_args(device=device, inference_mode=inference_mode),
+                    mock.Mock(action_space=mock.Mock(n=4)))
+        dqn.eval()
+        single = seconds_per_validation(
+            lambda: [dqn.evaluate_q(state) for state in val_states], args.repeats)
+        batched = seconds_per_validation(
+            lambda: dqn.evaluate_q_batch(val_batch).sum().item(), args.repeats)
+        print('Inference mode {}: one by one {:.1f}ms | batched {:.1f}ms | {:.1f}x faster'.format(
+            inference_mode, single * 1e3, batched * 1e3, single / batched))
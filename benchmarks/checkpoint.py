@@ -0,0 +1,78 @@
+"""
+Duration of the Rainbow training checkpoints of algorithms/rainbow/checkpoint.py with a replay
+memory of 1e5 64x64 grayscale transitions (by default): the first checkpoint into each of the two
+slots of a checkpoint directory, which writes every frame, the following incremental checkpoints,
+which only write the frames appended since the previous checkpoint into the same slot (two
+--checkpoint-intervals appends), and restoring the checkpoint into a new agent and memories.
+Checkpoints are written into a temporary directory within --directory.
+
+Example of use:
+`python benchmarks/checkpoint.py --memory-size 100000 --checkpoint-intervals 1000 10000`
+"""
+import argparse
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+import torch
+
+from algorithms.rainbow.agent import Agent
+from algorithms.rainbow.checkpoint import load_checkpoint, save_checkpoint
+from algorithms.rainbow.memory import ReplayMemory
+from benchmarks.utils import rainbow_args
+
+parser = argparse.ArgumentParser(description='Rainbow checkpoint benchmark')
+parser.add_argument('--memory-size', type=int, default=int(1e5),
+                    help='Number of transitions in the replay memory')
+parser.add_argument('--evaluation-size', type=int, default=500,
+                    help='Number of transitions in the validation memory')
+parser.add_argument('--checkpoint-intervals', type=int, nargs='+', default=[1000, 10000],
+                    help='Numbers of transitions appended between incremental checkpoints')
+parser.add_argument('--directory', type=str, default=None,
+                    help='Directory where the checkpoints are written (default: temporary '
+                         'directory)')
+
+
+def fill(mem, frames, num_steps):
+    for step in range(num_steps):
+        mem.append(frames[step % len(frames)], np.random.randint(4), np.random.randn(),
+                   (step + 1) % 100 == 0)
+
+
+def timed(function):
+    start = time.time()
+    function()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    rainbow = rainbow_args()
+    env = mock.Mock(action_space=mock.Mock(n=4))
+    dqn = Agent(rainbow, env)
+    mem = ReplayMemory(rainbow, args.memory_size)
+    val_mem = ReplayMemory(rainbow, args.evaluation_size)
+    frames = torch.randint(0, 256, (1000, 1) + rainbow.resolution, dtype=torch.uint8)
+    fill(mem, frames, args.memory_size)
+    fill(val_mem, frames, args.evaluation_size)
+    dqn.learn(mem)  # creates the optimiser state
+    frames_mb = mem.states.nbytes / 1024 ** 2
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        full_time = timed(lambda: save_checkpoint(directory, 0, dqn, mem, val_mem))
+        second_full_time = timed(lambda: save_checkpoint(directory, 0, dqn, mem, val_mem))
+        print('{} transitions ({:.0f}MB of frames): first checkpoints {:.2f}s and {:.2f}s'.format(
+            args.memory_size, frames_mb, full_time, second_full_time))
+        for interval in args.checkpoint_intervals:
+            for _ in range(2):  # brings both slots up to date
+                fill(mem, frames, interval)
+                incremental_time = timed(lambda: save_checkpoint(directory, interval, dqn, mem,
+                                                                 val_mem))
+            print('    incremental checkpoint after {} appends {:.3f}s | {:.1f}x faster than '
+                  'the first'.format(interval, incremental_time, full_time / incremental_time))
+        restored_dqn = Agent(rainbow, env)
+        restored_mem = ReplayMemory(rainbow, args.memory_size)
+        restored_val_mem = ReplayMemory(rainbow, args.evaluation_size)
+        restore_time = timed(lambda: load_checkpoint(directory, restored_dqn, restored_mem,
+                                                     restored_val_mem))
+        print('    restore {:.2f}s'.format(restore_time))
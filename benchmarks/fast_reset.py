@@ -0,0 +1,70 @@
+"""
+Resets/s of AI2ThorEnv with full resets, which reload the scene every episode, against fast resets
+("fast_reset": true), which restore the initial state of the loaded scene and only reload it every
+--full-reset-interval resets. Every episode takes --episode-length random actions first so that
+the fast resets have objects and a pose to restore. Observations after the fast resets are checked
+against the observation after a full reset. By default the SyntheticController of
+config_files/rainbow_synthetic.json replaces the Unity process, simulating the cost of loading a
+scene by sleeping --reset-latencies seconds every scene load and the cost of rendering by sleeping
+--step-latency seconds every step (including those of the fast resets).
+
+Example of use:
+`python benchmarks/fast_reset.py --reset-latencies 0.5 2 --step-latency 0.01`
+`python benchmarks/fast_reset.py --config-file config_files/rainbow_example.json`
+"""
+import argparse
+import time
+
+import numpy as np
+
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+from gym_ai2thor.utils import read_config
+
+parser = argparse.ArgumentParser(description='Fast reset benchmark')
+parser.add_argument('--config-file', type=str, default='config_files/rainbow_synthetic.json',
+                    help='Config file of the environment')
+parser.add_argument('--reset-latencies', type=float, nargs='+', default=[0.5, 2.],
+                    help='Seconds slept by the synthetic controller on every scene load')
+parser.add_argument('--step-latency', type=float, default=0.01,
+                    help='Seconds slept by the synthetic controller on every step')
+parser.add_argument('--num-resets', type=int, default=50, help='Number of resets measured')
+parser.add_argument('--episode-length', type=int, default=20,
+                    help='Number of random actions between resets')
+parser.add_argument('--full-reset-interval', type=int, default=10,
+                    help='Number of resets between scene loads of the fast resets')
+
+
+def run(env, args, reference_state):
+    """ Returns the resets/s, steps/s and largest difference to reference_state of the resets """
+    reset_time, max_difference = 0., 0.
+    start = time.time()
+    for _ in range(args.num_resets):
+        for _ in range(args.episode_length):
+            env.step(env.action_space.sample(), verbose=False)
+        reset_start = time.time()
+        state = env.reset()
+        reset_time += time.time() - reset_start
+        max_difference = max(max_difference, float(np.max(np.abs(
+            state.astype(np.float32) - reference_state.astype(np.float32)))))
+    steps_per_sec = args.num_resets * args.episode_length / (time.time() - start)
+    return args.num_resets / reset_time, steps_per_sec, max_difference
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    synthetic = read_config(args.config_file).get('controller', {}).get('type') == 'synthetic'
+    for reset_latency in args.reset_latencies if synthetic else [None]:
+        config_dict = {'controller': dict(type='synthetic', step_latency=args.step_latency,
+                                          reset_latency=reset_latency)} if synthetic else {}
+        results = {}
+        for fast_reset in (False, True):
+            env = AI2ThorEnv(config_file=args.config_file, config_dict=dict(
+                config_dict, fast_reset=fast_reset, full_reset_interval=args.full_reset_interval))
+            reference_state = env.reset()
+            results[fast_reset] = run(env, args, reference_state)
+            env.close()
+        name = 'Reset latency {}s'.format(reset_latency) if synthetic else args.config_file
+        print('{}: full {:.2f} resets/s ({:.1f} steps/s) | fast {:.2f} resets/s ({:.1f} steps/s) | '
+              '{:.1f}x faster | largest observation difference {:.4f}'.format(
+                  name, results[False][0], results[False][1], results[True][0], results[True][1],
+                  results[True][0] / results[False][0], results[True][2]))
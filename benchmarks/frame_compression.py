@@ -0,0 +1,94 @@
+"""
+Compression ratio of the frames of the Rainbow ReplayMemory (see CompressedFrames in
+algorithms/rainbow/memory.py) with each codec and keyframe interval, and its cost in append and
+sample throughput against raw uint8 frames. The frames are recorded from AI2ThorEnv with random
+actions (and optionally saved with --save-frames), or loaded from a recording saved before with
+--frames, since random frames do not compress.
+
+Example of use:
+`python benchmarks/frame_compression.py --record-steps 5000 --save-frames frames.npz`
+`python benchmarks/frame_compression.py --frames frames.npz --keyframe-intervals 1 4 16`
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from algorithms.rainbow.memory import ReplayMemory, lz4_installed
+from benchmarks.utils import rainbow_args
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+
+parser = argparse.ArgumentParser(description='Replay memory frame compression benchmark')
+parser.add_argument('--frames', type=str, default=None,
+                    help='Recording (.npz with frames and terminals) to use instead of recording')
+parser.add_argument('--record-steps', type=int, default=5000,
+                    help='Number of ai2thor steps recorded with random actions')
+parser.add_argument('--config-file', type=str, default='config_files/rainbow_example.json',
+                    help='Config file of the recorded ai2thor environment')
+parser.add_argument('--save-frames', type=str, default=None,
+                    help='Path of the .npz where the recorded frames are saved')
+parser.add_argument('--keyframe-intervals', type=int, nargs='+', default=[1, 4, 16],
+                    help='Keyframe intervals to benchmark (1 for no deltas)')
+parser.add_argument('--batch-size', type=int, default=32, help='Batch size of the samples')
+parser.add_argument('--num-samples', type=int, default=200, help='Number of batches sampled')
+
+
+def record(config_file, num_steps):
+    env = AI2ThorEnv(config_file=config_file)
+    frames, terminals = [], []
+    state, done = env.reset(), False
+    for _ in range(num_steps):
+        if done:
+            state, done = env.reset(), False
+        next_state, _, done, _ = env.step(env.action_space.sample())
+        frames.append(state)
+        terminals.append(done)
+        state = next_state
+    env.close()
+    frames = np.stack(frames)
+    if frames.dtype != np.uint8:
+        frames = np.rint(frames * 255).astype(np.uint8)
+    return frames, np.array(terminals)
+
+
+def measure(frames, terminals, args, **memory_kwargs):
+    rainbow = rainbow_args(resolution=frames.shape[2:], img_channels=frames.shape[1],
+                           batch_size=args.batch_size)
+    mem = ReplayMemory(rainbow, len(frames), **memory_kwargs)
+    frames = torch.from_numpy(frames)
+    start = time.time()
+    for step in range(len(frames)):
+        mem.append(frames[step], np.random.randint(4), np.random.randn(), terminals[step])
+    appends_per_sec = len(frames) / (time.time() - start)
+    np.random.seed(0)
+    start = time.time()
+    for _ in range(args.num_samples):
+        mem.sample(args.batch_size)
+    samples_per_sec = args.num_samples * args.batch_size / (time.time() - start)
+    nbytes = mem.states.nbytes() if memory_kwargs else mem.states.nbytes
+    return nbytes, appends_per_sec, samples_per_sec
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.frames is not None:
+        with np.load(args.frames) as recording:
+            frames, terminals = recording['frames'], recording['terminals']
+    else:
+        frames, terminals = record(args.config_file, args.record_steps)
+        if args.save_frames is not None:
+            np.savez(args.save_frames, frames=frames, terminals=terminals)
+    print('{} frames of shape {}, {} episodes'.format(len(frames), frames.shape[1:],
+                                                      int(terminals.sum())))
+    raw_bytes, raw_appends, raw_samples = measure(frames, terminals, args)
+    print('raw: {:.1f}MB | {:.0f} appends/s | {:.0f} samples/s'.format(
+        raw_bytes / 1024 ** 2, raw_appends, raw_samples))
+    for codec in ('zlib', 'lz4') if lz4_installed else ('zlib', ):
+        for keyframe_interval in args.keyframe_intervals:
+            nbytes, appends, samples = measure(frames, terminals, args, frame_compression=codec,
+                                               keyframe_interval=keyframe_interval)
+            print('{} keyframe interval {}: {:.1f}MB ({:.1f}x smaller) | {:.0f} appends/s | '
+                  '{:.0f} samples/s ({:.1f}x slower)'.format(
+                      codec, keyframe_interval, nbytes / 1024 ** 2, raw_bytes / nbytes, appends,
+                      samples, raw_samples / samples))
@@ -0,0 +1,83 @@
+"""
+Per-step latency and allocations of the Rainbow frame stacking: the previous deque + torch.cat
+stacking (a new stacked tensor every step) against the preallocated FrameRingBuffer used by
+FrameStackEnv, which writes the new frame in place and returns a view. Allocations are counted with
+the memory profiler of torch.
+
+Example of use:
+`python benchmarks/frame_stack.py --history-lengths 1 4 8 --resolution 64 64 --channels 1`
+"""
+import argparse
+from collections import deque
+import time
+
+import numpy as np
+import torch
+
+from algorithms.rainbow.env import FrameRingBuffer
+
+parser = argparse.ArgumentParser(description='Frame stacking benchmark')
+parser.add_argument('--history-lengths', type=int, nargs='+', default=[1, 4, 8],
+                    help='Numbers of stacked frames to benchmark')
+parser.add_argument('--resolution', type=int, nargs=2, default=[64, 64], help='Frame resolution')
+parser.add_argument('--channels', type=int, default=1, help='Frame channels')
+parser.add_argument('--num-steps', type=int, default=10000, help='Number of steps measured')
+parser.add_argument('--episode-length', type=int, default=100, help='Steps between resets')
+
+
+class DequeFrameStack:
+    """ Frame stacking of FrameStackEnv before the ring buffer """
+    def __init__(self, num_frames):
+        self.num_frames = num_frames
+
+    def reset(self, frame):
+        observation = torch.from_numpy(frame).to(dtype=torch.uint8)
+        self.state_buffer = deque([observation for _ in range(self.num_frames)],
+                                  maxlen=self.num_frames)
+        return torch.cat(list(self.state_buffer), 0)
+
+    def append(self, frame):
+        self.state_buffer.append(torch.from_numpy(frame).to(dtype=torch.uint8))
+        return torch.cat(list(self.state_buffer), 0)
+
+
+def run(frame_stack, frames, num_steps, episode_length):
+    frame_stack.reset(frames[0])
+    for step in range(1, num_steps + 1):
+        frame = frames[step % len(frames)]
+        if step % episode_length == 0:
+            frame_stack.reset(frame)
+        else:
+            frame_stack.append(frame)
+
+
+def allocations_per_step(frame_stack, frames, num_steps, episode_length):
+    """ Number of allocating ops and allocated bytes per step """
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                profile_memory=True) as profiler:
+        run(frame_stack, frames, num_steps, episode_length)
+    allocations = [event.cpu_memory_usage for event in profiler.events()
+                   if event.name != '[memory]' and event.cpu_memory_usage > 0]
+    return len(allocations) / num_steps, sum(allocations) / num_steps
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    frame_shape = (args.channels, ) + tuple(args.resolution)
+    frames = np.random.randint(0, 256, (64, ) + frame_shape, dtype=np.uint8)
+    for num_frames in args.history_lengths:
+        results = []
+        for frame_stack in [DequeFrameStack(num_frames),
+                            FrameRingBuffer(num_frames, frame_shape, torch.uint8,
+                                            torch.device('cpu'))]:
+            run(frame_stack, frames, 100, args.episode_length)  # warm up
+            start = time.time()
+            run(frame_stack, frames, args.num_steps, args.episode_length)
+            step_time = (time.time() - start) / args.num_steps
+            results.append((step_time, ) + allocations_per_step(frame_stack, frames, 1000,
+                                                                args.episode_length))
+        (deque_time, deque_allocs, deque_bytes), (ring_time, ring_allocs, ring_bytes) = results
+        print('History {}: deque + cat {:.2f}us, {:.2f} allocs ({:.0f}B) per step | ring buffer '
+              '{:.2f}us, {:.2f} allocs ({:.0f}B) per step | {:.1f}x faster'.format(
+                  num_frames, deque_time * 1e6, deque_allocs, deque_bytes, ring_time * 1e6,
+                  ring_allocs, ring_bytes, deque_time / ring_time))
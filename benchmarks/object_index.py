@@ -0,0 +1,102 @@
+"""
+Cost of resolving the target object of the interaction actions in AI2ThorEnv.step for scenes with
+hundreds of objects: the previous full scans of event.metadata['objects'] (one to build the visible
+objects on every step plus one per interaction with list membership checks) against the lazily
+built visible object index. The SyntheticController generates the object lists.
+
+Example of use:
+`python benchmarks/object_index.py --num-objects 100 300 1000`
+"""
+import argparse
+import time
+
+import numpy as np
+
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+
+parser = argparse.ArgumentParser(description='Visible object index benchmark')
+parser.add_argument('--num-objects', type=int, nargs='+', default=[100, 300, 1000],
+                    help='Number of objects in the scene')
+parser.add_argument('--repeats', type=int, default=1000,
+                    help='Number of times every action is resolved')
+
+CONFIG_OBJECTS = {'pickup_objects': ['Mug', 'Apple', 'Book'],
+                  'acceptable_receptacles': ['CounterTop', 'TableTop', 'Sink'],
+                  'openable_objects': ['Microwave', 'Fridge']}
+
+
+def scan_closest(event, action_str):
+    """
+    Object resolution of AI2ThorEnv.step before the visible object index. The visible objects
+    were scanned for every action (action_str None for movement actions)
+    """
+    visible_objects = [obj for obj in event.metadata['objects'] if obj['visible']]
+    if action_str is None:
+        return None
+    closest, distance = None, float('inf')
+    for obj in visible_objects:
+        if action_str == 'PutObject':
+            candidate = obj['receptacle'] and \
+                obj['objectType'] in CONFIG_OBJECTS['acceptable_receptacles']
+        elif action_str == 'PickupObject':
+            candidate = obj['pickupable'] and \
+                obj['objectType'] in CONFIG_OBJECTS['pickup_objects']
+        else:
+            candidate = obj['openable'] and not obj['isOpen'] and \
+                obj['objectType'] in CONFIG_OBJECTS['openable_objects']
+        if candidate and obj['distance'] < distance:
+            closest, distance = obj, obj['distance']
+    return closest
+
+
+def index_closest(env, action_str):
+    """ Object resolution with a new index for every event (the worst case) """
+    env.object_index_event = None
+    bucket = {'PutObject': 'receptacles', 'PickupObject': 'pickupables',
+              'OpenObject': 'closed_openables'}[action_str]
+    return env.closest_object(env.get_visible_objects(bucket))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    for num_objects in args.num_objects:
+        config_dict = dict(CONFIG_OBJECTS, controller={'type': 'synthetic',
+                                                       'num_objects': num_objects,
+                                                       'visibility_distance': 3})
+        env = AI2ThorEnv(config_dict=config_dict)
+        env.reset()
+        num_visible = sum(obj['visible'] for obj in env.event.metadata['objects'])
+        print('{} objects ({} visible):'.format(num_objects, num_visible))
+        # Movement actions: the scan of the visible objects was done on every step
+        start = time.time()
+        for _ in range(args.repeats):
+            scan_closest(env.event, None)
+        print('    Movement action: {:.1f}us scan -> 0us with the lazy index'.format(
+            (time.time() - start) / args.repeats * 1e6))
+        for action_str in ['PickupObject', 'PutObject', 'OpenObject']:
+            assert scan_closest(env.event, action_str) is index_closest(env, action_str)
+            start = time.time()
+            for _ in range(args.repeats):
+                scan_closest(env.event, action_str)
+            scan_time = (time.time() - start) / args.repeats
+            start = time.time()
+            for _ in range(args.repeats):
+                index_closest(env, action_str)
+            index_time = (time.time() - start) / args.repeats
+            print('    {}: {:.1f}us scans -> {:.1f}us index ({:.1f}x)'.format(
+                action_str, scan_time * 1e6, index_time * 1e6, scan_time / index_time))
+        # Random policy over all the actions, i.e. 4 interactions every 12 steps
+        actions = [env.action_names[action] for action in
+                   np.random.randint(0, len(env.action_names), args.repeats)]
+        start = time.time()
+        for action_str in actions:
+            scan_closest(env.event, action_str if action_str.endswith('Object') else None)
+        scan_time = (time.time() - start) / args.repeats
+        start = time.time()
+        for action_str in actions:
+            if action_str.endswith('Object'):
+                index_closest(env, action_str if action_str != 'CloseObject' else 'OpenObject')
+        index_time = (time.time() - start) / args.repeats
+        print('    Random policy: {:.1f}us scans -> {:.1f}us index per step ({:.1f}x)'.format(
+            scan_time * 1e6, index_time * 1e6, scan_time / index_time))
+        env.close()
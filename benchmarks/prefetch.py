@@ -0,0 +1,60 @@
+"""
+Learner steps per second of the Rainbow Agent sampling directly from the ReplayMemory against
+sampling through a PrefetchSampler with different queue depths. One transition is appended per
+learn step as in algorithms/rainbow/main.py with --replay-frequency 1.
+
+Example of use:
+`python benchmarks/prefetch.py --queue-depths 1 2 4 --num-learn-steps 200`
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+import torch
+
+from algorithms.rainbow.agent import Agent
+from algorithms.rainbow.memory import PrefetchSampler, ReplayMemory
+from benchmarks.utils import rainbow_args
+
+parser = argparse.ArgumentParser(description='PrefetchSampler benchmark')
+parser.add_argument('--queue-depths', type=int, nargs='+', default=[1, 2, 4],
+                    help='Prefetch queue depths to benchmark')
+parser.add_argument('--num-learn-steps', type=int, default=200,
+                    help='Number of learn steps measured')
+parser.add_argument('--memory-size', type=int, default=int(5e4),
+                    help='Number of transitions in memory')
+parser.add_argument('--batch-size', type=int, default=32, help='Batch size')
+parser.add_argument('--disable-cuda', action='store_true', help='Disable CUDA')
+
+
+def learner_steps_per_sec(dqn, replay, num_learn_steps, frame):
+    dqn.learn(replay)  # warm up (and start the prefetching thread)
+    start = time.time()
+    for step in range(num_learn_steps):
+        replay.append(frame, 0, 0., (step + 1) % 100 == 0)
+        dqn.learn(replay)
+    return num_learn_steps / (time.time() - start)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.disable_cuda
+                          else 'cpu')
+    rainbow = rainbow_args(device=device, batch_size=args.batch_size)
+    mem = ReplayMemory(rainbow, args.memory_size)
+    frames = torch.randint(0, 256, (1000, 1) + rainbow.resolution, dtype=torch.uint8)
+    for step in range(args.memory_size):
+        mem.append(frames[step % len(frames)], np.random.randint(4), np.random.randn(),
+                   (step + 1) % 100 == 0)
+    dqn = Agent(rainbow, mock.Mock(action_space=mock.Mock(n=4)))
+    dqn.train()
+
+    baseline = learner_steps_per_sec(dqn, mem, args.num_learn_steps, frames[0])
+    print('Device {}. No prefetching: {:.1f} learner steps/s'.format(device, baseline))
+    for queue_depth in args.queue_depths:
+        sampler = PrefetchSampler(mem, args.batch_size, queue_depth)
+        steps_per_sec = learner_steps_per_sec(dqn, sampler, args.num_learn_steps, frames[0])
+        sampler.close()
+        print('Prefetching {} batches: {:.1f} learner steps/s ({:.2f}x)'.format(
+            queue_depth, steps_per_sec, steps_per_sec / baseline))
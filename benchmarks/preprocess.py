@@ -0,0 +1,46 @@
+"""
+Per-frame microbenchmark of the preprocessing backends of AI2ThorEnv on 300x300 RGB frames, the
+default ai2thor frame size.
+
+Example of use:
+`python benchmarks/preprocess.py --resolutions 64 84 128`
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+
+from gym_ai2thor import image_processing
+from gym_ai2thor.image_processing import fast_preprocess, skimage_preprocess
+
+parser = argparse.ArgumentParser(description='Preprocessing backends benchmark')
+parser.add_argument('--resolutions', type=int, nargs='+', default=[64, 84, 128],
+                    help='Square output resolutions to benchmark')
+parser.add_argument('--num-frames', type=int, default=200,
+                    help='Number of frames preprocessed per measurement')
+
+
+def time_per_frame(preprocess_fn, frames, **kwargs):
+    start = time.time()
+    for frame in frames:
+        preprocess_fn(frame, **kwargs)
+    return (time.time() - start) / len(frames)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    frames = np.random.randint(0, 256, (args.num_frames, 300, 300, 3), dtype=np.uint8)
+    for resolution in args.resolutions:
+        for grayscale in [True, False]:
+            kwargs = dict(resolution=(resolution, resolution), grayscale=grayscale)
+            out = np.empty((1 if grayscale else 3, resolution, resolution), dtype=np.uint8)
+            skimage_time = time_per_frame(skimage_preprocess, frames, **kwargs)
+            fast_time = time_per_frame(fast_preprocess, frames, out=out, **kwargs)
+            with mock.patch.object(image_processing, 'cv2_installed', False):
+                numpy_time = time_per_frame(fast_preprocess, frames, out=out, **kwargs)
+            print('300x300 -> {0}x{0} {1}: skimage {2:.3f}ms | fast {3:.3f}ms ({4:.1f}x) | '
+                  'fast without OpenCV {5:.3f}ms ({6:.1f}x)'.format(
+                      resolution, 'grayscale' if grayscale else 'RGB', skimage_time * 1e3,
+                      fast_time * 1e3, skimage_time / fast_time, numpy_time * 1e3,
+                      skimage_time / numpy_time))
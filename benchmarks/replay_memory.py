@@ -0,0 +1,82 @@
+"""
+Benchmark of the Rainbow ReplayMemory: resident memory, append throughput and sample throughput for
+64x64 grayscale frames at different capacities, with the frames in RAM (memory backend) or in a
+memory-mapped file (memmap backend). Each capacity and backend is measured in a fresh process so the
+resident memory of one run does not leak into the next. The resident memory of the memmap backend
+includes the cached pages of the file, which the OS drops under memory pressure, so the anonymous
+resident memory (the part which has to fit in RAM) is also reported.
+
+Example of use:
+`python benchmarks/replay_memory.py --capacities 100000 1000000 --num-appends 100000`
+`python benchmarks/replay_memory.py --backends memmap --directory /data --capacities 10000000`
+"""
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from algorithms.rainbow.memory import ReplayMemory
+from benchmarks.utils import anonymous_rss_mb, rainbow_args, rss_mb
+
+parser = argparse.ArgumentParser(description='ReplayMemory benchmark')
+parser.add_argument('--capacities', type=int, nargs='+', default=[int(1e5), int(1e6)],
+                    help='Memory capacities to benchmark')
+parser.add_argument('--num-appends', type=int, default=int(1e5),
+                    help='Number of transitions appended (capped by the capacity)')
+parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 128, 512],
+                    help='Batch sizes used to measure sampling')
+parser.add_argument('--num-samples', type=int, default=100,
+                    help='Number of batches sampled per batch size')
+parser.add_argument('--episode-length', type=int, default=100,
+                    help='Length of the episodes appended')
+parser.add_argument('--backends', type=str, nargs='+', default=['memory', 'memmap'],
+                    choices=['memory', 'memmap'], help='Frame storages to benchmark')
+parser.add_argument('--directory', type=str, default=None,
+                    help='Directory of the frames files of the memmap backend (default: a '
+                         'temporary directory)')
+
+
+def run(capacity, backend, args):
+    rainbow = rainbow_args()
+    rss_start, anonymous_rss_start = rss_mb(), anonymous_rss_mb()
+    directory = tempfile.mkdtemp(dir=args.directory)
+    frames_file = os.path.join(directory, 'frames.uint8') if backend == 'memmap' else None
+    start = time.time()
+    mem = ReplayMemory(rainbow, capacity, frames_file=frames_file)
+    creation_time = time.time() - start
+    name = '{} {}'.format(backend.capitalize(), capacity)
+    num_appends = min(args.num_appends, capacity)
+    frames = torch.randint(0, 256, (1000, 1) + rainbow.resolution, dtype=torch.uint8)
+    start = time.time()
+    for step in range(num_appends):
+        mem.append(frames[step % len(frames)].clone(), np.random.randint(4), np.random.randn(),
+                   (step + 1) % args.episode_length == 0)
+    appends_per_sec = num_appends / (time.time() - start)
+    anonymous_rss = '' if anonymous_rss_start is None else \
+        ' (anonymous {:.0f}MB)'.format(anonymous_rss_mb() - anonymous_rss_start)
+    print('{}: created in {:.3f}s | {} appends at {:.0f}/s | RSS {:.0f}MB{}'.format(
+        name, creation_time, num_appends, appends_per_sec, rss_mb() - rss_start, anonymous_rss))
+    for batch_size in args.batch_sizes:
+        start = time.time()
+        for _ in range(args.num_samples):
+            mem.sample(batch_size)
+        samples_per_sec = args.num_samples * batch_size / (time.time() - start)
+        print('{}: batch size {}: {:.0f} samples/s ({:.1f} batches/s)'.format(
+            name, batch_size, samples_per_sec, samples_per_sec / batch_size))
+    if frames_file is not None:
+        del mem
+        os.remove(frames_file)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    for capacity in args.capacities:
+        for backend in args.backends:
+            process = mp.Process(target=run, args=(capacity, backend, args))
+            process.start()
+            process.join()
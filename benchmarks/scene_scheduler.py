@@ -0,0 +1,60 @@
+"""
+Scene loads and throughput of a VectorAI2ThorEnv on a multi-scene config with the scenes assigned
+by the shared SceneScheduler ("scene_sampling": "scheduled", each worker keeps its scene for
+--episodes-per-scene episodes) against a scene sampled from the weights on every episode
+("scene_sampling": "random"). Both use fast resets, which only restore the loaded scene unless the
+scene changes. The SyntheticController replaces the Unity process, simulating the cost of loading a
+scene by sleeping --reset-latency seconds and the cost of rendering by sleeping --step-latency
+seconds every step.
+
+Example of use:
+`python benchmarks/scene_scheduler.py --num-workers 4 --scenes FloorPlan1:2 FloorPlan28:1`
+"""
+import argparse
+import time
+
+from gym_ai2thor.envs.vector_env import VectorAI2ThorEnv
+
+parser = argparse.ArgumentParser(description='Multi-scene scheduler benchmark')
+parser.add_argument('--scenes', type=str, nargs='+',
+                    default=['FloorPlan1:2', 'FloorPlan28:1', 'FloorPlan30:1', 'FloorPlan201:1'],
+                    help='Scenes and their sampling weights as name:weight')
+parser.add_argument('--num-workers', type=int, default=4, help='Number of workers')
+parser.add_argument('--num-steps', type=int, default=1000,
+                    help='Number of batched steps per measurement')
+parser.add_argument('--episode-length', type=int, default=20, help='Number of steps per episode')
+parser.add_argument('--episodes-per-scene', type=int, default=10,
+                    help='Number of episodes a worker plays in a scene once assigned')
+parser.add_argument('--reset-latency', type=float, default=1.,
+                    help='Seconds slept by the synthetic controller on every scene load')
+parser.add_argument('--step-latency', type=float, default=0.01,
+                    help='Seconds slept by the synthetic controller on every step')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    scenes = {scene.split(':')[0]: float(scene.split(':')[1]) for scene in args.scenes}
+    for scene_sampling in ('random', 'scheduled'):
+        config_dict = {'scenes': scenes, 'scene_sampling': scene_sampling,
+                       'episodes_per_scene': args.episodes_per_scene, 'fast_reset': True,
+                       'full_reset_interval': 1000, 'max_episode_length': args.episode_length,
+                       'controller': {'type': 'synthetic', 'step_latency': args.step_latency,
+                                      'reset_latency': args.reset_latency}}
+        env = VectorAI2ThorEnv(args.num_workers, config_file='config_files/rainbow_synthetic.json',
+                               config_dict=config_dict)
+        env.reset()
+        start = time.time()
+        for _ in range(args.num_steps):
+            env.step([env.action_space.sample() for _ in range(args.num_workers)])
+        steps_per_sec = args.num_workers * args.num_steps / (time.time() - start)
+        stats = env.scene_scheduler.stats()
+        env.close()
+        episodes = sum(scene['episodes'] for scene in stats.values())
+        scene_loads = sum(scene['scene_loads'] for scene in stats.values())
+        print('{} scene sampling: {:.1f} steps/s | {} episodes | {} scene loads ({:.2f} per '
+              'episode)'.format(scene_sampling, steps_per_sec, episodes, scene_loads,
+                                scene_loads / episodes))
+        for scene, scene_stats in stats.items():
+            print('    {}: weight {:.2f} | {:.2f} of the episodes | {} loads'.format(
+                scene, scene_stats['weight'], scene_stats['episodes'] / episodes,
+                scene_stats['scene_loads']))
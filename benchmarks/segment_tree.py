@@ -0,0 +1,56 @@
+"""
+Microbenchmark of the SegmentTree priority writes and searches used by every Rainbow learn step:
+one scalar update/find per index against update_batch/find_batch.
+
+Example of use:
+`python benchmarks/segment_tree.py --capacity 1000000 --batch-sizes 32 128 512`
+"""
+import argparse
+import time
+
+import numpy as np
+
+from algorithms.rainbow.memory import SegmentTree
+
+parser = argparse.ArgumentParser(description='SegmentTree benchmark')
+parser.add_argument('--capacity', type=int, default=int(1e6), help='Size of the tree')
+parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 128, 512],
+                    help='Number of indices updated and values searched at once')
+parser.add_argument('--repeats', type=int, default=200, help='Number of batches measured')
+
+
+def time_per_batch(fn, batches):
+    start = time.time()
+    for batch in batches:
+        fn(*batch)
+    return (time.time() - start) / len(batches)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    tree = SegmentTree(args.capacity)
+    tree.update_batch(np.arange(args.capacity) + args.capacity - 1,
+                      np.random.uniform(0, 1, args.capacity))
+    for batch_size in args.batch_sizes:
+        updates = [(np.random.randint(0, args.capacity, batch_size) + args.capacity - 1,
+                    np.random.uniform(0, 1, batch_size)) for _ in range(args.repeats)]
+        searches = [(np.random.uniform(0, tree.total(), batch_size), )
+                    for _ in range(args.repeats)]
+
+        def scalar_update(indices, values):
+            for index, value in zip(indices, values):
+                tree.update(index, value)
+
+        def scalar_find(values):
+            for value in values:
+                tree.find(value)
+
+        scalar_update_time = time_per_batch(scalar_update, updates)
+        batch_update_time = time_per_batch(tree.update_batch, updates)
+        scalar_find_time = time_per_batch(scalar_find, searches)
+        batch_find_time = time_per_batch(tree.find_batch, searches)
+        print('Batch size {}: update {:.3f}ms -> update_batch {:.3f}ms ({:.1f}x) | '
+              'find {:.3f}ms -> find_batch {:.3f}ms ({:.1f}x)'.format(
+                  batch_size, scalar_update_time * 1e3, batch_update_time * 1e3,
+                  scalar_update_time / batch_update_time, scalar_find_time * 1e3,
+                  batch_find_time * 1e3, scalar_find_time / batch_find_time))
@@ -0,0 +1,96 @@
+"""
+Optimiser step time of the shared optimizers of algorithms/a3c/my_optim.py: the previous SharedAdam
+step, which loops over the parameters calling .item() on the step of each one and allocating its
+denominator, against the flat SharedAdam and SharedRMSprop, both with the parameters and gradients
+of FlatParameters (one vectorised operation over all the parameters per statistic) and with separate
+parameters (same operations on the views of the flat statistics of each parameter). Models are
+ActorCritic with each of the given frame sizes, larger frames giving a larger LSTM input layer
+(e.g. 128 -> 0.6M parameters, 256 -> 8.6M parameters).
+
+Example of use:
+`python benchmarks/shared_optim.py --frame-dims 128 256 --num-steps 200`
+"""
+import argparse
+import math
+import time
+
+import torch
+import torch.optim as optim
+
+from algorithms.a3c import my_optim
+from algorithms.a3c.model import ActorCritic, FlatParameters
+
+parser = argparse.ArgumentParser(description='Shared optimizers benchmark')
+parser.add_argument('--frame-dims', type=int, nargs='+', default=[128, 256],
+                    help='Frame sizes of the ActorCritic models to benchmark')
+parser.add_argument('--num-steps', type=int, default=200, help='Number of measured steps')
+
+
+class LoopSharedAdam(optim.Adam):
+    """ SharedAdam before the flat statistics (with the keyword overloads of current PyTorch) """
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0):
+        super(LoopSharedAdam, self).__init__(params, lr, betas, eps, weight_decay)
+        for group in self.param_groups:
+            for p in group['params']:
+                state = self.state[p]
+                state['step'] = torch.zeros(1)
+                state['exp_avg'] = p.data.new().resize_as_(p.data).zero_()
+                state['exp_avg_sq'] = p.data.new().resize_as_(p.data).zero_()
+
+    def share_memory(self):
+        for group in self.param_groups:
+            for p in group['params']:
+                for tensor in self.state[p].values():
+                    tensor.share_memory_()
+
+    def step(self, closure=None):
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                grad = p.grad.data
+                state = self.state[p]
+                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+                beta1, beta2 = group['betas']
+                state['step'] += 1
+                exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                denom = exp_avg_sq.sqrt().add_(group['eps'])
+                bias_correction1 = 1 - beta1 ** state['step'].item()
+                bias_correction2 = 1 - beta2 ** state['step'].item()
+                step_size = group['lr'] * math.sqrt(bias_correction2) / bias_correction1
+                p.data.addcdiv_(exp_avg, denom, value=-step_size)
+
+
+def seconds_per_step(shared_optimizer, frame_dim, flat, num_steps):
+    torch.manual_seed(0)
+    model = ActorCritic(1, 8, frame_dim)
+    if flat:
+        parameters = FlatParameters(model)
+        parameters.grad.normal_()
+    else:
+        for param in model.parameters():
+            param.grad = torch.randn_like(param)
+    optimizer = shared_optimizer(model.parameters(), lr=1e-4)
+    optimizer.share_memory()
+    optimizer.step()  # warm up
+    start = time.time()
+    for _ in range(num_steps):
+        optimizer.step()
+    return (time.time() - start) / num_steps
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    torch.set_num_threads(1)  # as in every A3C process
+    for frame_dim in args.frame_dims:
+        num_params = sum(p.numel() for p in ActorCritic(1, 8, frame_dim).parameters())
+        loop = seconds_per_step(LoopSharedAdam, frame_dim, False, args.num_steps)
+        print('ActorCritic {}x{} ({:.1f}M parameters): loop SharedAdam {:.3f}ms'.format(
+            frame_dim, frame_dim, num_params / 1e6, loop * 1e3))
+        for shared_optimizer in (my_optim.SharedAdam, my_optim.SharedRMSprop):
+            for flat in (True, False):
+                seconds = seconds_per_step(shared_optimizer, frame_dim, flat, args.num_steps)
+                print('    {} ({} parameters) {:.3f}ms | {:.1f}x faster than loop'.format(
+                    shared_optimizer.__name__, 'flat' if flat else 'separate', seconds * 1e3,
+                    loop / seconds))
@@ -0,0 +1,48 @@
+"""
+Auxiliary functions shared by the benchmark scripts
+"""
+import argparse
+import os
+import resource
+
+import torch
+
+
+def rss_mb():
+    """
+    Current resident set size of this process in MB. Falls back to the peak resident set size on
+    platforms without /proc
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def anonymous_rss_mb():
+    """
+    Resident memory of this process in MB which is not backed by a file (e.g. without the pages of
+    memory-mapped files, which the OS can drop and read again), or None on platforms without /proc
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) / 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def rainbow_args(**kwargs):
+    """
+    Rainbow arguments with the defaults of algorithms/rainbow/main.py for 64x64 grayscale states
+    """
+    args = dict(device=torch.device('cpu'), resolution=(64, 64), img_channels=1, history_length=4,
+                hidden_size=512, noisy_std=0.1, num_atoms=51, V_min=-10, V_max=10,
+                model_path=None, inference_mode='none', priority_exponent=0.5,
+                priority_weight=0.4, multi_step=3, discount=0.99, lr=0.0000625, adam_eps=1.5e-4,
+                batch_size=32)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
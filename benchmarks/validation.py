@@ -0,0 +1,65 @@
+"""
+Duration of the Q-validation phase of algorithms/rainbow/test.py: iterating over the validation
+memory and evaluating one state at a time against evaluating the cached stacked batches of
+ReplayMemory.state_batches, for several evaluation sizes. The first batched validation, which
+builds the cache, is reported separately.
+
+Example of use:
+`python benchmarks/validation.py --evaluation-sizes 500 50000 --evaluation-batch-size 500`
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+import torch
+
+from algorithms.rainbow.agent import Agent
+from algorithms.rainbow.memory import ReplayMemory
+from benchmarks.utils import rainbow_args
+
+parser = argparse.ArgumentParser(description='Validation phase benchmark')
+parser.add_argument('--evaluation-sizes', type=int, nargs='+', default=[500, 50000],
+                    help='Numbers of validation states to benchmark')
+parser.add_argument('--evaluation-batch-size', type=int, default=500,
+                    help='Number of validation states evaluated in each forward pass')
+parser.add_argument('--history-length', type=int, default=4, help='Number of stacked frames')
+parser.add_argument('--disable-cuda', action='store_true', help='Disable CUDA')
+
+
+def timed(function):
+    start = time.time()
+    result = function()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return result, time.time() - start
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.disable_cuda
+                          else 'cpu')
+    rainbow = rainbow_args(device=device, history_length=args.history_length)
+    dqn = Agent(rainbow, mock.Mock(action_space=mock.Mock(n=4)))
+    dqn.eval()
+    frames = torch.randint(0, 256, (1000, 1) + rainbow.resolution, dtype=torch.uint8)
+    print('Device {}. History length {}, batches of {} states'.format(
+        device, args.history_length, args.evaluation_batch_size))
+    for evaluation_size in args.evaluation_sizes:
+        val_mem = ReplayMemory(rainbow, evaluation_size)
+        for step in range(evaluation_size):
+            val_mem.append(frames[step % len(frames)], None, None, (step + 1) % 100 == 0)
+
+        single_Qs, single_time = timed(lambda: [dqn.evaluate_q(state) for state in val_mem])
+
+        def validate_batched():
+            step_Qs = []
+            for states in val_mem.state_batches(args.evaluation_batch_size):
+                step_Qs.extend(dqn.evaluate_q_batch(states).tolist())
+            return step_Qs
+        _, first_batched_time = timed(validate_batched)
+        batched_Qs, batched_time = timed(validate_batched)
+        assert np.allclose(single_Qs, batched_Qs, atol=1e-4)
+        print('{} states: one by one {:.2f}s | batched {:.2f}s (first {:.2f}s building the '
+              'cache) | {:.1f}x faster'.format(evaluation_size, single_time, batched_time,
+                                               first_batched_time, single_time / batched_time))
@@ -0,0 +1,47 @@
+"""
+Throughput benchmark of VectorAI2ThorEnv against a single AI2ThorEnv. The SyntheticController with
+a fixed per-step latency replaces the Unity process so that the numbers only measure the wrapper and
+the multiprocessing overhead, with the simulator cost simulated by sleeping.
+
+Example of use:
+`python benchmarks/vector_env_throughput.py --num-workers 1 2 4 8 --step-latency 0.01`
+"""
+import argparse
+import time
+
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+from gym_ai2thor.envs.vector_env import VectorAI2ThorEnv
+
+parser = argparse.ArgumentParser(description='VectorAI2ThorEnv throughput benchmark')
+parser.add_argument('--num-workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                    help='Number of workers to benchmark')
+parser.add_argument('--num-steps', type=int, default=200,
+                    help='Number of batched steps per measurement')
+parser.add_argument('--step-latency', type=float, default=0.01,
+                    help='Seconds slept by the synthetic controller on every step')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # max_episode_length 0 disables episode termination
+    config_dict = {'max_episode_length': 0,
+                   'controller': {'type': 'synthetic', 'step_latency': args.step_latency}}
+    env = AI2ThorEnv(config_dict=config_dict)
+    env.reset()
+    start = time.time()
+    for _ in range(args.num_steps):
+        env.step(env.action_space.sample(), verbose=False)
+    single_fps = args.num_steps / (time.time() - start)
+    env.close()
+    print('Single AI2ThorEnv: {:.1f} steps/s'.format(single_fps))
+
+    for num_workers in args.num_workers:
+        env = VectorAI2ThorEnv(num_workers, config_dict=config_dict)
+        env.reset()
+        start = time.time()
+        for _ in range(args.num_steps):
+            env.step([env.action_space.sample() for _ in range(num_workers)])
+        fps = num_workers * args.num_steps / (time.time() - start)
+        env.close()
+        print('VectorAI2ThorEnv with {} workers: {:.1f} steps/s ({:.2f}x)'.format(
+            num_workers, fps, fps / single_fps))
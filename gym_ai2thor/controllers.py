@@ -0,0 +1,291 @@
+"""
+Stand-in controllers with the same interface as ai2thor.controller.Controller (start, reset, step
+and stop), so that AI2ThorEnv, the trainers and the replay memories can be run and profiled
+without the Unity simulator. They are selected with the "controller" entry of the config file,
+whose other fields are passed to the controller constructor, e.g.
+
+    "controller": {"type": "synthetic", "step_latency": 0.01, "num_objects": 20}
+    "controller": {"type": "replay", "archive_path": "recordings/FloorPlan28.npz"}
+
+The default {"type": "unity"} starts the ai2thor controller. Recordings for the ReplayController are
+made by wrapping any controller with a RecordingController.
+"""
+import copy
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+DEFAULT_OBJECT_TYPES = ['Mug', 'Apple', 'Book', 'Bowl', 'CounterTop', 'TableTop', 'Sink',
+                        'Microwave', 'Fridge', 'Cabinet']
+PICKUPABLE_TYPES = {'Mug', 'Apple', 'Book', 'Bowl'}
+RECEPTACLE_TYPES = {'CounterTop', 'TableTop', 'Sink', 'Microwave', 'Fridge', 'Cabinet'}
+OPENABLE_TYPES = {'Microwave', 'Fridge', 'Cabinet'}
+
+
+class Event:
+    """
+    Minimal version of ai2thor.server.Event with the rendered RGB frame (H x W x 3 uint8) and the
+    metadata of one step
+    """
+    def __init__(self, frame, metadata):
+        self.frame = frame
+        self.metadata = metadata
+
+
+class SyntheticController:
+    """
+    Generates deterministic frames and object metadata from the scene name and the agent pose.
+    Frames are a random texture of the scene shifted with the rotation and horizon of the agent and
+    objects are placed randomly around the scene. An object is visible if it is closer than
+    visibility_distance and within the field of view of the agent. Pickup, Put, Open and Close
+    actions succeed on visible objects of the right kind, so that the tasks can give rewards.
+    TeleportFull, SetObjectPoses, DropHandObject, GetReachablePositions and Open/Close with
+    forceAction are supported to restore the state of a scene without reloading it.
+    The cost of rendering a real scene is simulated by sleeping step_latency seconds every step and
+    the cost of loading it by sleeping reset_latency seconds every reset.
+    """
+    def __init__(self, width=300, height=300, num_objects=20, object_types=None,
+                 step_latency=0., reset_latency=0., visibility_distance=1.5, seed=0):
+        """
+        :param width:               (int)   Width of the generated frames
+        :param height:              (int)   Height of the generated frames
+        :param num_objects:         (int)   Number of objects in every scene
+        :param object_types:        (list)  Object types cycled through to create the objects
+        :param step_latency:        (float) Seconds slept on every step
+        :param reset_latency:       (float) Seconds slept on every reset (i.e. scene load)
+        :param visibility_distance: (float) Maximum distance to see and interact with objects
+        :param seed:                (int)   Added to the hash of the scene name to generate it
+        """
+        self.width, self.height = width, height
+        self.num_objects = num_objects
+        self.object_types = object_types or DEFAULT_OBJECT_TYPES
+        self.step_latency = step_latency
+        self.reset_latency = reset_latency
+        self.visibility_distance = visibility_distance
+        self.seed = seed
+        self.scene_name = None
+        self.grid_size = 0.25
+
+    def start(self):
+        pass
+
+    def reset(self, scene_name):
+        """ Generates the texture and objects of the scene and places the agent at the origin """
+        if self.reset_latency > 0:
+            time.sleep(self.reset_latency)
+        self.scene_name = scene_name
+        random_state = np.random.RandomState((zlib.crc32(scene_name.encode()) + self.seed) %
+                                             2 ** 32)
+        self.texture = random_state.randint(0, 256, (self.height, self.width, 3), dtype=np.uint8)
+        self.object_positions = random_state.uniform(-2.5, 2.5, (self.num_objects, 2))
+        self.objects = []
+        for i in range(self.num_objects):
+            object_type = self.object_types[i % len(self.object_types)]
+            x, z = self.object_positions[i]
+            self.objects.append({
+                'objectId': '{}|{:+.2f}|+00.90|{:+.2f}'.format(object_type, x, z),
+                'name': '{}_{}'.format(object_type, i), 'objectType': object_type,
+                'position': {'x': x, 'y': 0.9, 'z': z}, 'rotation': {'x': 0., 'y': 0., 'z': 0.},
+                'pickupable': object_type in PICKUPABLE_TYPES,
+                'receptacle': object_type in RECEPTACLE_TYPES,
+                'openable': object_type in OPENABLE_TYPES, 'isOpen': False,
+                'isPickedUp': False})
+        self.position = np.zeros(2)
+        self.rotation, self.horizon = 0., 0.
+        self.inventory = []
+
+    def _visible(self):
+        """ Boolean mask and distances of the objects visible from the current pose """
+        offsets = self.object_positions - self.position
+        distances = np.sqrt(np.sum(offsets ** 2, 1))
+        angles = np.degrees(np.arctan2(offsets[:, 0], offsets[:, 1])) - self.rotation
+        in_view = np.abs((angles + 180) % 360 - 180) <= 45
+        picked_up = np.array([obj['isPickedUp'] for obj in self.objects], dtype=np.bool_)
+        return (distances < self.visibility_distance) & in_view & ~picked_up, distances
+
+    def _interact(self, action, visible):
+        """ Applies the interaction actions on visible objects. Returns whether they succeeded """
+        objects = {obj['objectId']: (i, obj) for i, obj in enumerate(self.objects)}
+        if action.get('objectId') not in objects:
+            return False
+        i, obj = objects[action['objectId']]
+        if action['action'] == 'PickupObject':
+            if not (visible[i] and obj['pickupable'] and not self.inventory):
+                return False
+            obj['isPickedUp'] = True
+            self.inventory.append({'objectId': obj['objectId'], 'objectType': obj['objectType']})
+        elif action['action'] == 'PutObject':
+            receptacle = objects.get(action.get('receptacleObjectId'))
+            if not (self.inventory and obj['isPickedUp'] and receptacle and
+                    visible[receptacle[0]] and receptacle[1]['receptacle']):
+                return False
+            obj['isPickedUp'] = False
+            self.object_positions[i] = self.object_positions[receptacle[0]]
+            obj['position'] = dict(receptacle[1]['position'])
+            self.inventory = []
+        elif action['action'] in ('OpenObject', 'CloseObject'):
+            if not ((visible[i] or action.get('forceAction')) and obj['openable']):
+                return False
+            obj['isOpen'] = action['action'] == 'OpenObject'
+        return True
+
+    def _set_object_poses(self, object_poses):
+        """ Moves the named objects to their poses, dropping them if they are held """
+        objects = {obj['name']: (i, obj) for i, obj in enumerate(self.objects)}
+        for pose in object_poses:
+            if pose['objectName'] not in objects:
+                return False
+            i, obj = objects[pose['objectName']]
+            obj['position'] = dict(pose['position'])
+            self.object_positions[i] = pose['position']['x'], pose['position']['z']
+            if obj['isPickedUp']:
+                obj['isPickedUp'] = False
+                self.inventory = []
+        return True
+
+    def _drop_hand_object(self):
+        """ Drops the held object at the position of the agent """
+        if not self.inventory:
+            return False
+        i, obj = next((i, obj) for i, obj in enumerate(self.objects)
+                      if obj['objectId'] == self.inventory[0]['objectId'])
+        obj['isPickedUp'] = False
+        self.object_positions[i] = self.position
+        obj['position'] = {'x': self.position[0], 'y': 0.9, 'z': self.position[1]}
+        self.inventory = []
+        return True
+
+    def step(self, action):
+        if self.step_latency > 0:
+            time.sleep(self.step_latency)
+        action_name = action['action']
+        success, action_return = True, None
+        if action_name == 'Initialize':
+            self.grid_size = action.get('gridSize', self.grid_size)
+        elif action_name.startswith('Move'):
+            angle = np.radians(self.rotation + {'MoveAhead': 0, 'MoveRight': 90, 'MoveBack': 180,
+                                                'MoveLeft': 270}[action_name])
+            self.position = np.clip(self.position + self.grid_size *
+                                    np.array([np.sin(angle), np.cos(angle)]), -2.5, 2.5)
+        elif action_name in ('RotateLeft', 'RotateRight'):
+            self.rotation = (self.rotation + (90 if action_name == 'RotateRight' else -90)) % 360
+        elif action_name == 'Rotate':
+            self.rotation = action['rotation'] % 360
+        elif action_name in ('LookUp', 'LookDown'):
+            self.horizon = np.clip(self.horizon + (30 if action_name == 'LookDown' else -30),
+                                   -30, 60)
+        elif action_name == 'TeleportFull':
+            rotation = action['rotation']
+            rotation = rotation['y'] if isinstance(rotation, dict) else rotation
+            self.position = np.clip([action['x'], action['z']], -2.5, 2.5)
+            self.rotation, self.horizon = rotation % 360, action['horizon']
+        elif action_name == 'SetObjectPoses':
+            success = self._set_object_poses(action['objectPoses'])
+        elif action_name == 'DropHandObject':
+            success = self._drop_hand_object()
+        elif action_name == 'GetReachablePositions':
+            grid = np.arange(-2.5, 2.5 + 1e-6, self.grid_size)
+            action_return = [{'x': float(x), 'y': 0.9, 'z': float(z)} for x in grid for z in grid]
+        else:
+            success = self._interact(action, self._visible()[0])
+        visible, distances = self._visible()
+        objects = []
+        for obj, obj_visible, distance in zip(self.objects, visible, distances):
+            obj = dict(obj)
+            obj['visible'], obj['distance'] = bool(obj_visible), float(distance)
+            objects.append(obj)
+        # Shift the texture with the pose so that every pose has its own frame
+        frame = np.roll(self.texture, (int(self.horizon) * self.height // 360,
+                                       int(self.rotation) * self.width // 360 +
+                                       int(np.sum(self.position) / self.grid_size)), (0, 1))
+        metadata = {'sceneName': self.scene_name, 'lastAction': action_name,
+                    'lastActionSuccess': success, 'actionReturn': action_return,
+                    'agent': {'position': {'x': self.position[0], 'y': 0.9,
+                                           'z': self.position[1]},
+                              'rotation': {'x': 0., 'y': self.rotation, 'z': 0.},
+                              'cameraHorizon': self.horizon},
+                    'objects': objects, 'inventoryObjects': list(self.inventory)}
+        return Event(frame, metadata)
+
+    def stop(self):
+        pass
+
+
+class RecordingController:
+    """
+    Wraps a controller and records the frame and metadata of every step, one episode per reset,
+    to be saved in an archive for the ReplayController
+    """
+    def __init__(self, controller):
+        self.controller = controller
+        self.frames, self.metadata, self.episode_starts = [], [], []
+
+    def start(self):
+        self.controller.start()
+
+    def reset(self, scene_name):
+        self.controller.reset(scene_name)
+        self.episode_starts.append(len(self.frames))
+
+    def step(self, action):
+        event = self.controller.step(action)
+        self.frames.append(np.array(event.frame, dtype=np.uint8))
+        # serialised right away since AI2ThorEnv adds fields to the metadata after the step
+        self.metadata.append(json.dumps(event.metadata))
+        return event
+
+    def stop(self):
+        self.controller.stop()
+
+    def save(self, archive_path):
+        """ Saves the recorded steps in a numpy .npz archive """
+        np.savez(archive_path, frames=np.stack(self.frames), metadata=np.array(self.metadata),
+                 episode_starts=np.array(self.episode_starts, dtype=np.int64))
+
+
+class ReplayController:
+    """
+    Plays back the episodes recorded by a RecordingController. Every reset starts the next recorded
+    episode (cycling through them) and every step returns the next recorded event regardless of the
+    action, repeating the last one at the end of the episode. Frames and metadata are loaded in
+    memory once, so playing back only costs copying the metadata dict.
+    """
+    def __init__(self, archive_path, step_latency=0.):
+        """
+        :param archive_path: (str)   Path to the .npz archive. Either absolute or relative path to
+                                     the gym_ai2thor folder as the config files.
+        :param step_latency: (float) Seconds slept on every step
+        """
+        archive_path = os.path.join(os.path.dirname(__file__), archive_path)
+        with np.load(archive_path) as archive:
+            self.frames = archive['frames']
+            self.metadata = [json.loads(metadata) for metadata in archive['metadata']]
+            self.episode_starts = list(archive['episode_starts'])
+        self.episode_ends = self.episode_starts[1:] + [len(self.frames)]
+        self.step_latency = step_latency
+        self.episode = -1
+        self.index = None
+
+    def start(self):
+        pass
+
+    def reset(self, scene_name):
+        self.episode = (self.episode + 1) % len(self.episode_starts)
+        self.index = self.episode_starts[self.episode]
+
+    def step(self, action):
+        if self.step_latency > 0:
+            time.sleep(self.step_latency)
+        index = min(self.index, self.episode_ends[self.episode] - 1)
+        self.index += 1
+        # AI2ThorEnv writes into the top level of the metadata
+        return Event(self.frames[index], copy.copy(self.metadata[index]))
+
+    def stop(self):
+        pass
+
+
+STAND_IN_CONTROLLERS = {'synthetic': SyntheticController, 'replay': ReplayController}
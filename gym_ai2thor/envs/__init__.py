@@ -1 +1,2 @@
-from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
\ No newline at end of file
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+from gym_ai2thor.envs.vector_env import VectorAI2ThorEnv
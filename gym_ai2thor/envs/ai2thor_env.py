@@ -3,17 +3,20 @@ Base class implementation for ai2thor environments wrapper, which adds an openAI
 inheriting the predefined methods and can be extended for particular tasks.
 """
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 import ai2thor.controller
 import numpy as np
-from skimage import transform
 from collections import defaultdict
 
 import gym
 from gym import error, spaces
 from gym.utils import seeding
-from gym_ai2thor.image_processing import rgb2gray
+from gym_ai2thor.controllers import STAND_IN_CONTROLLERS
+from gym_ai2thor.image_processing import PREPROCESS_BACKENDS
+from gym_ai2thor.scene_scheduler import scene_scheduler_from_config
 from gym_ai2thor.utils import read_config
 import gym_ai2thor.tasks
 
@@ -43,27 +46,41 @@ class AI2ThorEnv(gym.Env):
     """
     Wrapper base class
     """
-    def __init__(self, seed=None, config_file='config_files/config_example.json', config_dict=None):
+    def __init__(self, seed=None, config_file='config_files/config_example.json', config_dict=None,
+                 scene_scheduler=None):
         """
-        :param seed:         (int)   Random seed
-        :param config_file:  (str)   Path to environment configuration file. Either absolute or
-                                     relative path to the root of this repository.
-        :param: config_dict: (dict)  Overrides specific fields from the input configuration file.
+        :param seed:            (int)   Random seed
+        :param config_file:     (str)   Path to environment configuration file. Either absolute or
+                                        relative path to the root of this repository.
+        :param: config_dict:    (dict)  Overrides specific fields from the input configuration file.
+        :param scene_scheduler: (SceneScheduler) Scheduler of the "scenes" of the config shared
+                                        with other envs. A new one is created if None.
         """
         # Loads config settings from file
         self.config = read_config(config_file, config_dict)
-        self.scene_id = self.config['scene_id']
+        # Scene settings: either a single scene_id or scenes assigned by a scheduler on reset
+        self.scene_id = self.config.get('scene_id')
+        if scene_scheduler is None:
+            scene_scheduler = scene_scheduler_from_config(self.config)
+        self.scene_scheduler = scene_scheduler
+        self.scene_episodes_left = 0
+        if self.scene_scheduler is not None:
+            self.scene_id = None  # assigned on the first reset
+        elif self.scene_id is None:
+            raise ValueError('The config needs either a scene_id or scenes')
         # Randomness settings
         self.np_random = None
         if seed:
             self.seed(seed)
         # Object settings
-        # acceptable objects taken from config file.
+        # acceptable objects taken from config file (as sets for fast membership checks)
         if self.config['pickup_put_interaction'] or \
                             self.config['open_close_interaction']:
-            self.objects = {'pickupables': self.config['pickup_objects'],
-                            'receptacles': self.config['acceptable_receptacles'],
-                            'openables':   self.config['openable_objects']}
+            self.objects = {'pickupables': set(self.config['pickup_objects']),
+                            'receptacles': set(self.config['acceptable_receptacles']),
+                            'openables':   set(self.config['openable_objects'])}
+        # Index of the visible objects of self.event, built only when an interaction needs it
+        self.object_index, self.object_index_event = None, None
         # Action settings
         self.action_names = tuple(ALL_POSSIBLE_ACTIONS.copy())
         # remove open/close and pickup/put actions if respective interaction bool is set to False
@@ -84,10 +101,21 @@ class AI2ThorEnv(gym.Env):
         # Image settings
         self.event = None
         channels = 1 if self.config['grayscale'] else 3
-        self.observation_space = spaces.Box(low=0, high=255,
+        # States are either float32 in [0, 1] or uint8 in [0, 255] (no conversion is needed until
+        # the batch reaches the model in the latter)
+        self.observation_dtype = np.dtype(self.config.get('observation_dtype', 'float32'))
+        if self.observation_dtype not in (np.uint8, np.float32):
+            raise ValueError('Invalid observation_dtype: {}. Choose uint8 or float32'.format(
+                self.observation_dtype))
+        self.observation_space = spaces.Box(low=0, high=255 if self.observation_dtype == np.uint8
+                                            else 1,
                                             shape=(channels, self.config['resolution'][0],
                                                    self.config['resolution'][1]),
-                                            dtype=np.uint8)
+                                            dtype=self.observation_dtype)
+        self.preprocess_backend = self.config.get('preprocess_backend', 'skimage')
+        if self.preprocess_backend not in PREPROCESS_BACKENDS:
+            raise ValueError('Invalid preprocess_backend: {}. Choose one of {}'.format(
+                self.preprocess_backend, list(PREPROCESS_BACKENDS.keys())))
         # ai2thor initialise function settings
         self.metadata_last_object_attributes = ['lastObjectPut', 'lastObjectPutReceptacle',
                                                 'lastObjectPickedUp', 'lastObjectOpened',
@@ -104,46 +132,63 @@ class AI2ThorEnv(gym.Env):
             self.task = getattr(gym_ai2thor.tasks, self.config['task']['task_name'])(**self.config)
         except Exception as e:
             raise ValueError('Error occurred while creating task. Exception: {}'.format(e))
-        # Start ai2thor
-        self.controller = ai2thor.controller.Controller()
-        if self.config.get('build_file_name'):
-            # file must be in gym_ai2thor/build_files
-            self.build_file_path = os.path.abspath(os.path.join(__file__, '../../build_files',
-                                                                self.config['build_file_name']))
-            print('Build file path at: {}'.format(self.build_file_path))
-            if not os.path.exists(self.build_file_path):
-                raise ValueError('Unity build file at:\n{}\n does not exist'.format(
-                    self.build_file_path))
-            self.controller.local_executable_path = self.build_file_path
-
+        # Start ai2thor or one of the stand-in controllers of gym_ai2thor.controllers
+        controller_config = dict(self.config.get('controller', {'type': 'unity'}))
+        controller_type = controller_config.pop('type', 'unity')
+        if controller_type in STAND_IN_CONTROLLERS:
+            self.controller = STAND_IN_CONTROLLERS[controller_type](**controller_config)
+        elif controller_type == 'unity':
+            self.controller = ai2thor.controller.Controller()
+            if self.config.get('build_file_name'):
+                # file must be in gym_ai2thor/build_files
+                self.build_file_path = os.path.abspath(os.path.join(__file__, '../../build_files',
+                                                                    self.config['build_file_name']))
+                print('Build file path at: {}'.format(self.build_file_path))
+                if not os.path.exists(self.build_file_path):
+                    raise ValueError('Unity build file at:\n{}\n does not exist'.format(
+                        self.build_file_path))
+                self.controller.local_executable_path = self.build_file_path
+        else:
+            raise ValueError('Invalid controller type: {}. Choose unity or one of {}'.format(
+                controller_type, list(STAND_IN_CONTROLLERS.keys())))
+        # Fast reset settings: restore the initial state of the loaded scene on reset instead of
+        # reloading it, except every full_reset_interval resets or when scene_id changes
+        self.fast_reset = self.config.get('fast_reset', False)
+        self.full_reset_interval = self.config.get('full_reset_interval', 10)
+        self.random_initial_pose = self.config.get('random_initial_pose', False)
+        if (self.fast_reset or self.random_initial_pose) and controller_type == 'replay':
+            raise ValueError('fast_reset and random_initial_pose are not supported by the replay '
+                             'controller, which plays back the recorded events whatever the '
+                             'actions')
+        if self.full_reset_interval < 1:
+            raise ValueError('full_reset_interval must be at least 1')
+        self.initial_state = None  # recorded by load_scene
+        self.resets_since_load = 0
+        self.num_scene_loads, self.num_fast_resets = 0, 0
         self.controller.start()
+        # Background thread running the steps started with step_async, created on its first call
+        self.step_executor = None
+        self.pending_step = None
 
     def step(self, action, verbose=True):
         if not self.action_space.contains(action):
             raise error.InvalidAction('Action must be an integer between '
                                       '0 and {}!'.format(self.action_space.n))
         action_str = self.action_names[action]
-        visible_objects = [obj for obj in self.event.metadata['objects'] if obj['visible']]
         for attribute in self.metadata_last_object_attributes:
             self.event.metadata[attribute] = None
 
         # if/else statements below for dealing with up to 13 actions
         if action_str.endswith('Object'):  # All interactions end with 'Object'
             # Interaction actions
-            interaction_obj, distance = None, float('inf')
+            interaction_obj = None
             inventory_before = self.event.metadata['inventoryObjects'][0]['objectType'] \
                 if self.event.metadata['inventoryObjects'] else []
             if action_str.startswith('Put'):
-                closest_receptacle = None
                 if self.event.metadata['inventoryObjects']:
-                    for obj in visible_objects:
-                        # look for closest receptacle to put object from inventory
-                        closest_receptacle_to_put_object_in = obj['receptacle'] and \
-                                                              obj['distance'] < distance \
-                                        and obj['objectType'] in self.objects['receptacles']
-                        if closest_receptacle_to_put_object_in:
-                            closest_receptacle = obj
-                            distance = closest_receptacle['distance']
+                    # look for closest receptacle to put object from inventory
+                    receptacles = self.get_visible_objects('receptacles')
+                    closest_receptacle = self.closest_object(receptacles)
                     if closest_receptacle:
                         interaction_obj = closest_receptacle
                         object_to_put = self.event.metadata['inventoryObjects'][0]
@@ -154,44 +199,24 @@ class AI2ThorEnv(gym.Env):
                         self.event.metadata['lastObjectPut'] = object_to_put
                         self.event.metadata['lastObjectPutReceptacle'] = interaction_obj
             elif action_str.startswith('Pickup'):
-                closest_pickupable = None
-                for obj in visible_objects:
-                    # look for closest object to pick up
-                    closest_object_to_pick_up = obj['pickupable'] and \
-                                                obj['distance'] < distance and \
-                                obj['objectType'] in self.objects['pickupables']
-                    if closest_object_to_pick_up:
-                        closest_pickupable = obj
+                # look for closest object to pick up
+                closest_pickupable = self.closest_object(self.get_visible_objects('pickupables'))
                 if closest_pickupable and not self.event.metadata['inventoryObjects']:
                     interaction_obj = closest_pickupable
                     self.event = self.controller.step(
                         dict(action=action_str, objectId=interaction_obj['objectId']))
                     self.event.metadata['lastObjectPickedUp'] = interaction_obj
             elif action_str.startswith('Open'):
-                closest_openable = None
-                for obj in visible_objects:
-                    # look for closest closed receptacle to open it
-                    is_closest_closed_receptacle = obj['openable'] and \
-                            obj['distance'] < distance and not obj['isOpen'] and \
-                            obj['objectType'] in self.objects['openables']
-                    if is_closest_closed_receptacle:
-                        closest_openable = obj
-                        distance = closest_openable['distance']
+                # look for closest closed receptacle to open it
+                closest_openable = self.closest_object(self.get_visible_objects('closed_openables'))
                 if closest_openable:
                     interaction_obj = closest_openable
                     self.event = self.controller.step(
                         dict(action=action_str, objectId=interaction_obj['objectId']))
                     self.event.metadata['lastObjectOpened'] = interaction_obj
             elif action_str.startswith('Close'):
-                closest_openable = None
-                for obj in visible_objects:
-                    # look for closest opened receptacle to close it
-                    is_closest_open_receptacle = obj['openable'] and obj['distance'] < distance \
-                                                 and obj['isOpen'] and \
-                                                 obj['objectType'] in self.objects['openables']
-                    if is_closest_open_receptacle:
-                        closest_openable = obj
-                        distance = closest_openable['distance']
+                # look for closest opened receptacle to close it
+                closest_openable = self.closest_object(self.get_visible_objects('open_openables'))
                 if closest_openable:
                     interaction_obj = closest_openable
                     self.event = self.controller.step(
@@ -235,20 +260,114 @@ class AI2ThorEnv(gym.Env):
 
         return state_image, reward, done, info
 
+    def step_async(self, action, verbose=True):
+        """
+        Starts the step of action in a background thread and returns right away, so that the caller
+        can do other work (e.g. a training update) while the controller renders the next frame and
+        it is preprocessed and rewarded. The controller and the preprocessing mostly release the GIL
+        while they wait for Unity or run in numpy. The env must not be used until step_wait returns
+        """
+        if self.pending_step is not None:
+            raise RuntimeError('step_async was called again before step_wait')
+        if self.step_executor is None:
+            self.step_executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_step = self.step_executor.submit(self.step, action, verbose)
+
+    def step_wait(self):
+        """
+        Waits for the step started with step_async and returns its (state, reward, done, info).
+        Exceptions raised by the step, e.g. an invalid action, are raised here
+        """
+        if self.pending_step is None:
+            raise RuntimeError('step_wait was called without calling step_async first')
+        pending_step, self.pending_step = self.pending_step, None
+        return pending_step.result()
+
+    async def astep(self, action, verbose=True):
+        """
+        Awaitable version of step for asyncio code: the step runs in the background thread of
+        step_async, so the event loop keeps running other tasks until it finishes
+        """
+        self.step_async(action, verbose)
+        pending_step, self.pending_step = self.pending_step, None
+        return await asyncio.wrap_future(pending_step)
+
+    def get_visible_objects(self, bucket):
+        """
+        Returns the visible objects of the current event that the agent can interact with in one of
+        the buckets of capabilities: 'pickupables', 'receptacles', 'open_openables' or
+        'closed_openables', filtered by the object types of the config file.
+        The index of each event is built lazily: the visible objects are found the first time an
+        interaction needs them and each bucket is filtered from them the first time it is requested,
+        so movement actions never scan the objects.
+        """
+        if self.object_index_event is not self.event:
+            self.object_index = {'visible': [obj for obj in self.event.metadata['objects']
+                                             if obj['visible']]}
+            self.object_index_event = self.event
+        object_index = self.object_index
+        if bucket not in object_index:
+            if bucket in ('open_openables', 'closed_openables'):
+                openables = [obj for obj in object_index['visible'] if obj['openable'] and
+                             obj['objectType'] in self.objects['openables']]
+                object_index['open_openables'] = [obj for obj in openables if obj['isOpen']]
+                object_index['closed_openables'] = [obj for obj in openables if not obj['isOpen']]
+            else:
+                capability = {'pickupables': 'pickupable', 'receptacles': 'receptacle'}[bucket]
+                object_types = self.objects[bucket]
+                object_index[bucket] = [obj for obj in object_index['visible'] if obj[capability]
+                                        and obj['objectType'] in object_types]
+        return object_index[bucket]
+
+    @staticmethod
+    def closest_object(objects):
+        """ Returns the object with the smallest distance to the agent or None if empty """
+        return min(objects, key=lambda obj: obj['distance']) if objects else None
+
     def preprocess(self, img):
         """
-        Compute image operations to generate state representation
+        Compute image operations to generate state representation with the backend selected in
+        the config file ('skimage' or 'fast', see gym_ai2thor.image_processing)
         """
-        # TODO: replace scikit image with opencv
-        img = transform.resize(img, self.config['resolution'], mode='reflect')
-        img = img.astype(np.float32)
-        if self.observation_space.shape[0] == 1:
-            img = rgb2gray(img)
-        img = np.moveaxis(img, 2, 0)
+        img = PREPROCESS_BACKENDS[self.preprocess_backend](
+            img, self.config['resolution'], grayscale=self.observation_space.shape[0] == 1)
+        if self.observation_dtype == np.float32 and img.dtype == np.uint8:
+            img = np.multiply(img, 1 / 255, dtype=np.float32)
+        elif self.observation_dtype == np.uint8 and img.dtype != np.uint8:
+            img = np.rint(img * 255).astype(np.uint8)
         return img
 
     def reset(self):
         print('Resetting environment and starting new episode')
+        if self.scene_scheduler is not None:
+            if self.scene_episodes_left == 0:
+                self.scene_id = self.scene_scheduler.assign(self.scene_id,
+                                                            self.np_random or np.random)
+                self.scene_episodes_left = self.scene_scheduler.episodes_per_scene
+            self.scene_episodes_left -= 1
+        fast_reset = self.fast_reset and self.initial_state is not None and \
+            self.initial_state['scene_id'] == self.scene_id and \
+            self.resets_since_load + 1 < self.full_reset_interval
+        if fast_reset:
+            self.restore_initial_state()
+            self.resets_since_load += 1
+            self.num_fast_resets += 1
+        else:
+            self.load_scene()
+            self.resets_since_load = 0
+            self.num_scene_loads += 1
+        if self.scene_scheduler is not None:
+            self.scene_scheduler.record_episode(self.scene_id, scene_loaded=not fast_reset)
+        self.task.reset()
+        state = self.preprocess(self.event.frame)
+        return state
+
+    def load_scene(self):
+        """
+        Loads scene_id from scratch and records the initial state of the scene that
+        restore_initial_state goes back to: the pose of the agent, the poses of the objects which
+        can be moved and whether the openable objects are open
+        """
         self.controller.reset(self.scene_id)
         self.event = self.controller.step(dict(action='Initialize', gridSize=self.gridSize,
                                                cameraY=self.cameraY,
@@ -256,9 +375,61 @@ class AI2ThorEnv(gym.Env):
                                                renderClassImage=self.render_options['class'],
                                                renderObjectImage=self.render_options['object'],
                                                continuous=self.continuous_movement))
-        self.task.reset()
-        state = self.preprocess(self.event.frame)
-        return state
+        if not (self.fast_reset or self.random_initial_pose):
+            return
+        agent = self.event.metadata['agent']
+        objects = self.event.metadata['objects']
+        self.initial_state = {
+            'scene_id': self.scene_id,
+            'agent_pose': dict(agent['position'], rotation=agent['rotation']['y'],
+                               horizon=agent['cameraHorizon']),
+            'object_poses': [{'objectName': obj['name'], 'position': dict(obj['position']),
+                              'rotation': dict(obj['rotation'])} for obj in objects
+                             if obj['pickupable'] or obj.get('moveable', False)],
+            'open_objects': {obj['objectId']: obj['isOpen'] for obj in objects
+                             if obj['openable']},
+            'reachable_positions': None}
+        if self.random_initial_pose:
+            event = self.controller.step(dict(action='GetReachablePositions'))
+            self.initial_state['reachable_positions'] = event.metadata['actionReturn']
+            self.teleport(self.random_pose())
+
+    def restore_initial_state(self):
+        """
+        Brings the loaded scene back to the state recorded by load_scene without reloading it. Only
+        what the actions of this wrapper change is restored: the held object is dropped, the objects
+        are moved back to their initial poses if any of them moved, the openable objects are opened
+        or closed as they were and the agent is teleported to its initial (or a random) pose
+        """
+        initial_state = self.initial_state
+        if self.event.metadata['inventoryObjects']:
+            self.event = self.controller.step(dict(action='DropHandObject', forceAction=True))
+        positions = {obj['name']: obj['position'] for obj in self.event.metadata['objects']}
+        if any(positions[pose['objectName']] != pose['position']
+               for pose in initial_state['object_poses']):
+            self.event = self.controller.step(dict(action='SetObjectPoses',
+                                                   objectPoses=initial_state['object_poses']))
+        for obj in self.event.metadata['objects']:
+            if obj['openable'] and obj['isOpen'] != initial_state['open_objects'][obj['objectId']]:
+                self.event = self.controller.step(dict(
+                    action='CloseObject' if obj['isOpen'] else 'OpenObject',
+                    objectId=obj['objectId'], forceAction=True))
+        self.teleport(self.random_pose() if self.random_initial_pose
+                      else initial_state['agent_pose'])
+
+    def random_pose(self):
+        """ Random reachable position and rotation with the initial camera horizon """
+        # choice exists on both the RandomState and the Generator returned by gym's seeding
+        random_state = self.np_random or np.random
+        positions = self.initial_state['reachable_positions']
+        position = positions[random_state.choice(len(positions))]
+        return dict(position, rotation=float(random_state.choice([0, 90, 180, 270])),
+                    horizon=self.initial_state['agent_pose']['horizon'])
+
+    def teleport(self, pose):
+        self.event = self.controller.step(dict(action='TeleportFull', **pose))
+        if self.continuous_movement:
+            self.absolute_rotation = pose['rotation']
 
     def render(self, mode='human'):
         raise NotImplementedError
@@ -271,6 +442,9 @@ class AI2ThorEnv(gym.Env):
         return seed1
 
     def close(self):
+        if self.step_executor is not None:
+            self.step_executor.shutdown(wait=True)  # finishes the pending step if any
+            self.step_executor, self.pending_step = None, None
         self.controller.stop()
 
 
@@ -0,0 +1,200 @@
+"""
+Vectorized version of the ai2thor wrapper. N AI2ThorEnv instances are run in their own subprocess
+so that the Unity controllers render in parallel while the main process only waits for the slowest
+of them. Observations are written by each worker into a single shared-memory array of shape
+(num_envs, C, H, W) instead of being pickled through the pipes, so only the small reward, done and
+info values are sent back on every step. With a multi-scene config ("scenes"), the workers share
+one SceneScheduler which assigns them their scenes. A worker which raises an exception sends its
+traceback back before exiting and a worker which dies without doing so is detected by polling, so
+that the main process raises a WorkerError instead of waiting forever for their results.
+"""
+import multiprocessing as mp
+import traceback
+
+import numpy as np
+
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+from gym_ai2thor.scene_scheduler import scene_scheduler_from_config
+from gym_ai2thor.utils import read_config
+
+# ctypes typecodes used to allocate the shared observation array for each supported numpy dtype
+SHARED_ARRAY_TYPECODES = {np.dtype(np.uint8): 'B', np.dtype(np.float32): 'f'}
+
+
+class WorkerError(RuntimeError):
+    """ Raised by VectorAI2ThorEnv when one of its workers failed or died """
+
+
+def _worker(rank, remote, parent_remote, shared_observations, observations_shape,
+            observations_dtype, seed, config_file, config_dict, scene_scheduler):
+    """
+    Loop run by each subprocess. Commands are received through the pipe as (command, data) tuples
+    and the observation of the worker env is always written into its slot of the shared array.
+    Episodes are reset automatically when done and the last observation of the finished episode is
+    returned in info['terminal_observation']. If anything raises, the traceback is sent back in a
+    WorkerError instead of the result.
+    """
+    parent_remote.close()
+    env = None
+    observations = np.frombuffer(shared_observations, dtype=observations_dtype).reshape(
+        observations_shape)
+    try:
+        env = AI2ThorEnv(seed=seed, config_file=config_file, config_dict=config_dict,
+                         scene_scheduler=scene_scheduler)
+        while True:
+            command, data = remote.recv()
+            if command == 'step':
+                state, reward, done, info = env.step(data, verbose=False)
+                if done:
+                    info['terminal_observation'] = state
+                    state = env.reset()
+                observations[rank] = state
+                remote.send((reward, done, info))
+            elif command == 'reset':
+                observations[rank] = env.reset()
+                remote.send(None)
+            elif command == 'get_spaces':
+                remote.send((env.observation_space, env.action_space))
+            elif command == 'close':
+                env.close()
+                remote.close()
+                break
+            else:
+                raise NotImplementedError('Command {} is not implemented'.format(command))
+    except KeyboardInterrupt:
+        print('VectorAI2ThorEnv worker {}: got KeyboardInterrupt'.format(rank))
+        if env is not None:
+            env.close()
+    except Exception:
+        remote.send(WorkerError('VectorAI2ThorEnv worker {} failed:\n{}'.format(
+            rank, traceback.format_exc())))
+        if env is not None:
+            env.close()
+
+
+class VectorAI2ThorEnv:
+    """
+    Runs num_envs AI2ThorEnv workers in subprocesses and steps them in lockstep with batched
+    actions, rewards, dones and observations. All workers share the same configuration (file and
+    dict) and each one is seeded with seed + rank. The scene_scheduler of a multi-scene config is
+    shared by all the workers, so its stats cover the whole pool.
+    """
+    # seconds between the checks that a worker is still alive while waiting for its result
+    poll_interval = 1.
+
+    def __init__(self, num_envs, seed=None, config_file='config_files/config_example.json',
+                 config_dict=None, start_method=None):
+        """
+        :param num_envs:     (int)   Number of AI2ThorEnv workers (one subprocess each)
+        :param seed:         (int)   Random seed. Worker envs are seeded with seed + rank
+        :param config_file:  (str)   Path to environment configuration file. Either absolute or
+                                     relative path to the root of this repository.
+        :param config_dict:  (dict)  Overrides specific fields from the input configuration file.
+        :param start_method: (str)   multiprocessing start method ('fork', 'spawn', etc.). Default
+                                     of the platform is used if None
+        """
+        self.num_envs = num_envs
+        self.config = read_config(config_file, config_dict)
+        channels = 1 if self.config['grayscale'] else 3
+        self.observations_shape = (num_envs, channels) + tuple(self.config['resolution'])
+        self.observations_dtype = np.dtype(self.config.get('observation_dtype', 'float32'))
+
+        context = mp.get_context(start_method)
+        self.scene_scheduler = scene_scheduler_from_config(self.config, context=context)
+        self._shared_observations = context.RawArray(
+            SHARED_ARRAY_TYPECODES[self.observations_dtype],
+            int(np.prod(self.observations_shape)))
+        self.observations = np.frombuffer(self._shared_observations,
+                                          dtype=self.observations_dtype).reshape(
+                                              self.observations_shape)
+
+        self.remotes, self.work_remotes = zip(*[context.Pipe() for _ in range(num_envs)])
+        self.processes = []
+        for rank, (work_remote, remote) in enumerate(zip(self.work_remotes, self.remotes)):
+            worker_seed = seed + rank if seed is not None else None
+            process = context.Process(target=_worker,
+                                      args=(rank, work_remote, remote, self._shared_observations,
+                                            self.observations_shape, self.observations_dtype,
+                                            worker_seed, config_file, config_dict,
+                                            self.scene_scheduler))
+            process.daemon = True  # if the main process crashes, we should not cause things to hang
+            process.start()
+            self.processes.append(process)
+        for work_remote in self.work_remotes:
+            work_remote.close()
+
+        self.closed = False
+        self.remotes[0].send(('get_spaces', None))
+        self.observation_space, self.action_space = self._recv(0)
+        self.waiting = False
+
+    def _recv(self, rank):
+        """
+        Returns the next result of worker rank, checking every poll_interval seconds that it is
+        still alive. Raises a WorkerError if the worker sent one back or died.
+        """
+        remote, process = self.remotes[rank], self.processes[rank]
+        while not remote.poll(self.poll_interval):
+            if not process.is_alive():
+                raise WorkerError('VectorAI2ThorEnv worker {} died with exit code {}'.format(
+                    rank, process.exitcode))
+        result = remote.recv()
+        if isinstance(result, WorkerError):
+            raise result
+        return result
+
+    def step_async(self, actions):
+        """
+        Sends one action to each worker without waiting for the results
+        """
+        for remote, action in zip(self.remotes, actions):
+            remote.send(('step', int(action)))
+        self.waiting = True
+
+    def step_wait(self):
+        """
+        Waits for all workers to finish their step and returns the batched results
+        :return: (observations[N, C, H, W], rewards[N], dones[N], infos) where the observations are
+                 a copy of the shared-memory array
+        """
+        self.waiting = False
+        results = [self._recv(rank) for rank in range(self.num_envs)]
+        rewards, dones, infos = zip(*results)
+        return self.observations.copy(), np.array(rewards, dtype=np.float32), \
+            np.array(dones, dtype=np.bool_), list(infos)
+
+    def step(self, actions):
+        """
+        Steps all workers with actions, resetting automatically the ones whose episode finished.
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for rank in range(self.num_envs):
+            self._recv(rank)
+        return self.observations.copy()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for rank, (remote, process) in enumerate(zip(self.remotes, self.processes)):
+            if self.waiting:
+                try:
+                    self._recv(rank)
+                except WorkerError:
+                    pass
+            if process.is_alive():
+                try:
+                    remote.send(('close', None))
+                except (BrokenPipeError, EOFError):
+                    pass
+        self.waiting = False
+        for process in self.processes:
+            process.join()
+
+    def __len__(self):
+        return self.num_envs
@@ -1,7 +1,15 @@
 """"
 Auxiliary functions for image processing
 """
+from functools import lru_cache
+
 import numpy as np
+from skimage import transform
+try:
+    import cv2
+    cv2_installed = True
+except ImportError:
+    cv2_installed = False
 
 
 def rgb2gray(rgb):
@@ -10,3 +18,89 @@ def rgb2gray(rgb):
     https://en.wikipedia.org/wiki/Luma_(video)
     """
     return np.expand_dims(np.dot(rgb[..., :3], [0.299, 0.587, 0.114]), axis=2)
+
+
+def rgb2gray_uint8(rgb, out=None):
+    """
+    Integer version of rgb2gray for uint8 images. The BT.601 weights are scaled to sum up to 256
+    (77, 150, 29) so that the Luma is computed with integer multiply-adds and a final shift,
+    avoiding any float conversion. Returns a uint8 image of shape H x W
+    """
+    luma = rgb[..., 0].astype(np.uint16) * 77
+    luma += rgb[..., 1].astype(np.uint16) * 150
+    luma += rgb[..., 2].astype(np.uint16) * 29
+    luma += 128  # round to nearest
+    luma >>= 8
+    if out is None:
+        return luma.astype(np.uint8)
+    np.copyto(out, luma, casting='unsafe')
+    return out
+
+
+@lru_cache(maxsize=None)
+def _area_weights(in_size, out_size):
+    """
+    Matrix of shape out_size x in_size with the fraction of each input pixel covered by each output
+    pixel, i.e. the same weights used by area interpolation (cv2.INTER_AREA)
+    """
+    scale = in_size / out_size
+    edges = np.arange(out_size + 1) * scale
+    pixels = np.arange(in_size)
+    low = np.maximum(edges[:-1, None], pixels[None, :])
+    high = np.minimum(edges[1:, None], pixels[None, :] + 1)
+    return (np.clip(high - low, 0, None) / scale).astype(np.float32)
+
+
+def resize_area(img, resolution):
+    """
+    Resizes an H x W x C uint8 image to resolution (height, width) with area interpolation. Uses
+    OpenCV if installed and otherwise two matrix products with the area weights.
+    """
+    height, width = resolution
+    if cv2_installed:
+        resized = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        # cv2 drops the channel axis of single channel images
+        return resized if resized.ndim == img.ndim else resized[..., np.newaxis]
+    rows = _area_weights(img.shape[0], height)
+    cols = _area_weights(img.shape[1], width)
+    resized = rows @ img.reshape(img.shape[0], -1).astype(np.float32)
+    # (height, W, C) -> (C, height, W) @ (W, width) -> (height, width, C)
+    resized = np.moveaxis(resized.reshape(height, img.shape[1], -1), 2, 0) @ cols.T
+    return np.moveaxis(np.rint(resized).astype(np.uint8), 0, 2)
+
+
+def skimage_preprocess(img, resolution, grayscale):
+    """
+    Original preprocessing with scikit-image. Returns a float32 C x H x W image in [0, 1]
+    """
+    img = transform.resize(img, resolution, mode='reflect')
+    img = img.astype(np.float32)
+    if grayscale:
+        img = rgb2gray(img)
+    img = np.moveaxis(img, 2, 0)
+    return img
+
+
+def fast_preprocess(img, resolution, grayscale, out=None):
+    """
+    Area-interpolation resize followed by the integer Luma (if grayscale) which keeps the image as
+    uint8 from the raw frame to the state. Returns a uint8 C x H x W image in [0, 255] and, if
+    given, writes it into the out buffer of the same shape.
+    """
+    img = resize_area(img, resolution)
+    if grayscale:
+        if out is None:
+            return rgb2gray_uint8(img)[np.newaxis]
+        rgb2gray_uint8(img, out=out[0])
+        return out
+    if out is None:
+        return np.ascontiguousarray(np.moveaxis(img, 2, 0))
+    np.copyto(out, np.moveaxis(img, 2, 0))
+    return out
+
+
+# Backends selectable with the 'preprocess_backend' key of the config file
+PREPROCESS_BACKENDS = {
+    'skimage': skimage_preprocess,
+    'fast': fast_preprocess
+}
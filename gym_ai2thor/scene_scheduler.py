@@ -0,0 +1,107 @@
+"""
+Scene scheduling for multi-scene configs, where the "scenes" entry maps scene names to sampling
+weights instead of a single "scene_id", e.g.
+
+    "scenes": {"FloorPlan1": 2, "FloorPlan28": 1, "FloorPlan30": 1},
+    "episodes_per_scene": 20,
+    "scene_sampling": "scheduled",
+    "fast_reset": true
+
+Loading a scene costs much more than resetting the loaded one with "fast_reset" (see AI2ThorEnv),
+so with the default "scheduled" sampling every env keeps its scene for episodes_per_scene episodes
+at a time while the scenes still get their share of all the episodes. "random" sampling draws the
+scene of every episode from the weights instead, which is the naive baseline. Without fast_reset,
+every reset would reload the scene whether it changed or not, so multi-scene configs require it.
+"""
+import multiprocessing as mp
+
+import numpy as np
+
+SCENE_SAMPLINGS = ('scheduled', 'random')
+
+
+class SceneScheduler:
+    """
+    Assigns the scenes of the episodes of one or more AI2ThorEnv, e.g. all the workers of a
+    VectorAI2ThorEnv which share one scheduler. Scenes are assigned for episodes_per_scene episodes
+    at a time: an env keeps its current scene for another round while that scene has not had its
+    share of the episodes assigned so far, otherwise it moves to the scene furthest behind its
+    share. The assigned, played and loaded episode counts of every scene are kept in shared memory
+    so that the scheduler can be passed to subprocesses.
+    """
+    def __init__(self, scenes, episodes_per_scene=10, sampling='scheduled', context=None):
+        """
+        :param scenes:             (dict) Sampling weight of each scene name
+        :param episodes_per_scene: (int)  Number of episodes an env plays in a scene once assigned
+        :param sampling:           (str)  'scheduled' or 'random' (a scene sampled every episode)
+        :param context:            multiprocessing context of the processes sharing the scheduler
+        """
+        if sampling not in SCENE_SAMPLINGS:
+            raise ValueError('Invalid scene_sampling: {}. Choose one of {}'.format(
+                sampling, list(SCENE_SAMPLINGS)))
+        weights = np.array(list(scenes.values()), dtype=np.float64)
+        if len(weights) == 0 or np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError('scenes must map scene names to non-negative weights, not {}'.format(
+                scenes))
+        if episodes_per_scene < 1:
+            raise ValueError('episodes_per_scene must be at least 1')
+        self.scene_names = list(scenes)
+        self.weights = weights / weights.sum()
+        self.sampling = sampling
+        self.episodes_per_scene = episodes_per_scene if sampling == 'scheduled' else 1
+        context = context or mp
+        self.lock = context.Lock()
+        self.assigned_episodes = context.RawArray('d', len(self.scene_names))
+        self.episodes = context.RawArray('d', len(self.scene_names))
+        self.scene_loads = context.RawArray('d', len(self.scene_names))
+
+    def assign(self, current_scene=None, random_state=np.random):
+        """
+        Returns the scene of the next episodes_per_scene episodes of an env
+        :param current_scene: (str) Scene loaded by the env (None before its first episode)
+        :param random_state:  RandomState used by the random sampling
+        """
+        with self.lock:
+            assigned_episodes = np.frombuffer(self.assigned_episodes)
+            if self.sampling == 'random':
+                index = random_state.choice(len(self.weights), p=self.weights)
+            else:
+                # episodes each scene is short of its share once this round is assigned
+                deficits = self.weights * (assigned_episodes.sum() + self.episodes_per_scene) - \
+                    assigned_episodes
+                if current_scene in self.scene_names and \
+                        deficits[self.scene_names.index(current_scene)] >= 0:
+                    index = self.scene_names.index(current_scene)
+                else:
+                    index = int(np.argmax(deficits))
+            assigned_episodes[index] += self.episodes_per_scene
+        return self.scene_names[index]
+
+    def record_episode(self, scene, scene_loaded):
+        """ Counts an episode started in scene, which was loaded for it if scene_loaded """
+        index = self.scene_names.index(scene)
+        with self.lock:
+            self.episodes[index] += 1
+            self.scene_loads[index] += scene_loaded
+
+    def stats(self):
+        """ Returns the weight, number of episodes and number of loads of each scene """
+        with self.lock:
+            return {scene: {'weight': float(weight), 'episodes': int(episodes),
+                            'scene_loads': int(scene_loads)}
+                    for scene, weight, episodes, scene_loads in zip(
+                        self.scene_names, self.weights, self.episodes, self.scene_loads)}
+
+
+def scene_scheduler_from_config(config, context=None):
+    """
+    Returns the SceneScheduler of the "scenes" of config, or None if it has a single scene_id
+    :param context: multiprocessing context of the processes sharing the scheduler
+    """
+    if 'scenes' not in config:
+        return None
+    if not config.get('fast_reset', False):
+        raise ValueError('"scenes" requires "fast_reset": true, otherwise every reset reloads the '
+                         'scene whether it changed or not')
+    return SceneScheduler(config['scenes'], config.get('episodes_per_scene', 10),
+                          config.get('scene_sampling', 'scheduled'), context=context)
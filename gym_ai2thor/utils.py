@@ -32,12 +32,22 @@ def read_config(config_path, config_dict=None):
         "scene_id": "FloorPlan28",
         "grayscale": true,
         "resolution": [128, 128],
+        "preprocess_backend": "fast",
+        "observation_dtype": "uint8",
+        "controller": {"type": "synthetic", "step_latency": 0.01},
+        "fast_reset": true,
+        "full_reset_interval": 10,
+        "random_initial_pose": false,
         "task": {
             "task_name": "PickUp",
             "target_object": {"Mug": 1}
         }
     }
 
+    Instead of a single "scene_id", "scenes" can map several scenes to their sampling weights, e.g.
+    "scenes": {"FloorPlan1": 2, "FloorPlan28": 1}, "episodes_per_scene": 10 (see
+    gym_ai2thor.scene_scheduler).
+
     """
     config_path = os.path.join(os.path.dirname(__file__), config_path)
     if os.path.isfile(config_path):
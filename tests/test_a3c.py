@@ -0,0 +1,328 @@
+"""
+Tests related to the A3C/A2C losses, the syncing of the local and shared models and the shared
+optimizers.
+"""
+import argparse
+import json
+import multiprocessing
+from multiprocessing.reduction import ForkingPickler
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import torch
+
+from algorithms.a3c.a2c import train_a2c
+from algorithms.a3c.my_optim import SharedAdam, SharedRMSprop, flat_view
+from algorithms.a3c.model import ActorCritic, FlatParameters, flat_gradients
+from algorithms.a3c.stats import WorkerStats
+from algorithms.a3c.train import a3c_losses, discounted_cumsum
+from gym_ai2thor.envs.vector_env import VectorAI2ThorEnv
+from gym_ai2thor.utils import read_config
+
+
+def make_args(**kwargs):
+    """ Default A3C loss arguments (as in algorithms/a3c/main.py) """
+    args = dict(gamma=0.99, tau=0.95, entropy_coef=0.01)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def reference_losses(args, values, log_probs, entropies, rewards, R):
+    """
+    Step by step losses of a single env rollout as previously computed in train.py
+    """
+    values = [value.view(1, 1) for value in values] + [R.view(1, 1)]
+    R = R.view(1, 1)
+    policy_loss, value_loss = 0, 0
+    gae = torch.zeros(1, 1)
+    for i in reversed(range(len(rewards))):
+        R = args.gamma * R + rewards[i]
+        advantage = R - values[i]
+        value_loss = value_loss + 0.5 * advantage.pow(2)
+        delta_t = rewards[i] + args.gamma * values[i + 1] - values[i]
+        gae = gae * args.gamma * args.tau + delta_t
+        policy_loss = policy_loss - log_probs[i] * gae.detach() - \
+            args.entropy_coef * entropies[i]
+    return policy_loss.squeeze(), value_loss.squeeze()
+
+
+class TestA3CLosses(unittest.TestCase):
+    def test_discounted_cumsum_matches_loop(self):
+        torch.manual_seed(0)
+        x, bootstrap = torch.randn(50, 3), torch.randn(3)
+        discounts = 0.9 * (torch.rand(50, 3) > 0.1).float()
+        expected, y = torch.zeros(50, 3), bootstrap
+        for t in reversed(range(50)):
+            y = x[t] + discounts[t] * y
+            expected[t] = y
+        torch.testing.assert_close(discounted_cumsum(x, discounts, bootstrap), expected)
+
+    def test_single_env_losses_and_gradients(self):
+        args = make_args()
+        for num_steps in [1, 5, 20]:
+            torch.manual_seed(num_steps)
+            values = torch.randn(num_steps, 1, requires_grad=True)
+            log_probs = torch.randn(num_steps, 1, requires_grad=True)
+            entropies = torch.rand(num_steps, 1, requires_grad=True)
+            rewards, R = torch.randn(num_steps, 1), torch.randn(1)
+            losses = a3c_losses(args, values, log_probs, entropies, rewards,
+                                torch.ones(num_steps, 1), R)
+            gradients = torch.autograd.grad(sum(losses), [values, log_probs, entropies])
+            expected = reference_losses(args, values, log_probs, entropies, rewards, R)
+            expected_gradients = torch.autograd.grad(sum(expected),
+                                                     [values, log_probs, entropies])
+            for loss, expected_loss in zip(losses, expected):
+                torch.testing.assert_close(loss, expected_loss)
+            for gradient, expected_gradient in zip(gradients, expected_gradients):
+                torch.testing.assert_close(gradient, expected_gradient)
+
+    def test_masked_batch_matches_episodes(self):
+        """
+        The losses of N envs with episodes finishing within the rollout are the average of the
+        losses of each episode computed separately (bootstrapped with 0 if it finished)
+        """
+        args = make_args()
+        torch.manual_seed(0)
+        num_steps, num_envs = 12, 3
+        values, log_probs = torch.randn(num_steps, num_envs), torch.randn(num_steps, num_envs)
+        entropies, rewards = torch.rand(num_steps, num_envs), torch.randn(num_steps, num_envs)
+        next_value = torch.randn(num_envs)
+        masks = torch.ones(num_steps, num_envs)
+        masks[3, 0], masks[8, 0], masks[11, 1] = 0, 0, 0
+        policy_loss, value_loss = a3c_losses(args, values, log_probs, entropies, rewards, masks,
+                                             next_value)
+        expected_policy_loss, expected_value_loss = 0, 0
+        for env in range(num_envs):
+            starts = [0] + [t + 1 for t in range(num_steps - 1) if masks[t, env] == 0]
+            ends = starts[1:] + [num_steps]
+            for start, end in zip(starts, ends):
+                R = next_value[env] * masks[end - 1, env]
+                episode = slice(start, end)
+                losses = reference_losses(args, values[episode, env], log_probs[episode, env],
+                                          entropies[episode, env], rewards[episode, env], R)
+                expected_policy_loss += losses[0] / num_envs
+                expected_value_loss += losses[1] / num_envs
+        torch.testing.assert_close(policy_loss, expected_policy_loss)
+        torch.testing.assert_close(value_loss, expected_value_loss)
+
+
+class TestFlatParameters(unittest.TestCase):
+    def test_sync_and_shared_update(self):
+        torch.manual_seed(0)
+        shared_model = ActorCritic(1, 4, 32)
+        shared_state = {name: tensor.clone() for name, tensor in shared_model.state_dict().items()}
+        shared_parameters = FlatParameters(shared_model, share_memory=True)
+        self.assertTrue(shared_parameters.data.is_shared())
+        for name, tensor in shared_model.state_dict().items():
+            torch.testing.assert_close(tensor, shared_state[name])
+        optimizer = torch.optim.SGD(shared_model.parameters(), lr=1e-2)
+
+        model = ActorCritic(1, 4, 32)
+        parameters = FlatParameters(model)
+        self.assertTrue(parameters.sync_with(shared_parameters))
+        self.assertFalse(parameters.sync_with(shared_parameters))  # nothing changed
+        for name, tensor in model.state_dict().items():
+            torch.testing.assert_close(tensor, shared_state[name])
+
+        # Gradients of the local model are used by the optimiser of the shared model
+        for _ in range(2):
+            parameters.zero_grad()
+            value, logit, _ = model((torch.rand(2, 1, 32, 32), (torch.zeros(2, 256),
+                                                                torch.zeros(2, 256))))
+            (value.sum() + logit.sum()).backward()
+            expected_grads = [param.grad.clone() for param in model.parameters()]
+            parameters.push_gradients(shared_model)
+            for shared_param, expected_grad in zip(shared_model.parameters(), expected_grads):
+                torch.testing.assert_close(shared_param.grad, expected_grad)
+            optimizer.step()
+            shared_parameters.increment_version()
+            self.assertTrue(parameters.sync_with(shared_parameters))
+            torch.testing.assert_close(parameters.data, shared_parameters.data)
+        self.assertFalse(torch.equal(shared_parameters.data[:10],
+                                     shared_state['conv1.weight'].view(-1)[:10]))
+
+    def test_flat_gradients_of_shared_model(self):
+        """ The shared model trained directly by A2C gets flat gradients for the optimizers """
+        torch.manual_seed(0)
+        model = ActorCritic(1, 4, 32)
+        FlatParameters(model, share_memory=True)
+        grad = flat_gradients(model)
+        for _ in range(2):
+            grad.zero_()
+            value, logit, _ = model((torch.rand(2, 1, 32, 32), (torch.zeros(2, 256),
+                                                                torch.zeros(2, 256))))
+            (value.sum() + logit.sum()).backward()
+            flat_grad = flat_view([param.grad for param in model.parameters()])
+            self.assertIsNotNone(flat_grad)
+            self.assertEqual(flat_grad.data_ptr(), grad.data_ptr())
+            self.assertGreater(grad.abs().sum().item(), 0)
+        self.assertIsNotNone(flat_view(list(model.parameters())))
+
+
+class TestSharedOptimizers(unittest.TestCase):
+    def check_matches(self, shared_optimizer, reference_optimizer, flat):
+        torch.manual_seed(0)
+        model = ActorCritic(1, 4, 32)
+        reference_model = ActorCritic(1, 4, 32)
+        reference_model.load_state_dict(model.state_dict())
+        if flat:
+            parameters = FlatParameters(model)
+        optimizer = shared_optimizer(model.parameters(), lr=1e-3)
+        optimizer.share_memory()
+        reference = reference_optimizer(reference_model.parameters(), lr=1e-3)
+        for _ in range(5):
+            inputs = (torch.rand(2, 1, 32, 32), (torch.zeros(2, 256), torch.zeros(2, 256)))
+            for net, net_optimizer in ((model, optimizer), (reference_model, reference)):
+                if flat and net is model:
+                    parameters.zero_grad()
+                else:
+                    net_optimizer.zero_grad()
+                value, logit, _ = net(inputs)
+                (value.sum() + logit.pow(2).sum()).backward()
+            self.assertEqual(flat_view([p.grad for p in model.parameters()]) is not None, flat)
+            optimizer.step()
+            reference.step()
+        for param, reference_param in zip(model.parameters(), reference_model.parameters()):
+            torch.testing.assert_close(param, reference_param, rtol=1e-4, atol=1e-6)
+        self.assertEqual(optimizer.step_count.item(), 5)
+        self.assertTrue(all(statistic.is_shared() for statistic in optimizer.statistics.values()))
+
+    def test_adam_matches_torch(self):
+        for flat in (True, False):
+            self.check_matches(SharedAdam, torch.optim.Adam, flat)
+
+    def test_rmsprop_matches_torch(self):
+        for flat in (True, False):
+            self.check_matches(SharedRMSprop, torch.optim.RMSprop, flat)
+
+    def test_pickled_optimizer_shares_statistics_but_not_buffer(self):
+        """ As when the optimizer is passed to spawned processes by torch.multiprocessing """
+        model = ActorCritic(1, 4, 32)
+        model.share_memory()
+        optimizer = SharedAdam(model.parameters())
+        optimizer.share_memory()
+        for param in model.parameters():
+            param.grad = torch.randn_like(param)
+        optimizer.step()
+        restored = ForkingPickler.loads(ForkingPickler.dumps(optimizer))
+        self.assertIsNone(restored.buffer)
+        for param in restored.params:
+            param.grad = torch.randn_like(param)
+        restored.step()
+        # both update the same shared step count, statistics and parameters
+        self.assertEqual(optimizer.step_count.item(), 2)
+        for name, statistic in optimizer.statistics.items():
+            torch.testing.assert_close(statistic, restored.statistics[name])
+        for param, restored_param in zip(model.parameters(), restored.params):
+            torch.testing.assert_close(param, restored_param)
+        self.assertNotEqual(optimizer.buffer.data_ptr(), restored.buffer.data_ptr())
+
+
+def count_steps(rank, stats, num_steps):
+    for _ in range(num_steps):
+        stats.add(rank, env_steps=1)
+    stats.add(rank, updates=rank, sync_seconds=0.5)
+
+
+class TestWorkerStats(unittest.TestCase):
+    def test_worker_slots_are_summed(self):
+        context = multiprocessing.get_context('fork')
+        stats = WorkerStats(4, context=context)
+        processes = [context.Process(target=count_steps, args=(rank, stats, 1000))
+                     for rank in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(stats.total('env_steps'), 4000)
+        self.assertEqual(stats.total('updates'), 0 + 1 + 2 + 3)
+        self.assertEqual(stats.worker(2), {'env_steps': 1000, 'updates': 2, 'sync_seconds': 0.5})
+        self.assertIn('env steps 4000', stats.summary())
+
+
+class StopTraining(Exception):
+    pass
+
+
+class StopAfterUpdates(WorkerStats):
+    """ Stops the endless training loop after num_updates optimiser updates """
+    def __init__(self, num_updates):
+        super().__init__(1)
+        self.num_updates = num_updates
+
+    def add(self, rank, env_steps=0, updates=0, sync_seconds=0.):
+        super().add(rank, env_steps, updates, sync_seconds)
+        if self.total('updates') >= self.num_updates:
+            raise StopTraining
+
+
+class TestA2C(unittest.TestCase):
+    def test_train_a2c(self):
+        """
+        Runs a few updates of train_a2c on 2 envs with the synthetic controller, checking that the
+        parameters change, that the losses are finite and that the LSTM states of the envs whose
+        episode finished start from zeros on the next step
+        """
+        config = read_config('config_files/rainbow_synthetic.json',
+                             {'resolution': [32, 32], 'observation_dtype': 'float32'})
+        num_updates, num_steps = 3, 5
+        with tempfile.TemporaryDirectory() as directory:
+            config_file = os.path.join(directory, 'config.json')
+            with open(config_file, 'w') as f:
+                json.dump(config, f)
+            args = make_args(seed=0, lr=1e-3, num_processes=2, num_steps=num_steps,
+                             max_episode_length=4, value_loss_coef=0.5, max_grad_norm=50,
+                             config_file=config_file)
+            events = []  # forward inputs and dones in the order of the training loop
+
+            class RecordingActorCritic(ActorCritic):
+                def forward(self, inputs):
+                    events.append(('forward', inputs[1][0].clone(), inputs[1][1].clone()))
+                    return super().forward(inputs)
+
+            class RecordingVectorEnv(VectorAI2ThorEnv):
+                def step(self, actions):
+                    results = super().step(actions)
+                    events.append(('done', results[2]))
+                    return results
+
+            torch.manual_seed(0)
+            env = VectorAI2ThorEnv(1, config_file=config_file, start_method='fork')
+            shared_model = RecordingActorCritic(1, env.action_space.n, 32)
+            env.close()
+            initial_parameters = [param.detach().clone() for param in shared_model.parameters()]
+            losses = []
+
+            def record_losses(*loss_args):
+                losses.append(a3c_losses(*loss_args))
+                return losses[-1]
+
+            stats = StopAfterUpdates(num_updates)
+            with mock.patch('algorithms.a3c.a2c.VectorAI2ThorEnv', RecordingVectorEnv), \
+                    mock.patch('algorithms.a3c.a2c.a3c_losses', side_effect=record_losses):
+                with self.assertRaises(StopTraining):
+                    train_a2c(args, shared_model, stats, start_method='fork')
+
+        self.assertEqual(stats.total('env_steps'), num_updates * num_steps * 2)
+        self.assertEqual(len(losses), num_updates)
+        for policy_loss, value_loss in losses:
+            self.assertTrue(torch.isfinite(policy_loss) and torch.isfinite(value_loss))
+        self.assertTrue(any(not torch.equal(param, initial_param) for param, initial_param in
+                            zip(shared_model.parameters(), initial_parameters)))
+
+        # every step is followed by a forward pass, either of the next step or of the bootstrap
+        dones = [event[1] for event in events if event[0] == 'done']
+        self.assertTrue(any(done.any() for done in dones))
+        for event, next_event in zip(events, events[1:]):
+            if event[0] == 'done':
+                self.assertEqual(next_event[0], 'forward')
+                _, hx, cx = next_event
+                for rank, done in enumerate(event[1]):
+                    self.assertEqual(bool(hx[rank].eq(0).all()), bool(done))
+                    self.assertEqual(bool(cx[rank].eq(0).all()), bool(done))
+
+
+if __name__ == '__main__':
+    unittest.main()
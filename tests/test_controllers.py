@@ -0,0 +1,284 @@
+"""
+Tests related to the stand-in controllers used to run the ai2thor wrapper without a simulator and
+to the parts of the wrapper tested with them.
+"""
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from gym import error
+import numpy as np
+
+from gym_ai2thor.controllers import RecordingController, ReplayController, SyntheticController
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+
+
+def run_actions(controller, actions, scene_name='FloorPlan28'):
+    controller.reset(scene_name)
+    events = [controller.step(dict(action='Initialize', gridSize=0.25))]
+    for action in actions:
+        events.append(controller.step(dict(action=action)))
+    return events
+
+
+class TestSyntheticController(unittest.TestCase):
+    def test_deterministic_frames_and_objects(self):
+        actions = ['MoveAhead', 'RotateRight', 'MoveAhead', 'LookDown', 'RotateLeft', 'MoveBack']
+        first_events = run_actions(SyntheticController(), actions)
+        second_events = run_actions(SyntheticController(), actions)
+        for first, second in zip(first_events, second_events):
+            np.testing.assert_array_equal(first.frame, second.frame)
+            self.assertEqual(first.metadata, second.metadata)
+        # the frame changes with the pose and the scene
+        self.assertFalse(np.array_equal(first_events[1].frame, first_events[2].frame))
+        other_scene = run_actions(SyntheticController(), [], scene_name='FloorPlan1')[0]
+        self.assertFalse(np.array_equal(first_events[0].frame, other_scene.frame))
+        self.assertEqual(first_events[0].frame.shape, (300, 300, 3))
+        self.assertEqual(first_events[0].frame.dtype, np.uint8)
+
+    def test_pickup_and_put_visible_objects(self):
+        controller = SyntheticController(num_objects=40, visibility_distance=10)
+        event = run_actions(controller, [])[0]
+        visible = [obj for obj in event.metadata['objects'] if obj['visible']]
+        pickupable = next(obj for obj in visible if obj['pickupable'])
+        receptacle = next(obj for obj in visible if obj['receptacle'])
+        hidden = next(obj for obj in event.metadata['objects'] if not obj['visible'])
+        event = controller.step(dict(action='PickupObject', objectId=hidden['objectId']))
+        self.assertFalse(event.metadata['lastActionSuccess'])
+        event = controller.step(dict(action='PickupObject', objectId=pickupable['objectId']))
+        self.assertTrue(event.metadata['lastActionSuccess'])
+        self.assertEqual(event.metadata['inventoryObjects'][0]['objectId'],
+                         pickupable['objectId'])
+        event = controller.step(dict(action='PutObject', objectId=pickupable['objectId'],
+                                     receptacleObjectId=receptacle['objectId']))
+        self.assertTrue(event.metadata['lastActionSuccess'])
+        self.assertEqual(event.metadata['inventoryObjects'], [])
+
+    def test_env_selects_controller_from_config(self):
+        env = AI2ThorEnv(config_file='config_files/rainbow_synthetic.json')
+        self.assertIsInstance(env.controller, SyntheticController)
+        state = env.reset()
+        self.assertEqual(state.shape, env.observation_space.shape)
+        for _ in range(20):
+            state, reward, done, _ = env.step(env.action_space.sample(), verbose=False)
+            self.assertEqual(state.shape, env.observation_space.shape)
+        env.close()
+        with self.assertRaises(ValueError):
+            AI2ThorEnv(config_dict={'controller': {'type': 'simulator'}})
+
+
+class TestAsyncStep(unittest.TestCase):
+    ACTIONS = [0, 1, 2, 3, 0, 0, 1, 3, 2, 2]
+
+    def test_async_steps_match_blocking_steps(self):
+        env = AI2ThorEnv(config_file='config_files/rainbow_synthetic.json')
+        async_env = AI2ThorEnv(config_file='config_files/rainbow_synthetic.json')
+        np.testing.assert_array_equal(env.reset(), async_env.reset())
+        for action in self.ACTIONS:
+            state, reward, done, _ = env.step(action, verbose=False)
+            async_env.step_async(action, verbose=False)
+            async_state, async_reward, async_done, _ = async_env.step_wait()
+            np.testing.assert_array_equal(async_state, state)
+            self.assertEqual((async_reward, async_done), (reward, done))
+
+        async def run_episode():
+            return [await async_env.astep(action, verbose=False) for action in self.ACTIONS]
+        env.reset()
+        async_env.reset()
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(run_episode())
+        finally:
+            loop.close()
+        for action, (async_state, async_reward, _, _) in zip(self.ACTIONS, results):
+            state, reward, _, _ = env.step(action, verbose=False)
+            np.testing.assert_array_equal(async_state, state)
+            self.assertEqual(async_reward, reward)
+        env.close()
+        async_env.close()
+
+    def test_step_runs_in_background(self):
+        env = AI2ThorEnv(config_file='config_files/rainbow_synthetic.json',
+                         config_dict={'controller': {'type': 'synthetic', 'step_latency': 0.2}})
+        env.reset()
+        start = time.time()
+        env.step_async(0, verbose=False)
+        self.assertLess(time.time() - start, 0.1)  # returns before the controller step finishes
+        with self.assertRaises(RuntimeError):
+            env.step_async(0, verbose=False)
+        state, _, _, _ = env.step_wait()
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertEqual(state.shape, env.observation_space.shape)
+        with self.assertRaises(RuntimeError):
+            env.step_wait()
+        env.step_async(env.action_space.n, verbose=False)  # invalid actions raise on step_wait
+        with self.assertRaises(error.InvalidAction):
+            env.step_wait()
+        env.close()
+
+
+class TestFastReset(unittest.TestCase):
+    CONFIG = {'open_close_interaction': True, 'openable_objects': ['Microwave', 'Fridge'],
+              'controller': {'type': 'synthetic', 'num_objects': 40, 'visibility_distance': 10}}
+
+    def make_env(self, **config):
+        return AI2ThorEnv(config_file='config_files/rainbow_synthetic.json',
+                          config_dict=dict(self.CONFIG, **config))
+
+    def run_episode(self, env):
+        """ Moves the agent and changes the objects: picks up, opens and moves around """
+        actions = ['PickupObject', 'OpenObject', 'RotateRight', 'MoveAhead', 'LookDown',
+                   'PutObject', 'MoveAhead', 'PickupObject', 'RotateRight', 'MoveAhead']
+        for action in actions:
+            env.step(env.action_names.index(action), verbose=False)
+        # opens an object out of view too, so that the episode always changes the objects
+        closed = next(obj for obj in env.event.metadata['objects']
+                      if obj['openable'] and not obj['isOpen'])
+        env.event = env.controller.step(dict(action='OpenObject', objectId=closed['objectId'],
+                                             forceAction=True))
+        return env.event.metadata
+
+    def test_fast_reset_matches_full_reset(self):
+        full_env = self.make_env()
+        fast_env = self.make_env(fast_reset=True, full_reset_interval=100)
+        np.testing.assert_array_equal(full_env.reset(), fast_env.reset())
+        for _ in range(3):
+            metadata = self.run_episode(fast_env)
+            self.assertTrue(any(obj['isOpen'] for obj in metadata['objects']))
+            self.run_episode(full_env)
+            np.testing.assert_array_equal(full_env.reset(), fast_env.reset())
+            for key in ('agent', 'objects', 'inventoryObjects'):
+                self.assertEqual(full_env.event.metadata[key], fast_env.event.metadata[key])
+        self.assertEqual((fast_env.num_scene_loads, fast_env.num_fast_resets), (1, 3))
+        self.assertEqual((full_env.num_scene_loads, full_env.num_fast_resets), (4, 0))
+        full_env.close()
+        fast_env.close()
+
+    def test_full_reset_interval_and_scene_change(self):
+        env = self.make_env(fast_reset=True, full_reset_interval=3)
+        for _ in range(6):
+            env.reset()
+            self.run_episode(env)
+        self.assertEqual((env.num_scene_loads, env.num_fast_resets), (2, 4))
+        env.scene_id = 'FloorPlan1'
+        env.reset()
+        self.assertEqual(env.num_scene_loads, 3)
+        self.assertEqual(env.event.metadata['sceneName'], 'FloorPlan1')
+        env.close()
+        with self.assertRaises(ValueError):
+            self.make_env(fast_reset=True, full_reset_interval=0)
+
+    def test_random_initial_pose(self):
+        env = self.make_env(fast_reset=True, random_initial_pose=True)
+        env.seed(1)
+        env.reset()
+        reachable_positions = env.initial_state['reachable_positions']
+        poses = set()
+        for _ in range(5):
+            self.run_episode(env)
+            env.reset()
+            agent = env.event.metadata['agent']
+            self.assertIn(agent['position'], reachable_positions)
+            self.assertEqual(agent['rotation']['y'] % 90, 0)
+            self.assertEqual(env.event.metadata['inventoryObjects'], [])
+            poses.add((agent['position']['x'], agent['position']['z'], agent['rotation']['y']))
+        self.assertGreater(len(poses), 1)
+        env.close()
+
+
+class TestReplayController(unittest.TestCase):
+    def test_replays_recorded_episodes(self):
+        recorder = RecordingController(SyntheticController(num_objects=5))
+        episodes = [run_actions(recorder, ['MoveAhead', 'RotateLeft']),
+                    run_actions(recorder, ['RotateRight'])]
+        with tempfile.TemporaryDirectory() as directory:
+            archive_path = os.path.join(directory, 'recording.npz')
+            recorder.save(archive_path)
+            controller = ReplayController(archive_path)
+        for _ in range(2):  # episodes are replayed cyclically
+            for episode in episodes:
+                # actions are ignored and the last event is repeated at the end of the episode
+                replayed = run_actions(controller, ['MoveBack'] * len(episode))
+                for event, replayed_event in zip(episode + [episode[-1]], replayed):
+                    np.testing.assert_array_equal(replayed_event.frame, event.frame)
+                    self.assertEqual(replayed_event.metadata['agent'], event.metadata['agent'])
+                    self.assertEqual(len(replayed_event.metadata['objects']),
+                                     len(event.metadata['objects']))
+
+    def test_env_runs_on_recording(self):
+        env = AI2ThorEnv(config_file='config_files/rainbow_synthetic.json')
+        env.controller = RecordingController(env.controller)
+        env.reset()
+        for _ in range(10):
+            env.step(env.action_space.sample(), verbose=False)
+        with tempfile.TemporaryDirectory() as directory:
+            archive_path = os.path.join(directory, 'recording.npz')
+            env.controller.save(archive_path)
+            replay_env = AI2ThorEnv(config_file='config_files/rainbow_synthetic.json',
+                                    config_dict={'controller': {'type': 'replay',
+                                                                'archive_path': archive_path}})
+        recorded = env.controller.frames
+        np.testing.assert_array_equal(replay_env.reset(), env.preprocess(recorded[0]))
+        for frame in recorded[1:]:
+            state, _, _, _ = replay_env.step(0, verbose=False)
+            np.testing.assert_array_equal(state, env.preprocess(frame))
+
+
+class TestVisibleObjectIndex(unittest.TestCase):
+    """
+    Interaction resolution of AI2ThorEnv.step with the lazily built visible object index
+    """
+    def setUp(self):
+        self.env = AI2ThorEnv(config_dict={
+            'controller': {'type': 'synthetic', 'num_objects': 300, 'visibility_distance': 10},
+            'pickup_objects': ['Mug', 'Apple', 'Book'],
+            'acceptable_receptacles': ['CounterTop', 'TableTop', 'Sink', 'Fridge'],
+            'openable_objects': ['Microwave', 'Fridge']})
+        self.env.reset()
+
+    def tearDown(self):
+        self.env.close()
+
+    def test_index_matches_full_scan(self):
+        object_index = {bucket: self.env.get_visible_objects(bucket) for bucket in
+                        ['pickupables', 'receptacles', 'open_openables', 'closed_openables']}
+        objects = [obj for obj in self.env.event.metadata['objects'] if obj['visible']]
+        config = self.env.config
+        self.assertEqual(object_index['pickupables'],
+                         [obj for obj in objects if obj['pickupable'] and
+                          obj['objectType'] in config['pickup_objects']])
+        self.assertEqual(object_index['receptacles'],
+                         [obj for obj in objects if obj['receptacle'] and
+                          obj['objectType'] in config['acceptable_receptacles']])
+        self.assertEqual(object_index['closed_openables'],
+                         [obj for obj in objects if obj['openable'] and not obj['isOpen'] and
+                          obj['objectType'] in config['openable_objects']])
+        self.assertEqual(object_index['open_openables'], [])
+        self.assertGreater(len(object_index['pickupables']), 1)
+
+    def test_interactions_pick_nearest_object(self):
+        nearest = min(self.env.get_visible_objects('pickupables'),
+                      key=lambda obj: obj['distance'])
+        self.env.step(self.env.action_names.index('PickupObject'), verbose=False)
+        self.assertEqual(self.env.event.metadata['lastObjectPickedUp']['objectId'],
+                         nearest['objectId'])
+        self.assertEqual(self.env.event.metadata['inventoryObjects'][0]['objectId'],
+                         nearest['objectId'])
+        nearest = min(self.env.get_visible_objects('closed_openables'),
+                      key=lambda obj: obj['distance'])
+        self.env.step(self.env.action_names.index('OpenObject'), verbose=False)
+        self.assertEqual(self.env.event.metadata['lastObjectOpened']['objectId'],
+                         nearest['objectId'])
+        self.assertIn(nearest['objectId'], [obj['objectId'] for obj in
+                                            self.env.get_visible_objects('open_openables')])
+
+    def test_index_is_not_built_for_movement(self):
+        self.env.step(self.env.action_names.index('MoveAhead'), verbose=False)
+        self.env.step(self.env.action_names.index('RotateLeft'), verbose=False)
+        self.assertIsNone(self.env.object_index_event)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Tests related to the image preprocessing backends of the ai2thor environment wrapper.
+"""
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from gym_ai2thor import image_processing
+from gym_ai2thor.image_processing import fast_preprocess, skimage_preprocess
+
+
+def smooth_frame(height=300, width=300):
+    """
+    Smooth RGB frame so that the anti-aliasing differences between backends stay small
+    """
+    y, x = np.meshgrid(np.linspace(0, 1, height), np.linspace(0, 1, width), indexing='ij')
+    frame = np.stack([x, y, 0.5 + 0.5 * np.sin(4 * np.pi * x * y)], axis=2)
+    return (frame * 255).astype(np.uint8)
+
+
+class TestPreprocessBackends(unittest.TestCase):
+    def test_fast_within_tolerance_of_skimage(self):
+        frame = smooth_frame()
+        for resolution in [(64, 64), (84, 84), (128, 128)]:
+            for grayscale in [True, False]:
+                expected = skimage_preprocess(frame, resolution, grayscale)
+                state = fast_preprocess(frame, resolution, grayscale)
+                self.assertEqual(state.dtype, np.uint8)
+                self.assertEqual(state.shape, expected.shape)
+                difference = np.abs(state / 255 - expected)
+                self.assertLess(difference.mean(), 0.01)
+                self.assertLess(difference.max(), 0.05)
+
+    def test_numpy_fallback_matches_opencv(self):
+        if not image_processing.cv2_installed:
+            self.skipTest('OpenCV not installed')
+        frame = np.random.RandomState(0).randint(0, 256, (300, 300, 3), dtype=np.uint8)
+        for resolution in [(64, 64), (84, 84), (128, 96)]:
+            opencv_state = fast_preprocess(frame, resolution, grayscale=False)
+            with mock.patch.object(image_processing, 'cv2_installed', False):
+                numpy_state = fast_preprocess(frame, resolution, grayscale=False)
+            self.assertLessEqual(np.abs(opencv_state.astype(int) - numpy_state).max(), 1)
+
+    def test_out_buffer(self):
+        frame = smooth_frame()
+        for channels, grayscale in [(1, True), (3, False)]:
+            out = np.zeros((channels, 84, 84), dtype=np.uint8)
+            state = fast_preprocess(frame, (84, 84), grayscale, out=out)
+            self.assertIs(state, out)
+            np.testing.assert_array_equal(out, fast_preprocess(frame, (84, 84), grayscale))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,619 @@
+"""
+Tests related to the Rainbow agent, replay memory and frame stacking wrapper.
+"""
+import argparse
+from collections import deque
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+
+from algorithms.rainbow import apex
+from algorithms.rainbow.agent import Agent
+from algorithms.rainbow.checkpoint import checkpoint_exists, load_checkpoint, save_checkpoint
+from algorithms.rainbow.env import FrameRingBuffer, FrameStackEnv, VectorFrameStackEnv
+from algorithms.rainbow.memory import PrefetchSampler, ReplayMemory, SegmentTree
+from algorithms.rainbow.model import RainbowDQN
+from algorithms.rainbow.test import ParallelEvaluator
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+from tests.test_vector_env import FakeController
+
+
+def make_args(**kwargs):
+    """
+    Default Rainbow arguments (as in algorithms/rainbow/main.py) for small 64x64 grayscale states
+    """
+    args = dict(device=torch.device('cpu'), resolution=(64, 64), img_channels=1, history_length=4,
+                hidden_size=64, noisy_std=0.1, num_atoms=51, V_min=-10, V_max=10, model_path=None,
+                inference_mode='none', priority_exponent=0.5, priority_weight=0.4, multi_step=3,
+                discount=0.99, lr=1e-4, adam_eps=1.5e-4, batch_size=32)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def fill_memory(mem, args, num_steps, episode_length=50, seed=0):
+    """
+    Appends num_steps transitions with random uint8 frames and episodes of episode_length steps
+    :return: (frames, actions, rewards) appended
+    """
+    random_state = np.random.RandomState(seed)
+    frames = random_state.randint(0, 256, (num_steps, args.img_channels) + tuple(args.resolution),
+                                  dtype=np.uint8)
+    actions = random_state.randint(0, 4, num_steps)
+    rewards = random_state.randn(num_steps).astype(np.float32)
+    for step in range(num_steps):
+        terminal = (step + 1) % episode_length == 0
+        mem.append(torch.from_numpy(frames[step]), actions[step], rewards[step], terminal)
+    return frames, actions, rewards
+
+
+def expected_sample(args, idx, frames, rewards, episode_length):
+    """
+    Reference (state, return, next_state, nonterminal) of the transition at data index idx of a
+    memory filled with fill_memory (without wrapping around), where frames outside of the episode
+    are blank
+    """
+    start = idx - idx % episode_length
+    end = start + episode_length - 1
+
+    def stack(last):
+        return np.concatenate([frames[j] if start <= j <= end else np.zeros_like(frames[0])
+                               for j in range(last - args.history_length + 1, last + 1)], 0)
+
+    R = sum(args.discount ** n * rewards[idx + n]
+            for n in range(args.multi_step) if idx + n <= end)
+    return stack(idx), R, stack(idx + args.multi_step), float(idx + args.multi_step < end)
+
+
+class TestObservationDtype(unittest.TestCase):
+    """
+    uint8 states from the env to the replay memory and normalisation inside the model
+    """
+    @mock.patch('ai2thor.controller.Controller', FakeController)
+    def test_env_and_frame_stack_uint8(self):
+        env = AI2ThorEnv(config_dict={'observation_dtype': 'uint8', 'resolution': [64, 64]})
+        self.assertEqual(env.reset().dtype, np.uint8)
+        env = FrameStackEnv(env, 4, torch.device('cpu'))
+        state = env.reset()
+        self.assertEqual(state.dtype, torch.uint8)
+        state, _, _, _ = env.step(0)
+        self.assertEqual(state.shape, (4, 64, 64))
+        self.assertEqual(state[-1, 0, 0].item(), 1)  # stand-in frame value after one step
+        # float32 stacking of a uint8 env
+        env = FrameStackEnv(env.env, 4, torch.device('cpu'), observation_dtype='float32')
+        self.assertEqual(env.reset().dtype, torch.float32)
+
+    def test_model_normalises_uint8(self):
+        args = make_args()
+        model = RainbowDQN(args, mock.Mock(n=4))
+        model.eval()
+        states = torch.randint(0, 256, (8, 4, 64, 64), dtype=torch.uint8)
+        with torch.no_grad():
+            torch.testing.assert_close(model(states), model(states.float() / 255))
+
+    def test_memory_stores_uint8_and_float_states_equally(self):
+        args = make_args()
+        mem_uint8, mem_float = ReplayMemory(args, 100), ReplayMemory(args, 100)
+        state = torch.randint(0, 256, (4, 64, 64), dtype=torch.uint8)
+        mem_uint8.append(state, 0, 0., False)
+        mem_float.append(state.float() / 255 + 1e-4, 0, 0., False)
+        np.testing.assert_array_equal(mem_uint8.states[0], mem_float.states[0])
+
+
+def reference_stacks(frames, dones, num_frames):
+    """
+    Stacked states of the original deque-based FrameStackEnv for frames[0] returned by reset and
+    frames[1:] by steps, where dones[t] means that frames[t] is the first frame of a new episode
+    """
+    states = []
+    for t, frame in enumerate(frames):
+        if t == 0 or dones[t]:
+            stack = deque([frame] * num_frames, maxlen=num_frames)
+        else:
+            stack.append(frame)
+        states.append(np.concatenate(list(stack), 0))
+    return states
+
+
+class TestFrameStack(unittest.TestCase):
+    def test_ring_buffer_matches_deque_stacking(self):
+        random_state = np.random.RandomState(0)
+        for num_frames in [1, 4, 8]:
+            frames = random_state.randint(0, 256, (100, 1, 8, 8), dtype=np.uint8)
+            dones = random_state.uniform(size=100) < 0.05
+            expected = reference_stacks(frames, dones, num_frames)
+            frame_buffer = FrameRingBuffer(num_frames, (1, 8, 8), torch.uint8,
+                                           torch.device('cpu'))
+            previous_state = frame_buffer.reset(frames[0])
+            for t in range(1, len(frames)):
+                state = frame_buffer.reset(frames[t]) if dones[t] else \
+                    frame_buffer.append(frames[t])
+                np.testing.assert_array_equal(state.numpy(), expected[t])
+                if not dones[t]:
+                    # the state of the previous step is still valid after one step
+                    np.testing.assert_array_equal(previous_state.numpy(), expected[t - 1])
+                previous_state = state
+
+    def test_float_conversion_and_copies(self):
+        frames = np.random.RandomState(0).randint(0, 256, (20, 1, 4, 4), dtype=np.uint8)
+        frame_buffer = FrameRingBuffer(4, (1, 4, 4), torch.float32, torch.device('cpu'),
+                                       copy_states=True)
+        states = [frame_buffer.reset(frames[0])] + \
+            [frame_buffer.append(frame) for frame in frames[1:]]
+        for state, expected_state in zip(states, reference_stacks(frames, [False] * 20, 4)):
+            torch.testing.assert_close(state, torch.from_numpy(expected_state).float() / 255)
+
+    def test_vector_frame_stack(self):
+        num_envs, num_frames, num_steps = 3, 4, 60
+        random_state = np.random.RandomState(0)
+        frames = random_state.randint(0, 256, (num_steps, num_envs, 1, 8, 8), dtype=np.uint8)
+        dones = random_state.uniform(size=(num_steps, num_envs)) < 0.1
+        # Vector env stand-in returning the frames above (and auto-reset when done)
+        venv = mock.Mock(num_envs=num_envs, config={}, observations_dtype=np.dtype(np.uint8),
+                         observation_space=mock.Mock(shape=(1, 8, 8)))
+        venv.reset.return_value = frames[0]
+        venv.step_wait.side_effect = [(frames[t], np.zeros(num_envs), dones[t],
+                                       [{}] * num_envs) for t in range(1, num_steps)]
+        env = VectorFrameStackEnv(venv, num_frames, torch.device('cpu'))
+        states = [env.reset().clone()] + \
+            [env.step([0] * num_envs)[0].clone() for _ in range(1, num_steps)]
+        for i in range(num_envs):
+            expected = reference_stacks(frames[:, i], dones[:, i], num_frames)
+            for state, expected_state in zip(states, expected):
+                np.testing.assert_array_equal(state[i].numpy(), expected_state)
+
+
+class TestSegmentTree(unittest.TestCase):
+    def test_find_batch_matches_find(self):
+        random_state = np.random.RandomState(0)
+        for size in [2, 7, 64, 1000]:
+            tree = SegmentTree(size)
+            for priority in random_state.uniform(0, 2, size):
+                tree.append(priority)
+            values = random_state.uniform(0, tree.total(), 100)
+            probs, data_idxs, tree_idxs = tree.find_batch(values)
+            for i, value in enumerate(values):
+                prob, data_idx, tree_idx = tree.find(value)
+                self.assertEqual((prob, data_idx, tree_idx),
+                                 (probs[i], data_idxs[i], tree_idxs[i]))
+
+    def test_update_batch_matches_update(self):
+        random_state = np.random.RandomState(0)
+        for size in [1, 2, 7, 64, 1000]:
+            scalar_tree, batch_tree = SegmentTree(size), SegmentTree(size)
+            for priority in random_state.uniform(0, 2, size // 2 + 1):
+                scalar_tree.append(priority)
+                batch_tree.append(priority)
+            for _ in range(10):
+                # tree indices of written leaves (with repetitions, the last value is kept)
+                indices = random_state.randint(0, size // 2 + 1, 32) + size - 1
+                values = random_state.uniform(0, 2, 32).astype(np.float32)
+                values[0] = 0
+                for index, value in zip(indices, values):
+                    scalar_tree.update(index, value)
+                batch_tree.update_batch(indices, values)
+                np.testing.assert_allclose(batch_tree.sum_tree, scalar_tree.sum_tree, rtol=1e-5)
+                np.testing.assert_array_equal(batch_tree.min_tree, scalar_tree.min_tree)
+                self.assertEqual(batch_tree.max, scalar_tree.max)
+                leaves = scalar_tree.sum_tree[size - 1:]
+                self.assertEqual(scalar_tree.min(), leaves[leaves > 0].min())
+
+
+class TestReplayMemory(unittest.TestCase):
+    def test_sample_matches_stored_transitions(self):
+        args = make_args()
+        episode_length = 20
+        mem = ReplayMemory(args, 1000)
+        frames, actions, rewards = fill_memory(mem, args, 300, episode_length=episode_length)
+        for _ in range(5):
+            tree_idxs, states, sampled_actions, returns, next_states, nonterminals, weights = \
+                mem.sample(args.batch_size)
+            for i, tree_idx in enumerate(tree_idxs):
+                idx = tree_idx - mem.capacity + 1
+                state, R, next_state, nonterminal = expected_sample(args, idx, frames, rewards,
+                                                                    episode_length)
+                np.testing.assert_array_equal(states[i].numpy(), state)
+                np.testing.assert_array_equal(next_states[i].numpy(), next_state)
+                self.assertEqual(sampled_actions[i].item(), actions[idx])
+                self.assertAlmostEqual(returns[i].item(), R, places=5)
+                self.assertEqual(nonterminals[i].item(), nonterminal)
+            self.assertTrue(torch.all(weights <= 1))
+
+    def test_prefetch_sampler(self):
+        """
+        Checks that prefetched batches can be learnt from and that the priorities of transitions
+        overwritten after their batch was sampled are not updated
+        """
+        args = make_args()
+        mem = ReplayMemory(args, 200)
+        fill_memory(mem, args, 200)
+        sampler = PrefetchSampler(mem, args.batch_size, queue_depth=2)
+        try:
+            dqn = Agent(args, mock.Mock(action_space=mock.Mock(n=4)))
+            dqn.learn(sampler)
+            tree_idxs = sampler.sample(args.batch_size)[0]
+            for _ in range(50):
+                sampler.append(torch.zeros(1, 64, 64, dtype=torch.uint8), 0, 0., False)
+            sampler.update_priorities(tree_idxs, np.full(args.batch_size, 4.))
+            # the memory was full so the 50 appends overwrote the first 50 transitions
+            overwritten = tree_idxs - mem.capacity + 1 < 50
+            updated = mem.transitions.sum_tree[tree_idxs] == 4. ** args.priority_exponent
+            np.testing.assert_array_equal(updated, ~overwritten)
+        finally:
+            sampler.close()
+
+    def test_prefetch_sampler_raises_sampling_errors(self):
+        """ Checks that an error raised in the prefetch thread is raised by sample """
+        args = make_args()
+        mem = ReplayMemory(args, 200)
+        fill_memory(mem, args, 200)
+        sampler = PrefetchSampler(mem, args.batch_size)
+        try:
+            with mock.patch.object(mem, 'sample', side_effect=ValueError('sampling failed')):
+                with self.assertRaisesRegex(ValueError, 'sampling failed'):
+                    sampler.sample(args.batch_size)
+        finally:
+            sampler.close()
+
+    def test_validation_iterator(self):
+        args = make_args()
+        episode_length = 10
+        mem = ReplayMemory(args, 100)
+        frames, _, rewards = fill_memory(mem, args, 100, episode_length=episode_length)
+        for idx, state in enumerate(mem):
+            if idx >= args.history_length:  # the first states wrap around the cyclic buffer
+                expected_state, _, _, _ = expected_sample(args, idx, frames, rewards,
+                                                          episode_length)
+                np.testing.assert_array_equal(state.numpy(), expected_state)
+
+    def test_state_batches_match_iterator(self):
+        args = make_args()
+        mem = ReplayMemory(args, 100)
+        fill_memory(mem, args, 130, episode_length=7)  # wraps around the cyclic buffer
+        batches = list(mem.state_batches(32))
+        self.assertEqual([len(batch) for batch in batches], [32, 32, 32, 4])
+        np.testing.assert_array_equal(torch.cat(batches).numpy(),
+                                      torch.stack(list(mem)).numpy())
+        # The cached states are rebuilt after appending
+        fill_memory(mem, args, 10, seed=1)
+        np.testing.assert_array_equal(torch.cat(list(mem.state_batches(64))).numpy(),
+                                      torch.stack(list(mem)).numpy())
+
+    def test_memory_mapped_frames_reopen(self):
+        args = make_args()
+        episode_length = 20
+        with tempfile.TemporaryDirectory() as directory:
+            frames_file = os.path.join(directory, 'frames.uint8')
+            mem = ReplayMemory(args, 1000, frames_file=frames_file)
+            self.assertIsInstance(mem.states, np.memmap)
+            frames, actions, rewards = fill_memory(mem, args, 300, episode_length=episode_length)
+            mem.update_priorities(np.arange(10) + mem.capacity - 1, np.full(10, 3.))
+            mem.flush()
+            self.assertEqual(os.path.getsize(frames_file), 1000 * 64 * 64)
+
+            reopened = ReplayMemory(args, 1000, frames_file=frames_file)
+            np.testing.assert_array_equal(reopened.states[:300], frames)
+            np.testing.assert_array_equal(reopened.actions, mem.actions)
+            np.testing.assert_array_equal(reopened.transitions.sum_tree, mem.transitions.sum_tree)
+            self.assertEqual((reopened.transitions.index, reopened.t, reopened.num_appends),
+                             (300, 0, 300))
+            tree_idxs, states, _, returns, next_states, _, _ = reopened.sample(args.batch_size)
+            for i, tree_idx in enumerate(tree_idxs):
+                idx = tree_idx - mem.capacity + 1
+                state, R, next_state, _ = expected_sample(args, idx, frames, rewards,
+                                                          episode_length)
+                np.testing.assert_array_equal(states[i].numpy(), state)
+                np.testing.assert_array_equal(next_states[i].numpy(), next_state)
+                self.assertAlmostEqual(returns[i].item(), R, places=5)
+            with self.assertRaises(ValueError):
+                ReplayMemory(args, 500, frames_file=frames_file)
+
+    def test_compressed_frames_match_raw_frames(self):
+        args = make_args()
+        raw_mem = ReplayMemory(args, 100)
+        fill_memory(raw_mem, args, 230, episode_length=7)  # wraps around the cyclic buffer
+        for keyframe_interval in (1, 4):
+            mem = ReplayMemory(args, 100, frame_compression='zlib',
+                               keyframe_interval=keyframe_interval)
+            fill_memory(mem, args, 230, episode_length=7)
+            np.testing.assert_array_equal(mem.states[:], raw_mem.states)
+            np.testing.assert_array_equal(mem.states[[5, 3]], raw_mem.states[[5, 3]])
+            self.assertEqual(mem.states.chain_lengths.max(), keyframe_interval - 1)
+            # 8 segments of 12.5 transitions (all the priorities are equal) are wider than the
+            # history + multi_step invalid transitions around the index
+            np.random.seed(0)
+            expected_batch = raw_mem.sample(8)
+            np.random.seed(0)
+            for tensor, expected_tensor in zip(mem.sample(8), expected_batch):
+                np.testing.assert_array_equal(np.asarray(tensor), np.asarray(expected_tensor))
+            np.testing.assert_array_equal(torch.cat(list(mem.state_batches(32))).numpy(),
+                                          torch.cat(list(raw_mem.state_batches(32))).numpy())
+            with tempfile.TemporaryDirectory() as directory:
+                mem.save_checkpoint(directory)
+                restored = ReplayMemory(args, 100)
+                restored.load_checkpoint(directory)
+                np.testing.assert_array_equal(restored.states, raw_mem.states)
+
+    def test_compressed_append_cost_does_not_depend_on_capacity(self):
+        args = make_args(resolution=(8, 8))
+        frame = torch.zeros(1, 8, 8, dtype=torch.uint8)
+        seconds_per_append = []
+        for capacity in (1000, 1000000):
+            mem = ReplayMemory(args, capacity, frame_compression='zlib')
+            mem.append(frame, 0, 0., False)  # warm up
+            start = time.perf_counter()
+            for _ in range(200):
+                mem.append(frame, 0, 0., False)
+            seconds_per_append.append((time.perf_counter() - start) / 200)
+        # indexing an arange of the capacity made appends ~30x slower with 1000x the capacity
+        self.assertLess(seconds_per_append[1], 5 * seconds_per_append[0])
+
+    def test_sampling_fails_without_valid_transitions(self):
+        args = make_args()
+        mem = ReplayMemory(args, 100)
+        fill_memory(mem, args, 230, episode_length=7)
+        # With 32 segments of ~3 transitions, one lies within the invalid transitions around the
+        # index
+        with self.assertRaises(ValueError):
+            mem.sample(32)
+
+    def test_compressed_deltas_survive_overwrites(self):
+        """ Overwriting the keyframe of a chain of deltas keeps the rest of the chain readable """
+        args = make_args()
+        mem = ReplayMemory(args, 10, frame_compression='zlib', keyframe_interval=10)
+        frames, _, _ = fill_memory(mem, args, 10, episode_length=10)
+        self.assertEqual(list(mem.states.chain_lengths), list(range(10)))
+        new_frames, _, _ = fill_memory(mem, args, 3, episode_length=10, seed=1)
+        np.testing.assert_array_equal(mem.states[:3], new_frames)
+        np.testing.assert_array_equal(mem.states[3:], frames[3:])
+        self.assertEqual(mem.states.chain_lengths[3], 0)
+
+    def assert_memories_equal(self, mem, expected_mem):
+        np.testing.assert_array_equal(mem.states, expected_mem.states)
+        for name, value in expected_mem.metadata().items():
+            np.testing.assert_array_equal(mem.metadata()[name], value)
+
+    def test_checkpoint_round_trip(self):
+        args = make_args()
+        with tempfile.TemporaryDirectory() as directory:
+            mem = ReplayMemory(args, 200)
+            fill_memory(mem, args, 150, episode_length=30)
+            mem.priority_weight = 0.7
+            mem.save_checkpoint(directory)
+            restored = ReplayMemory(args, 200)
+            restored.load_checkpoint(directory)
+            self.assert_memories_equal(restored, mem)
+
+            # The second checkpoint wraps around the cyclic buffer
+            fill_memory(mem, args, 80, episode_length=30, seed=1)
+            mem.update_priorities(np.arange(20) + mem.capacity - 1, np.full(20, 2.))
+            mem.save_checkpoint(directory)
+            restored = ReplayMemory(args, 200)
+            restored.load_checkpoint(directory)
+            self.assert_memories_equal(restored, mem)
+            self.assertTrue(restored.transitions.full)
+            np.random.seed(0)
+            expected_batch = mem.sample(args.batch_size)
+            np.random.seed(0)
+            for tensor, expected_tensor in zip(restored.sample(args.batch_size),
+                                               expected_batch):
+                np.testing.assert_array_equal(np.asarray(tensor), np.asarray(expected_tensor))
+
+    def test_incremental_checkpoint_writes_new_slots(self):
+        args = make_args()
+        with tempfile.TemporaryDirectory() as directory:
+            mem = ReplayMemory(args, 100)
+            fill_memory(mem, args, 40)
+            mem.save_checkpoint(directory)
+            fill_memory(mem, args, 10, seed=1)
+            # Frames changed behind the back of the memory are not written again
+            mem.states[:40] = 0
+            mem.save_checkpoint(directory)
+            restored = ReplayMemory(args, 100)
+            restored.load_checkpoint(directory)
+            self.assertTrue(restored.states[:40].any())
+            np.testing.assert_array_equal(restored.states[40:50], mem.states[40:50])
+
+
+class TestAgent(unittest.TestCase):
+    def test_learn_on_uint8_batches(self):
+        args = make_args()
+        mem = ReplayMemory(args, 1000)
+        fill_memory(mem, args, 200)
+        dqn = Agent(args, mock.Mock(action_space=mock.Mock(n=4)))
+        _, states, _, _, next_states, _, _ = mem.sample(args.batch_size)
+        self.assertEqual(states.dtype, torch.uint8)
+        self.assertEqual(next_states.shape, (args.batch_size, 4, 64, 64))
+        dqn.learn(mem)
+
+    def test_batched_inference_matches_single_states(self):
+        states = torch.randint(0, 256, (6, 4, 64, 64), dtype=torch.uint8)
+        for inference_mode in ['none', 'eager', 'script', 'trace']:
+            dqn = Agent(make_args(inference_mode=inference_mode),
+                        mock.Mock(action_space=mock.Mock(n=4)))
+            dqn.eval()
+            with torch.no_grad():
+                expected_q = (dqn.online_net(states) * dqn.support).sum(2)
+            torch.testing.assert_close(dqn.evaluate_q_batch(states), expected_q.max(1)[0])
+            np.testing.assert_array_equal(dqn.act_batch(states).numpy(),
+                                          expected_q.argmax(1).numpy())
+            for state, q in zip(states, expected_q):
+                self.assertAlmostEqual(dqn.evaluate_q(state), q.max().item(), places=4)
+                self.assertEqual(dqn.act(state), q.argmax().item())
+
+    def test_q_value_net_uses_current_weights(self):
+        dqn = Agent(make_args(inference_mode='script'), mock.Mock(action_space=mock.Mock(n=4)))
+        states = torch.randint(0, 256, (4, 4, 64, 64), dtype=torch.uint8)
+        dqn.eval()
+        q_before = dqn.evaluate_q_batch(states)
+        dqn.train()
+        with torch.no_grad():
+            dqn.online_net.fc_z_v.bias_mu[0] += 5.  # more probability mass on V_min
+        dqn.eval()
+        self.assertFalse(torch.allclose(dqn.evaluate_q_batch(states), q_before))
+
+    def test_training_checkpoint_round_trip(self):
+        args = make_args()
+        env = mock.Mock(action_space=mock.Mock(n=4))
+        dqn = Agent(args, env)
+        mem, val_mem = ReplayMemory(args, 200), ReplayMemory(args, 50)
+        fill_memory(mem, args, 200)
+        fill_memory(val_mem, args, 50, seed=1)
+        for _ in range(3):
+            dqn.learn(mem)
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertFalse(checkpoint_exists(directory))
+            save_checkpoint(directory, 1234, dqn, mem, val_mem)
+            self.assertTrue(checkpoint_exists(directory))
+            restored_dqn = Agent(args, env)
+            restored_mem, restored_val_mem = ReplayMemory(args, 200), ReplayMemory(args, 50)
+            self.assertEqual(load_checkpoint(directory, restored_dqn, restored_mem,
+                                             restored_val_mem), 1234)
+        for net in ('online_net', 'target_net'):
+            for name, tensor in getattr(dqn, net).state_dict().items():
+                torch.testing.assert_close(getattr(restored_dqn, net).state_dict()[name], tensor)
+        state = dqn.optimiser.state_dict()['state']
+        restored_state = restored_dqn.optimiser.state_dict()['state']
+        self.assertEqual(state.keys(), restored_state.keys())
+        for key in state:
+            for field in ('exp_avg', 'exp_avg_sq'):
+                torch.testing.assert_close(restored_state[key][field], state[key][field])
+        np.testing.assert_array_equal(restored_val_mem.states, val_mem.states)
+        np.testing.assert_array_equal(restored_mem.transitions.sum_tree,
+                                      mem.transitions.sum_tree)
+
+    def test_interrupted_checkpoint_keeps_previous_one(self):
+        args = make_args()
+        env = mock.Mock(action_space=mock.Mock(n=4))
+        dqn = Agent(args, env)
+        mem, val_mem = ReplayMemory(args, 200), ReplayMemory(args, 50)
+        fill_memory(mem, args, 150)
+        fill_memory(val_mem, args, 50, seed=1)
+        with tempfile.TemporaryDirectory() as directory:
+            save_checkpoint(directory, 1, dqn, mem, val_mem)
+            fill_memory(mem, args, 30, seed=2)
+            save_checkpoint(directory, 2, dqn, mem, val_mem)
+            expected_states = mem.states.copy()
+            # The third checkpoint writes the new frames in place into the slot of the first one
+            # and crashes before completing
+            fill_memory(mem, args, 100, seed=3)
+            with mock.patch('torch.save', side_effect=RuntimeError('crash')):
+                with self.assertRaises(RuntimeError):
+                    save_checkpoint(directory, 3, dqn, mem, val_mem)
+            restored_mem, restored_val_mem = ReplayMemory(args, 200), ReplayMemory(args, 50)
+            self.assertEqual(load_checkpoint(directory, Agent(args, env), restored_mem,
+                                             restored_val_mem), 2)
+            np.testing.assert_array_equal(restored_mem.states, expected_states)
+            self.assertEqual(restored_mem.num_appends, 180)
+
+
+@mock.patch('ai2thor.controller.Controller', FakeController)
+class TestParallelEvaluator(unittest.TestCase):
+    def make_evaluator(self, asynchronous):
+        args = make_args(history_length=2, seed=0, config_file='config_files/config_example.json',
+                         evaluation_episodes=5, max_episode_length=100, evaluation_batch_size=16)
+        evaluator = ParallelEvaluator(args, 2, asynchronous=asynchronous,
+                                      config_dict={'max_episode_length': 6,
+                                                   'resolution': [64, 64],
+                                                   'observation_dtype': 'uint8'},
+                                      start_method='fork')
+        dqn = Agent(args, mock.Mock(action_space=evaluator.env.action_space))
+        val_mem = ReplayMemory(args, 40)
+        fill_memory(val_mem, args, 40)
+        return args, evaluator, dqn, val_mem
+
+    def test_episodes_and_validation_q(self):
+        args, evaluator, dqn, val_mem = self.make_evaluator(asynchronous=False)
+        try:
+            with mock.patch('algorithms.rainbow.test.torch.save') as save:
+                avg_reward, avg_Q = evaluator.evaluate(10, dqn, val_mem, evaluate_only=True)
+            save.assert_not_called()
+            self.assertEqual([length for _, length in evaluator.episode_stats], [6] * 5)
+            dqn.eval()
+            expected_Q = torch.cat([dqn.evaluate_q_batch(states)
+                                    for states in val_mem.state_batches(16)]).mean().item()
+            self.assertAlmostEqual(avg_Q, expected_Q, places=4)
+            self.assertAlmostEqual(avg_reward, np.mean([reward for reward, _
+                                                        in evaluator.episode_stats]))
+        finally:
+            evaluator.close()
+
+    def test_asynchronous_evaluation_uses_snapshot(self):
+        args, evaluator, dqn, val_mem = self.make_evaluator(asynchronous=True)
+        try:
+            dqn.eval()
+            expected_Qs = torch.cat([dqn.evaluate_q_batch(states)
+                                     for states in val_mem.state_batches(16)])
+            dqn.train()
+            evaluator.start(10, dqn, val_mem)
+            with torch.no_grad():  # training goes on while evaluating
+                for param in dqn.online_net.parameters():
+                    param.add_(1.)
+            num_steps, step_rewards, step_Qs, state_dict = evaluator.wait()
+            self.assertEqual(num_steps, 10)
+            self.assertEqual(len(step_rewards), args.evaluation_episodes)
+            np.testing.assert_allclose(step_Qs, expected_Qs.numpy(), atol=1e-4)
+            self.assertIsNone(evaluator.poll())
+        finally:
+            evaluator.close()
+
+
+class TestApex(unittest.TestCase):
+    def test_interleaved_chunks_match_actor_transitions(self):
+        """
+        The transitions sent in chunks by two actors to the same memory rebuild the same states,
+        returns and next states as if each actor had appended them to its own memory
+        """
+        args = make_args(batch_size=8)
+        dqn = Agent(args, mock.Mock(action_space=mock.Mock(n=4)))
+        central = ReplayMemory(args, 2000)
+        sent_idxs, sent_positions = [], []
+        actors = []
+        for seed in range(2):
+            actors.append(dict(local=ReplayMemory(args, 2 * (10 + args.history_length +
+                                                             args.multi_step)),
+                               reference=ReplayMemory(args, 1000), num_sent=0,
+                               random_state=np.random.RandomState(seed)))
+        for step in range(300):
+            actor = actors[step % 2]
+            frame = torch.from_numpy(actor['random_state'].randint(0, 256, (1, 64, 64),
+                                                                   dtype=np.uint8))
+            action, reward = actor['random_state'].randint(4), actor['random_state'].randn()
+            done = actor['random_state'].uniform() < 0.05
+            for mem in (actor['local'], actor['reference']):
+                mem.append(frame, action, reward, done)
+            if done or actor['local'].num_appends - actor['num_sent'] >= 10 + args.multi_step:
+                num_sent = actor['num_sent']
+                chunk, actor['num_sent'] = apex.make_chunk(dqn, actor['local'], num_sent, done)
+                ready = chunk['priorities'] > 0
+                sent_idxs.append((central.transitions.index + np.flatnonzero(ready)) %
+                                 central.capacity)
+                sent_positions.append(np.arange(num_sent, actor['num_sent']))
+                self.assertEqual(ready.sum(), len(sent_positions[-1]))
+                central.append_batch(**chunk)
+                batch = central._get_batch(sent_idxs[-1])
+                expected = actor['reference']._get_batch(sent_positions[-1])
+                for tensor, expected_tensor in zip(batch, expected):
+                    torch.testing.assert_close(tensor, expected_tensor)
+        self.assertGreater(len(sent_idxs), 10)
+
+    @mock.patch('ai2thor.controller.Controller', FakeController)
+    def test_run_with_stand_in_controller(self):
+        args = apex.parser.parse_args(['--num-actors', '2', '--learn-start', '50',
+                                       '--batch-size', '8', '--hidden-size', '32',
+                                       '--memory-capacity', '1000', '--max-num-steps', '300',
+                                       '--history-length', '2', '--actor-send-interval', '10',
+                                       '--learner-sync-interval', '5', '--report-interval',
+                                       '100'])
+        args.device = torch.device('cpu')
+        stats = apex.run(args, duration=60, start_method='fork')
+        self.assertGreaterEqual(stats['env_steps'], 300)
+        self.assertGreater(stats['learner_updates'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Tests related to the scheduling of the scenes of multi-scene configs. The SyntheticController
+replaces the Unity process so that these run without a simulator.
+"""
+import unittest
+
+import numpy as np
+
+from gym_ai2thor.envs.ai2thor_env import AI2ThorEnv
+from gym_ai2thor.envs.vector_env import VectorAI2ThorEnv
+from gym_ai2thor.scene_scheduler import SceneScheduler
+
+SCENES = {'FloorPlan1': 2, 'FloorPlan28': 1, 'FloorPlan30': 1}
+
+
+def run_rounds(scheduler, num_envs, num_rounds):
+    """ Assigns the scenes of num_envs envs in turns. Returns the episodes and loads per scene """
+    current_scenes = [None] * num_envs
+    episodes, loads = dict.fromkeys(SCENES, 0), dict.fromkeys(SCENES, 0)
+    random_state = np.random.RandomState(0)
+    for _ in range(num_rounds):
+        for rank in range(num_envs):
+            scene = scheduler.assign(current_scenes[rank], random_state)
+            episodes[scene] += scheduler.episodes_per_scene
+            loads[scene] += scene != current_scenes[rank]
+            current_scenes[rank] = scene
+    return episodes, loads
+
+
+class TestSceneScheduler(unittest.TestCase):
+    def test_scheduled_scenes_match_weights(self):
+        scheduler = SceneScheduler(SCENES, episodes_per_scene=10)
+        episodes, loads = run_rounds(scheduler, num_envs=4, num_rounds=50)
+        total_episodes = sum(episodes.values())
+        for scene, weight in zip(scheduler.scene_names, scheduler.weights):
+            # at most one round per env away from the target share
+            self.assertLessEqual(abs(episodes[scene] - weight * total_episodes), 4 * 10)
+        # envs rarely change scene
+        self.assertLess(sum(loads.values()), 4 * 50 / 4)
+
+    def test_random_sampling_loads_scenes_every_episode(self):
+        scheduler = SceneScheduler(SCENES, episodes_per_scene=10, sampling='random')
+        self.assertEqual(scheduler.episodes_per_scene, 1)
+        episodes, loads = run_rounds(scheduler, num_envs=4, num_rounds=500)
+        self.assertAlmostEqual(episodes['FloorPlan1'] / 2000, 0.5, delta=0.05)
+        self.assertGreater(sum(loads.values()), 2000 / 2)
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(ValueError):
+            SceneScheduler({})
+        with self.assertRaises(ValueError):
+            SceneScheduler({'FloorPlan1': -1, 'FloorPlan28': 1})
+        with self.assertRaises(ValueError):
+            SceneScheduler(SCENES, sampling='round_robin')
+        with self.assertRaises(ValueError):
+            SceneScheduler(SCENES, episodes_per_scene=0)
+        # every reset would reload the scene
+        with self.assertRaises(ValueError):
+            AI2ThorEnv(config_file='config_files/rainbow_synthetic.json',
+                       config_dict={'scenes': SCENES})
+
+    def test_env_keeps_scene_for_episodes_per_scene(self):
+        env = AI2ThorEnv(config_file='config_files/rainbow_synthetic.json',
+                         config_dict={'scenes': SCENES, 'episodes_per_scene': 5,
+                                      'fast_reset': True, 'full_reset_interval': 100})
+        scenes = []
+        for _ in range(20):
+            env.reset()
+            self.assertEqual(env.event.metadata['sceneName'], env.scene_id)
+            scenes.append(env.scene_id)
+        for round_start in range(0, 20, 5):
+            self.assertEqual(len(set(scenes[round_start:round_start + 5])), 1)
+        stats = env.scene_scheduler.stats()
+        self.assertEqual(sum(scene['episodes'] for scene in stats.values()), 20)
+        self.assertEqual(sum(scene['scene_loads'] for scene in stats.values()),
+                         env.num_scene_loads)
+        self.assertLessEqual(env.num_scene_loads, 4)
+        env.close()
+
+    def test_vector_env_workers_share_scheduler(self):
+        env = VectorAI2ThorEnv(2, config_file='config_files/rainbow_synthetic.json',
+                               config_dict={'scenes': {'FloorPlan1': 1, 'FloorPlan28': 1},
+                                            'fast_reset': True},
+                               start_method='fork')
+        try:
+            env.reset()
+            stats = env.scene_scheduler.stats()
+            # the second worker is assigned the scene the first one did not get
+            self.assertEqual(stats['FloorPlan1']['episodes'], 1)
+            self.assertEqual(stats['FloorPlan28']['episodes'], 1)
+        finally:
+            env.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Tests related to the vectorized ai2thor environment wrapper. A stand-in controller replaces the
+Unity process so that these run without a simulator.
+"""
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from gym_ai2thor.envs.vector_env import VectorAI2ThorEnv, WorkerError
+
+
+class FakeEvent:
+    def __init__(self, frame, metadata):
+        self.frame = frame
+        self.metadata = metadata
+
+
+class FakeController:
+    """
+    Minimal stand-in for ai2thor.controller.Controller which returns a frame depending only on the
+    number of steps taken since the last reset
+    """
+    def __init__(self):
+        self.step_num = 0
+
+    def start(self):
+        pass
+
+    def reset(self, scene_id):
+        self.step_num = 0
+
+    def step(self, action):
+        self.step_num = 0 if action['action'] == 'Initialize' else self.step_num + 1
+        frame = np.full((300, 300, 3), self.step_num % 256, dtype=np.uint8)
+        return FakeEvent(frame, {'objects': [], 'inventoryObjects': [],
+                                 'lastAction': action['action']})
+
+    def stop(self):
+        pass
+
+
+@mock.patch('ai2thor.controller.Controller', FakeController)
+class TestVectorAI2ThorEnv(unittest.TestCase):
+    """
+    Batched step/reset tests
+    """
+    def test_step_shapes_and_shared_observations(self):
+        num_envs = 3
+        env = VectorAI2ThorEnv(num_envs, config_dict={'max_episode_length': 5},
+                               start_method='fork')
+        try:
+            observations = env.reset()
+            self.assertEqual(observations.shape, (num_envs,) + env.observation_space.shape)
+            for step_num in range(1, 3):
+                observations, rewards, dones, infos = env.step([0] * num_envs)
+                self.assertEqual(observations.shape, env.observations.shape)
+                self.assertEqual(rewards.shape, (num_envs,))
+                self.assertFalse(dones.any())
+                self.assertEqual(len(infos), num_envs)
+                # frames of the stand-in controller only depend on the step number
+                np.testing.assert_allclose(observations, step_num / 255, atol=1e-5)
+        finally:
+            env.close()
+
+    def test_auto_reset(self):
+        """
+        Checks that episodes are reset by the worker when done and that the terminal observation
+        is returned in the info dict
+        """
+        max_episode_length = 4
+        env = VectorAI2ThorEnv(2, config_dict={'max_episode_length': max_episode_length},
+                               start_method='fork')
+        try:
+            env.reset()
+            for _ in range(max_episode_length):
+                observations, _, dones, infos = env.step([0, 1])
+            self.assertTrue(dones.all())
+            for info in infos:
+                np.testing.assert_allclose(info['terminal_observation'],
+                                           max_episode_length / 255, atol=1e-5)
+            np.testing.assert_allclose(observations, 0)
+        finally:
+            env.close()
+
+    def test_worker_exception_is_raised(self):
+        """
+        Checks that an exception raised in a worker is sent back and raised by step
+        """
+        env = VectorAI2ThorEnv(2, start_method='fork')
+        try:
+            env.reset()
+            with self.assertRaisesRegex(WorkerError, 'InvalidAction'):
+                env.step([0, env.action_space.n])
+        finally:
+            env.close()
+
+    def test_dead_worker_is_detected(self):
+        """
+        Checks that step raises instead of waiting forever when a worker process died
+        """
+        env = VectorAI2ThorEnv(2, start_method='fork')
+        env.poll_interval = 0.01
+        try:
+            env.reset()
+            env.processes[1].kill()
+            env.processes[1].join()
+            with self.assertRaisesRegex(WorkerError, 'worker 1 died'):
+                env.step([0, 0])
+        finally:
+            env.close()
+
+
+if __name__ == '__main__':
+    unittest.main()